@@ -0,0 +1,144 @@
+import json
+import socket
+import threading
+
+import capture
+import memstats
+import metrics
+import tracing
+from server_state import clients
+from protocol import FrameReader, encode
+
+ADMIN_HOST = "127.0.0.1"  # Local only: never expose on a public interface
+ADMIN_PORT = 5050
+
+
+def stats_command(msg):
+    return {"type": "stats", "metrics": metrics.snapshot()}
+
+
+def trace_command(msg):
+    """{"type": "trace", "enabled": true|false} switches per-message tracing"""
+    if "enabled" in msg:
+        tracing.set_enabled(msg["enabled"])
+    return {"type": "trace", "enabled": tracing.enabled}
+
+
+def traces_command(msg):
+    """{"type": "traces", "limit": N} returns the most recent finished traces"""
+    limit = int(msg.get("limit", 100))
+    return {"type": "traces", "traces": list(tracing.recent)[-limit:]}
+
+
+def profile_command(msg):
+    """{"type": "profile", "seconds": S, "interval_ms": I} samples all threads"""
+    seconds = float(msg.get("seconds", 10))
+    interval = float(msg.get("interval_ms", 5)) / 1000
+    path = tracing.start_profile(seconds, interval)
+    if path is None:
+        return {"type": "error", "message": "A profile is already running"}
+    return {"type": "profile", "path": path, "seconds": seconds}
+
+
+def capture_command(msg):
+    """{"type": "capture", "path": P} starts capturing traffic to P,
+    {"type": "capture", "path": null} stops; without "path" reports status"""
+    if "path" in msg:
+        if msg["path"]:
+            capture.start(msg["path"])
+        else:
+            stopped = capture.stop()
+            if stopped:
+                return {"type": "capture", "path": None, "stopped": stopped[0], "events": stopped[1]}
+    active = capture.active
+    return {"type": "capture", "path": active and active.path, "events": active and active.count}
+
+
+def memory_command(msg):
+    """{"type": "memory", "top": N} reports RSS, traced memory (with the top
+    N allocation sites), threads, fds and registered clients"""
+    return {"type": "memory", **memstats.snapshot(int(msg.get("top", memstats.TOP_ALLOCATORS))),
+            "clients": len(clients)}
+
+
+# Commands accepted as JSON lines, e.g. {"type": "stats"}
+COMMANDS = {
+    "stats": stats_command,
+    "trace": trace_command,
+    "traces": traces_command,
+    "profile": profile_command,
+    "capture": capture_command,
+    "memory": memory_command,
+}
+
+
+def http_response(conn, status, content_type, body):
+    body = body.encode()
+    conn.sendall(
+        f"HTTP/1.0 {status}\r\nContent-Type: {content_type}\r\n"
+        f"Content-Length: {len(body)}\r\nConnection: close\r\n\r\n".encode() + body)
+
+
+def handle_http(conn, request_line):
+    parts = request_line.decode(errors="replace").split()
+    path = parts[1] if len(parts) > 1 else "/"
+    if path == "/metrics":
+        http_response(conn, "200 OK", "text/plain; version=0.0.4", metrics.render_prometheus())
+    elif path == "/stats":
+        http_response(conn, "200 OK", "application/json", json.dumps(metrics.snapshot()))
+    elif path == "/memory":
+        http_response(conn, "200 OK", "application/json", json.dumps(memory_command({})))
+    else:
+        http_response(conn, "404 Not Found", "text/plain", "Try /metrics, /stats or /memory\n")
+
+
+def handle_admin(conn):
+    """Serve one admin connection: plain HTTP GET or JSON-line commands"""
+    try:
+        reader = FrameReader(conn)
+        line = reader.read_line()
+        if line and line.startswith(b"GET "):
+            handle_http(conn, line)
+            return
+
+        while line is not None:
+            if line.strip():
+                msg = json.loads(line)
+                command = COMMANDS.get(msg.get("type"))
+                if command:
+                    reply = command(msg)
+                else:
+                    reply = {"type": "error", "message": f"Unknown command: {msg.get('type')}"}
+                conn.sendall(encode(reply))
+            line = reader.read_line()
+    except (ConnectionError, OSError, ValueError) as e:
+        print(f"Admin connection error: {e}")
+    finally:
+        try:
+            conn.close()
+        except:
+            pass
+
+
+def start(port=ADMIN_PORT, server=None):
+    """Start the admin listener in the background (on an inherited listening
+    socket if given); a busy port is not fatal. Returns the listening socket."""
+    if server is None:
+        try:
+            server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+            server.bind((ADMIN_HOST, port))
+            server.listen(16)
+        except OSError as e:
+            print(f"⚠ Admin port {port} unavailable, metrics endpoint disabled: {e}")
+            return None
+    port = server.getsockname()[1]
+
+    def accept_loop():
+        while True:
+            conn, _ = server.accept()
+            threading.Thread(target=handle_admin, args=(conn,), daemon=True).start()
+
+    threading.Thread(target=accept_loop, daemon=True).start()
+    print(f" Admin/metrics endpoint on {ADMIN_HOST}:{port} (/metrics, /stats)")
+    return server
@@ -0,0 +1,90 @@
+"""Admission control for the accept loop.
+
+Three limits keep an overloaded server degrading predictably instead of
+spawning threads until it falls over:
+
+  - connections in the TLS handshake (the expensive, unauthenticated part).
+    Beyond it, new sockets are closed straight away, before any TLS work.
+  - total open connections, and open connections per client IP. Beyond
+    them, the client finishes the handshake and gets a "server_busy" error
+    with a retry_after_ms hint, then the connection is closed.
+"""
+import random
+import threading
+from collections import defaultdict
+
+import metrics
+
+MAX_CONNECTIONS = 5000
+MAX_PER_IP = 50
+MAX_HANDSHAKES = 64
+HANDSHAKE_TIMEOUT = 10  # Seconds a client gets to complete the TLS handshake
+RETRY_AFTER = 5  # Seconds suggested to shed clients (jittered to spread retries)
+
+shed = metrics.Counter("chat_shed_connections_total", "Connections refused by admission control",
+                       ("reason",))
+open_connections = metrics.Gauge("chat_open_connections", "Admitted connections, handshaking included")
+handshakes_in_progress = metrics.Gauge("chat_handshakes_in_progress", "Connections in the TLS handshake")
+
+
+class Admission:
+    def __init__(self, max_connections=MAX_CONNECTIONS, max_per_ip=MAX_PER_IP,
+                 max_handshakes=MAX_HANDSHAKES):
+        self.max_connections = max_connections
+        self.max_per_ip = max_per_ip
+        self.max_handshakes = max_handshakes
+        self.total = 0
+        self.per_ip = defaultdict(int)
+        self.handshakes = 0
+        self.lock = threading.Lock()
+
+    def begin_handshake(self):
+        """Claim a handshake slot; False (and counted as shed) if none is free"""
+        with self.lock:
+            if self.handshakes >= self.max_handshakes:
+                admitted = False
+            else:
+                self.handshakes += 1
+                admitted = True
+            handshakes_in_progress.set(self.handshakes)
+        if not admitted:
+            shed.inc(reason="handshakes")
+        return admitted
+
+    def end_handshake(self):
+        with self.lock:
+            self.handshakes -= 1
+            handshakes_in_progress.set(self.handshakes)
+
+    def admit(self, ip):
+        """Count a connection from ip; returns None, or why it must be shed"""
+        with self.lock:
+            if self.total >= self.max_connections:
+                reason = "total"
+            elif self.per_ip[ip] >= self.max_per_ip:
+                reason = "per_ip"
+            else:
+                self.total += 1
+                self.per_ip[ip] += 1
+                open_connections.set(self.total)
+                return None
+        shed.inc(reason=reason)
+        return reason
+
+    def release(self, ip):
+        with self.lock:
+            self.total -= 1
+            self.per_ip[ip] -= 1
+            if not self.per_ip[ip]:
+                del self.per_ip[ip]
+            open_connections.set(self.total)
+
+
+def busy_error(reason):
+    return {
+        "type": "error",
+        "code": "server_busy",
+        "reason": reason,
+        "retry_after_ms": int(RETRY_AFTER * random.uniform(1.0, 2.0) * 1000),
+        "message": "Server busy, retry later",
+    }
@@ -0,0 +1,111 @@
+import gzip
+import json
+import os
+import re
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+from datetime import datetime
+
+try:
+    import fcntl
+except ImportError:  # Windows: one server process per directory
+    fcntl = None
+
+CACHE_MONTHS = 4  # Decompressed months kept in memory
+LEGACY_FORMAT = "%Y-%m-%d %H:%M:%S"
+FILE_PATTERN = re.compile(r"^messages-(\d{4}-\d{2})\.jsonl\.gz$")
+
+
+class MessageArchive:
+    """Read-only, gzip-compressed monthly partitions of old messages.
+
+    Each month is one file, messages-YYYY-MM.jsonl.gz, holding one JSON row
+    [sender, receiver, content, timestamp (epoch ms), type] per line in
+    insertion order. Files are written once (atomically) and never modified
+    afterwards.
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.cache = OrderedDict()  # month: (mtime, rows), most recently used last
+        self.lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+
+    def path_for(self, month):
+        return os.path.join(self.directory, f"messages-{month}.jsonl.gz")
+
+    @contextmanager
+    def compaction_lock(self):
+        """Yields whether this process may compact now: cluster nodes sharing
+        the store and archive take turns, and a node that finds the lock
+        taken skips its pass"""
+        with open(os.path.join(self.directory, ".compact.lock"), "w") as lock_file:
+            if fcntl:
+                try:
+                    fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                except BlockingIOError:
+                    yield False
+                    return
+            yield True
+
+    def months(self):
+        """Archived months, oldest first"""
+        found = []
+        for name in os.listdir(self.directory):
+            match = FILE_PATTERN.match(name)
+            if match:
+                found.append(match.group(1))
+        return sorted(found)
+
+    def write_month(self, month, rows):
+        path = self.path_for(month)
+        if os.path.exists(path):
+            # Month reopened (e.g. late rows): merge with what is archived
+            rows = self.read_month(month) + list(rows)
+            os.chmod(path, 0o644)
+        tmp = f"{path}.{os.getpid()}.tmp"
+        with gzip.open(tmp, "wt", encoding="utf-8", compresslevel=6) as f:
+            for row in rows:
+                f.write(json.dumps(row) + "\n")
+        os.replace(tmp, path)
+        os.chmod(path, 0o444)
+        with self.lock:
+            self.cache.pop(month, None)
+
+    def read_month(self, month):
+        path = self.path_for(month)
+        mtime = os.stat(path).st_mtime_ns  # Another worker process may have merged it
+        with self.lock:
+            cached = self.cache.get(month)
+            if cached and cached[0] == mtime:
+                self.cache.move_to_end(month)
+                return cached[1]
+
+        with gzip.open(path, "rt", encoding="utf-8") as f:
+            rows = [json.loads(line) for line in f]
+        for row in rows:
+            if isinstance(row[3], str):  # Archived before timestamps were epoch ms
+                row[3] = int(datetime.strptime(row[3], LEGACY_FORMAT).timestamp() * 1000)
+
+        with self.lock:
+            self.cache[month] = (mtime, rows)
+            self.cache.move_to_end(month)
+            while len(self.cache) > CACHE_MONTHS:
+                self.cache.popitem(last=False)
+        return rows
+
+    def drop_month(self, month):
+        path = self.path_for(month)
+        os.chmod(path, 0o644)
+        os.remove(path)
+        with self.lock:
+            self.cache.pop(month, None)
+
+    def rows(self):
+        """Every archived row, oldest month first"""
+        for month in self.months():
+            yield from self.read_month(month)
+
+    def size(self):
+        return sum(os.path.getsize(self.path_for(m)) for m in self.months())
@@ -0,0 +1,86 @@
+"""Write coalescing benchmark: the same load with coalescing off and on.
+
+Runs loadgen against a local server once per --modes entry ("off", or a
+--coalesce-ms tick for coalescing on) and reports, per run, the frames sent
+to clients, the TLS writes they took (frames/write is the coalescing
+factor), writes per second, delivery rate and p50/p99 latency of group,
+private and typing messages.
+
+    python bench_coalesce.py --users 300 --duration 20
+    python bench_coalesce.py --modes off,0,0.5,2 --mix group=60,typing=40
+"""
+import argparse
+import asyncio
+import json
+import urllib.request
+
+import loadgen
+
+ADMIN_PORT = 5851
+KINDS = ("group", "private", "typing")
+
+
+def fetch_counter(port, name):
+    with urllib.request.urlopen(f"http://127.0.0.1:{port}/stats", timeout=5) as response:
+        stats = json.load(response)
+    return stats.get(name, {}).get("total", {}).get("count", 0)
+
+
+def run_once(args, mode):
+    server_args = ["--admin-port", str(args.admin_port)]
+    server_args += ["--no-coalesce"] if mode == "off" else ["--coalesce-ms", mode]
+    local = loadgen.spawn_server(args.port, server_args)
+    try:
+        bench_args = loadgen.parse_args(["--server", f"127.0.0.1:{args.port}",
+                                         "--users", str(args.users), "--duration", str(args.duration),
+                                         "--rate", str(args.rate), "--mix", args.mix])
+        result = asyncio.run(loadgen.run_bench(bench_args))
+        frames = fetch_counter(args.admin_port, "chat_outbound_frames_total")
+        writes = fetch_counter(args.admin_port, "chat_socket_writes_total")
+    finally:
+        loadgen.stop_server(*local)
+
+    return {
+        "mode": mode,
+        "frames": frames,
+        "writes": writes,
+        "frames_per_write": round(frames / writes, 2) if writes else None,
+        "writes_per_sec": round(writes / args.duration, 1),
+        "delivery_rate_per_sec": result["delivery_rate_per_sec"],
+        "errors": result["errors"],
+        "latency": {kind: result["latency"][kind] for kind in KINDS if kind in result["latency"]},
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Write coalescing on/off benchmark")
+    parser.add_argument("--port", type=int, default=5850)
+    parser.add_argument("--admin-port", type=int, default=ADMIN_PORT)
+    parser.add_argument("--modes", default="off,0",
+                        help="comma-separated runs: 'off' or a --coalesce-ms value")
+    parser.add_argument("--users", type=int, default=300)
+    parser.add_argument("--duration", type=float, default=15)
+    parser.add_argument("--rate", type=float, default=1.0, help="messages/sec per user")
+    parser.add_argument("--mix", default="group=50,private=20,typing=30")
+    parser.add_argument("--output", help="write JSON results to this file")
+    args = parser.parse_args(argv)
+
+    runs = [run_once(args, mode.strip()) for mode in args.modes.split(",")]
+
+    print(f"{'mode':>8}{'frames':>10}{'writes':>10}{'f/write':>9}{'writes/s':>10}{'errors':>8}"
+          + "".join(f"{kind + ' p50/p99':>22}" for kind in KINDS))
+    for run in runs:
+        latency = "".join(
+            f"{'{p50_ms}/{p99_ms}'.format(**run['latency'][kind]) if kind in run['latency'] else '-':>22}"
+            for kind in KINDS)
+        print(f"{run['mode']:>8}{run['frames']:>10}{run['writes']:>10}{run['frames_per_write']!s:>9}"
+              f"{run['writes_per_sec']:>10}{run['errors']:>8}{latency}")
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({"config": vars(args), "runs": runs}, f, indent=2)
+        print(f"Results written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,306 @@
+"""ChatDatabase scale benchmark.
+
+Builds (or reuses) a synthetic corpus with a realistic group/private/file
+mix, then measures the storage operations the server depends on:
+
+  insert_per_sec  - ChatDatabase.insert_message throughput (one commit each)
+  history_ms      - history-on-connect latency for one user, cold cache
+  history_warm_ms - the same with the recent-message cache warm
+  search_p50_ms / search_p95_ms - ChatDatabase.search latency
+  range_ms        - history_range: latest page of the group in the last week
+  open_ms         - opening the store (for the log: loading indexes and recovery)
+  db_size_mb      - disk space the store takes
+
+    python bench_db.py --scale 1m
+    python bench_db.py --scale 10m --output run.json
+    python bench_db.py --scale 1m --update-thresholds
+    python bench_db.py --scale 1m --backend both
+
+--backend picks the store (storage.py): sqlite, the segmented log, or both
+side by side; with both, keyword search must also return the same results
+from each store for messages with quotes, backslashes and control
+characters (check_search_parity). A run fails (exit code 1) when a metric regresses past the
+thresholds stored in bench_thresholds.json for that scale (key "<scale>"
+for sqlite, "<scale>-log" for the log). Corpora are cached in --corpus-dir
+and generated from a fixed seed, so runs are comparable.
+"""
+import argparse
+import json
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+import storage
+from database import ChatDatabase, conversation_key
+
+SRC_DIR = os.path.dirname(os.path.abspath(__file__))
+THRESHOLDS_FILE = os.path.join(SRC_DIR, "bench_thresholds.json")
+SCALES = {"10k": 10_000, "100k": 100_000, "1m": 1_000_000, "10m": 10_000_000}
+MIX = (("group", 0.70), ("private", 0.25), ("file", 0.05))
+NUM_USERS = 500
+BATCH_SIZE = 50_000
+SEED = 1234
+CORPUS_VERSION = 3  # Bump when the schema changes so cached corpora are rebuilt
+INSERT_SAMPLES = 2000
+SEARCH_TERMS = ("meeting", "deploy", "lunch", "zzz-no-match", "report", "friday")
+THRESHOLD_SLACK = 1.5  # Recorded thresholds allow this much headroom
+THRESHOLD_FLOOR_MS = 1.0  # Recorded latency thresholds are never lower (sub-ms timings are mostly noise)
+
+WORDS = ("hey hello thanks ok sure meeting tomorrow today deploy build report lunch "
+         "coffee friday weekend project deadline review merge fix bug release call "
+         "later please great done working on it see you soon agreed").split()
+EXTENSIONS = (".png", ".pdf", ".txt", ".zip", ".docx")
+# Messages whose JSON encoding escapes characters, and terms to find in them
+PARITY_MESSAGES = ('she said "hi"', "saved to c:\\temp\\notes", "name\tsize", "two\nlines",
+                   "Café at noon", 'quote " and \\ both')
+PARITY_TERMS = ('"', '"hi"', "\\", "c:\\temp", "\t", "\n", "two\nLINES", "café", '" and \\')
+
+
+def generate_rows(count, rng):
+    """Yield (sender, receiver, content, timestamp, type, conversation) rows in time order"""
+    users = [f"user{i}" for i in range(NUM_USERS)]
+    kinds = [k for k, _ in MIX]
+    weights = [w for _, w in MIX]
+    start = (datetime.now() - timedelta(days=365)).timestamp() * 1000
+    step = timedelta(days=365).total_seconds() * 1000 / count
+    for i in range(count):
+        sender = rng.choice(users)
+        kind = rng.choices(kinds, weights)[0]
+        timestamp = int(start + step * i)
+        if kind == "group":
+            content = " ".join(rng.choices(WORDS, k=rng.randint(2, 20)))
+            receiver = "group"
+        elif kind == "private":
+            content = " ".join(rng.choices(WORDS, k=rng.randint(2, 20)))
+            receiver = rng.choice(users)
+        else:
+            content = f"{rng.choice(WORDS)}_{i}{rng.choice(EXTENSIONS)}"
+            receiver = "FILE"
+        yield sender, receiver, content, timestamp, kind, conversation_key(sender, receiver, kind)
+
+
+def build_corpus(path, count, backend):
+    print(f"Generating {count:,} messages into {path} ...")
+    start = time.perf_counter()
+    store = storage.open_store(backend, path)
+    rng = random.Random(SEED)
+    batch = []
+    for row in generate_rows(count, rng):
+        batch.append(row)
+        if len(batch) >= BATCH_SIZE:
+            store.append_many(batch)
+            batch = []
+    if batch:
+        store.append_many(batch)
+    store.close()
+    print(f"Corpus ready in {time.perf_counter() - start:.1f}s")
+
+
+def check_search_parity(workdir):
+    """Terms for which the stores' keyword search results differ, over the
+    same sample of messages plus PARITY_MESSAGES"""
+    rows = list(generate_rows(2000, random.Random(SEED)))
+    last = rows[-1][3]
+    rows += [("user1", "group", content, last + i + 1, "group", "group")
+             for i, content in enumerate(PARITY_MESSAGES)]
+    stores = {backend: storage.open_store(backend, os.path.join(workdir, f"parity-{backend}"))
+              for backend in storage.BACKENDS}
+    try:
+        for store in stores.values():
+            store.append_many(rows)
+        return [term for term in SEARCH_TERMS + PARITY_TERMS
+                if len({tuple(sorted(store.search(term))) for store in stores.values()}) > 1]
+    finally:
+        for store in stores.values():
+            store.close()
+
+
+def disk_mb(path):
+    """Space allocated on disk (log segments are preallocated sparse files)"""
+    paths = [os.path.join(path, name) for name in os.listdir(path)] if os.path.isdir(path) else [path]
+    return round(sum(os.stat(p).st_blocks * 512 for p in paths) / 1e6, 2)
+
+
+def percentile(values, q):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q * len(values)))]
+
+
+def measure(corpus_path, workdir, backend):
+    # Work on a copy so inserts never grow the cached corpus
+    path = os.path.join(workdir, os.path.basename(corpus_path))
+    if os.path.isdir(corpus_path):
+        shutil.copytree(corpus_path, path)
+    else:
+        shutil.copy(corpus_path, path)
+    results = {}
+
+    start = time.perf_counter()
+    db = ChatDatabase(path, backend=backend)
+    db.open()
+    results["open_ms"] = round((time.perf_counter() - start) * 1000, 2)
+
+    timings = []
+    for _ in range(3):
+        db.recent.clear()
+        start = time.perf_counter()
+        db.connect_history("user7")
+        timings.append(time.perf_counter() - start)
+    results["history_ms"] = round(min(timings) * 1000, 2)
+
+    timings = []
+    for _ in range(20):
+        start = time.perf_counter()
+        db.connect_history("user7")
+        timings.append(time.perf_counter() - start)
+    results["history_warm_ms"] = round(min(timings) * 1000, 2)
+
+    timings = []
+    for _ in range(3):
+        for term in SEARCH_TERMS:
+            start = time.perf_counter()
+            db.search(term)
+            timings.append(time.perf_counter() - start)
+    results["search_p50_ms"] = round(percentile(timings, 0.50) * 1000, 2)
+    results["search_p95_ms"] = round(percentile(timings, 0.95) * 1000, 2)
+
+    week_ago = int((time.time() - 7 * 86400) * 1000)
+    timings = []
+    for _ in range(5):
+        start = time.perf_counter()
+        db.history_range("user7", since=week_ago, limit=100)
+        timings.append(time.perf_counter() - start)
+    results["range_ms"] = round(min(timings) * 1000, 2)
+
+    rng = random.Random(SEED + 1)
+    rows = list(generate_rows(INSERT_SAMPLES, rng))
+    start = time.perf_counter()
+    for sender, receiver, content, _, kind, _ in rows:
+        db.insert_message(sender, receiver, content, kind)
+    results["insert_per_sec"] = round(INSERT_SAMPLES / (time.perf_counter() - start), 1)
+
+    db.close()
+    results["db_size_mb"] = disk_mb(corpus_path)
+    return results
+
+
+# Direction of "worse" for each metric
+HIGHER_IS_BETTER = {"insert_per_sec"}
+
+
+def thresholds_key(scale, backend):
+    return scale if backend == "sqlite" else f"{scale}-{backend}"
+
+
+def check_thresholds(key, results):
+    """Return a list of regressions against the stored thresholds"""
+    if not os.path.exists(THRESHOLDS_FILE):
+        return None
+    with open(THRESHOLDS_FILE) as f:
+        limits = json.load(f).get(key)
+    if not limits:
+        return None
+
+    failures = []
+    for name, limit in limits.items():
+        value = results.get(name)
+        if value is None:
+            continue
+        if name in HIGHER_IS_BETTER and value < limit:
+            failures.append(f"{name} = {value} is below the minimum {limit}")
+        elif name not in HIGHER_IS_BETTER and value > limit:
+            failures.append(f"{name} = {value} exceeds the maximum {limit}")
+    return failures
+
+
+def update_thresholds(key, results):
+    data = {}
+    if os.path.exists(THRESHOLDS_FILE):
+        with open(THRESHOLDS_FILE) as f:
+            data = json.load(f)
+    data[key] = {
+        name: round(value / THRESHOLD_SLACK if name in HIGHER_IS_BETTER
+                    else max(value * THRESHOLD_SLACK, THRESHOLD_FLOOR_MS if name.endswith("_ms") else 0), 2)
+        for name, value in results.items()
+    }
+    with open(THRESHOLDS_FILE, "w") as f:
+        json.dump(data, f, indent=2, sort_keys=True)
+        f.write("\n")
+    print(f"Thresholds for {key} written to {THRESHOLDS_FILE}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="ChatDatabase scale benchmark")
+    parser.add_argument("--scale", choices=SCALES, default="1m")
+    parser.add_argument("--backend", choices=[*storage.BACKENDS, "both"], default="sqlite",
+                        help="store to measure (both: run each and compare)")
+    parser.add_argument("--corpus-dir", default=os.path.join(tempfile.gettempdir(), "chat-bench-corpus"))
+    parser.add_argument("--output", help="write JSON results to this file")
+    parser.add_argument("--update-thresholds", action="store_true",
+                        help="record this run (with headroom) as the new thresholds")
+    args = parser.parse_args(argv)
+
+    backends = list(storage.BACKENDS) if args.backend == "both" else [args.backend]
+    os.makedirs(args.corpus_dir, exist_ok=True)
+    results = {}
+    for backend in backends:
+        suffix = ".db" if backend == "sqlite" else f".{backend}"
+        corpus = os.path.join(args.corpus_dir, f"corpus-v{CORPUS_VERSION}-{args.scale}{suffix}")
+        if not os.path.exists(corpus):
+            build_corpus(corpus + ".tmp", SCALES[args.scale], backend)
+            os.replace(corpus + ".tmp", corpus)
+
+        workdir = tempfile.mkdtemp(prefix="chat-bench-db-")
+        try:
+            results[backend] = measure(corpus, workdir, backend)
+        finally:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    report = {"timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"), "scale": args.scale,
+              "messages": SCALES[args.scale], "backend": args.backend,
+              "results": results if args.backend == "both" else results[args.backend]}
+    print(f"{'':<16}" + "".join(f"{backend:>12}" for backend in backends))
+    for name in results[backends[0]]:
+        print(f"{name:<16}" + "".join(f"{results[backend][name]:>12}" for backend in backends))
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+
+    if args.update_thresholds:
+        for backend in backends:
+            update_thresholds(thresholds_key(args.scale, backend), results[backend])
+        return
+
+    failed = False
+    if args.backend == "both":
+        workdir = tempfile.mkdtemp(prefix="chat-bench-db-")
+        try:
+            mismatched = check_search_parity(workdir)
+        finally:
+            shutil.rmtree(workdir, ignore_errors=True)
+        if mismatched:
+            print(f"✗ search results differ between stores for {mismatched}")
+            failed = True
+        else:
+            print("✓ search results match between stores")
+    for backend in backends:
+        key = thresholds_key(args.scale, backend)
+        failures = check_thresholds(key, results[backend])
+        if failures is None:
+            print(f"No stored thresholds for {key} (run with --update-thresholds)")
+        elif failures:
+            for failure in failures:
+                print(f"✗ {key}: {failure}")
+            failed = True
+        else:
+            print(f"✓ {key} within stored thresholds")
+    if failed:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,171 @@
+"""Head-of-line benchmark: chat text latency while large files are sent.
+
+Starts a local server and connects receivers that read at a capped rate
+(a slow link), a chatter sending group messages every --interval ms and
+an uploader sending a --file-mb file every --file-every seconds. Reports
+the end-to-end latency of the text messages at the receivers, how long
+files took to arrive, and the server's per-lane queue wait.
+
+    python bench_lanes.py
+    python bench_lanes.py --file-mb 30 --read-mbps 20 --duration 20
+
+Without priority lanes a text message to a receiver waits for every file
+frame queued before it; with them it waits for at most one chunk.
+"""
+import argparse
+import base64
+import json
+import os
+import socket
+import tempfile
+import threading
+import time
+import urllib.request
+
+import loadgen
+from chat_client import default_ssl_context
+from protocol import FrameReader, encode
+
+ADMIN_PORT = 5861
+
+
+class Throttled:
+    """A socket whose recv() is paced to `rate` bytes per second"""
+
+    def __init__(self, sock, rate):
+        self.sock = sock
+        self.rate = rate
+        self.next_read = time.perf_counter()
+
+    def recv(self, bufsize):
+        delay = self.next_read - time.perf_counter()
+        if delay > 0:
+            time.sleep(delay)
+        data = self.sock.recv(bufsize)
+        self.next_read = max(self.next_read, time.perf_counter()) + len(data) / self.rate
+        return data
+
+
+def connect(port, name):
+    sock = default_ssl_context().wrap_socket(socket.create_connection(("127.0.0.1", port)))
+    sock.sendall(name.encode() + b"\n")
+    return sock
+
+
+def receive(sock, rate, results, stop):
+    reader = FrameReader(Throttled(sock, rate) if rate else sock)
+    try:
+        while not stop.is_set():
+            line = reader.read_line()
+            if line is None:
+                return
+            now = time.perf_counter()
+            if line.startswith(b'{"type": "group"'):
+                parts = json.loads(line)["content"].split(" ")
+                if parts[0] == "lb":
+                    results["text"].append(now - float(parts[1]))
+            elif line.startswith(b'{"type": "file"'):
+                # The whole file, or its header after the chunks; don't decode the data
+                start = line.index(b'"filename": "lb_') + len(b'"filename": "lb_')
+                results["files"].append(now - float(line[start:line.index(b".bin", start)]))
+    except (OSError, ValueError):
+        results["errors"] += 1
+
+
+def drain(sock):
+    """Read and drop what the server sends a sending client (daemon thread)"""
+    try:
+        while sock.recv(1 << 20):
+            pass
+    except OSError:
+        pass
+
+
+def run(args):
+    limits = os.path.join(tempfile.gettempdir(), f"bench-lanes-{os.getpid()}.json")
+    with open(limits, "w") as f:
+        json.dump({"type_limits": {"file": [100, 100], "group": [1000, 1000]},
+                   "user_limit": [100000, 100000], "file_cost_per_mb": 0}, f)
+    local = loadgen.spawn_server(args.port, ["--admin-port", str(args.admin_port), "--rate-limits", limits])
+    stop = threading.Event()
+    results = {"text": [], "files": [], "errors": 0}
+    try:
+        threads = []
+        for i in range(args.receivers):
+            sock = connect(args.port, f"lb-recv{i}")
+            threads.append(threading.Thread(target=receive, args=(sock, args.read_mbps * 1e6, results, stop),
+                                            daemon=True))
+        chatter = connect(args.port, "lb-chat")
+        uploader = connect(args.port, "lb-upload")
+        for sock in (chatter, uploader):
+            threads.append(threading.Thread(target=drain, args=(sock,), daemon=True))
+        for thread in threads:
+            thread.start()
+        time.sleep(0.5)
+
+        filedata = base64.b64encode(os.urandom(int(args.file_mb * 1e6))).decode()
+        end = time.perf_counter() + args.duration
+        next_file = time.perf_counter()
+        while time.perf_counter() < end:
+            now = time.perf_counter()
+            if now >= next_file:
+                uploader.sendall(encode({"type": "file", "filename": f"lb_{now:.6f}.bin",
+                                         "filedata": filedata}))
+                next_file = now + args.file_every
+            chatter.sendall(encode({"type": "group", "content": f"lb {time.perf_counter():.6f}"}))
+            time.sleep(args.interval / 1000)
+        time.sleep(args.drain)
+
+        with urllib.request.urlopen(f"http://127.0.0.1:{args.admin_port}/stats", timeout=5) as response:
+            stats = json.load(response)
+    finally:
+        stop.set()
+        loadgen.stop_server(*local)
+        os.unlink(limits)
+
+    return {
+        "text": loadgen.summarize(results["text"]),
+        "files": loadgen.summarize(results["files"]),
+        "errors": results["errors"],
+        "lane_wait": stats.get("chat_lane_wait_seconds", {}),
+        "evictions": stats.get("chat_evictions_total", {}),
+        "offload_wait": stats.get("chat_offload_wait_seconds", {}),
+        "offload_exec": stats.get("chat_offload_exec_seconds", {}),
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Text latency during large file transfers")
+    parser.add_argument("--port", type=int, default=5860)
+    parser.add_argument("--admin-port", type=int, default=ADMIN_PORT)
+    parser.add_argument("--receivers", type=int, default=5)
+    parser.add_argument("--read-mbps", type=float, default=50, help="receiver read rate in MB/s (0: unlimited)")
+    parser.add_argument("--file-mb", type=float, default=20)
+    parser.add_argument("--file-every", type=float, default=3, help="seconds between uploads")
+    parser.add_argument("--interval", type=float, default=20, help="milliseconds between text messages")
+    parser.add_argument("--duration", type=float, default=15)
+    parser.add_argument("--drain", type=float, default=5, help="seconds to keep reading after the last send")
+    parser.add_argument("--output", help="write JSON results to this file")
+    args = parser.parse_args(argv)
+
+    result = run(args)
+    text, files = result["text"], result["files"]
+    print(f"Text:  {text['count']} received, p50 {text['p50_ms']} ms, p99 {text['p99_ms']} ms, "
+          f"max {text['max_ms']} ms")
+    print(f"Files: {files['count']} received, p50 {files['p50_ms']} ms, max {files['max_ms']} ms")
+    for lane, wait in result["lane_wait"].items():
+        print(f"Lane {lane:<8} wait p50 {wait['p50_ms']} ms, p99 {wait['p99_ms']} ms ({wait['count']} frames)")
+    for op, wait in result["offload_wait"].items():
+        run_time = result["offload_exec"][op]
+        print(f"Offload {op:<6} wait p50 {wait['p50_ms']} ms, run p50 {run_time['p50_ms']} ms, "
+              f"p99 {run_time['p99_ms']} ms ({wait['count']} calls)")
+    if result["errors"] or result["evictions"]:
+        print(f"⚠ Receiver errors: {result['errors']}, evictions: {result['evictions']}")
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({"config": vars(args), **result}, f, indent=2)
+        print(f"Results written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
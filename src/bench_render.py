@@ -0,0 +1,194 @@
+"""GUI render benchmark: what each kind of event costs the client's GUI thread.
+
+Replays synthetic events into the chat window (client.py's Chat) on Qt's
+offscreen platform, the way the session delivers them (through its
+signals), and lets Qt lay out and paint after every event. Per event type
+it reports the time from delivery until everything it caused was painted:
+
+  group     - group messages and files: Chat.show_message HTML bubbles
+  private   - private messages into --peers open windows: PrivateChat.show_message
+  typing    - group and private typing notifications: update_typing_label
+  presence  - online user lists with joins and leaves: update_users
+  toggle    - dark/light mode switches, restyling the main window and every
+              private window (run last, with the windows the others filled)
+
+An event that keeps the GUI thread busy for longer than a frame (16.7 ms
+at 60 Hz) is a frame stall: the window cannot repaint or react to input
+meanwhile.
+
+    python bench_render.py
+    python bench_render.py --messages 100000 --scenarios group,private
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import time
+
+os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+from PyQt5.QtCore import qInstallMessageHandler
+from PyQt5.QtWidgets import QApplication
+
+from loadgen import summarize
+
+BENCH_USER = "bench-render"
+FRAME_SECONDS = 1 / 60
+SCENARIOS = ("group", "private", "typing", "presence", "toggle")
+WORDS = ("hello", "meeting", "at", "noon", "the", "build", "is", "green", "again", "can", "you",
+         "review", "my", "change", "thanks", "lunch", "deploy", "tomorrow", "ok", "👍")
+
+
+def load_client():
+    """Import client.py without starting a session: client_connection reads
+    the username from the command line, so give it ours"""
+    sys.argv = [sys.argv[0], BENCH_USER]
+    import client
+    return client
+
+
+def quiet_qt(mode, context, message):
+    # The offscreen platform warns whenever a window is sized or raised
+    if "This plugin does not support" not in message:
+        print(message, file=sys.stderr)
+
+
+def text(rng):
+    return " ".join(rng.choice(WORDS) for _ in range(rng.choice((1, 3, 8, 20, 60))))
+
+
+def group_events(window, rng, count):
+    now = int(time.time() * 1000)
+    for i in range(count):
+        sender = BENCH_USER if rng.random() < 0.2 else f"user{rng.randrange(200)}"
+        if rng.random() < 0.03:
+            msg = {"type": "file", "sender": sender, "filename": f"report_{i}.pdf", "timestamp": now + i}
+        else:
+            msg = {"type": "group", "sender": sender, "content": text(rng), "timestamp": now + i}
+        yield msg["type"], lambda msg=msg: window.sig.message.emit(msg)
+
+
+def private_events(window, rng, count, peers):
+    now = int(time.time() * 1000)
+    for i in range(count):
+        peer = f"user{rng.randrange(peers)}"
+        sender = BENCH_USER if rng.random() < 0.4 else peer
+        msg = {"type": "private", "sender": sender, "to": peer if sender == BENCH_USER else BENCH_USER,
+               "content": text(rng), "timestamp": now + i}
+        yield "private", lambda msg=msg: window.sig.message.emit(msg)
+
+
+def typing_events(window, rng, count, typers, peers):
+    for _ in range(count):
+        if rng.random() < 0.8:
+            sender = f"user{rng.randrange(typers)}"
+            yield "typing", lambda sender=sender: window.sig.typing.emit(sender)
+        else:
+            sender = f"user{rng.randrange(peers)}"
+            yield "private_typing", lambda sender=sender: window.sig.private_typing.emit(sender)
+
+
+def presence_events(window, rng, count, users):
+    online = {f"user{i}" for i in range(users)} | {BENCH_USER}
+    joined = users
+    for i in range(count):
+        if i % 100 == 99:
+            # A reconnect wave (e.g. after a server restart): a third of the list changes at once
+            leaving = rng.sample(sorted(online - {BENCH_USER}), len(online) // 3)
+        else:
+            leaving = rng.sample(sorted(online - {BENCH_USER}), rng.randint(0, 2))
+        online.difference_update(leaving)
+        for _ in range(len(leaving) or 1):
+            online.add(f"user{joined}")
+            joined += 1
+        users_list = sorted(online)
+        yield "presence", lambda users_list=users_list: window.sig.status.emit(users_list)
+
+
+def toggle_events(window, count):
+    for _ in range(count):
+        yield "toggle", window.toggle_mode
+
+
+def replay(app, events):
+    """Deliver each event and let Qt process what it caused (layout, paint,
+    timers); returns {event type: [seconds]}"""
+    costs = {}
+    for kind, fire in events:
+        start = time.perf_counter()
+        fire()
+        app.processEvents()
+        costs.setdefault(kind, []).append(time.perf_counter() - start)
+    return costs
+
+
+def report(costs):
+    result = {}
+    for kind, samples in costs.items():
+        result[kind] = {**summarize(samples),
+                        "mean_ms": round(sum(samples) / len(samples) * 1000, 3),
+                        "stalls": sum(1 for s in samples if s > FRAME_SECONDS),
+                        "total_s": round(sum(samples), 3)}
+    return result
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="GUI render benchmark (offscreen Qt)")
+    parser.add_argument("--scenarios", default=",".join(SCENARIOS), help="comma-separated, from: "
+                        + ", ".join(SCENARIOS))
+    parser.add_argument("--messages", type=int, default=10000, help="group and private messages each")
+    parser.add_argument("--typing", type=int, default=10000, help="typing notifications")
+    parser.add_argument("--presence", type=int, default=2000, help="user list updates")
+    parser.add_argument("--users", type=int, default=1000, help="users online in presence updates")
+    parser.add_argument("--peers", type=int, default=20, help="open private chat windows")
+    parser.add_argument("--typers", type=int, default=5, help="distinct users typing in the group")
+    parser.add_argument("--toggles", type=int, default=20, help="dark/light mode switches")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--output", help="write JSON results to this file")
+    args = parser.parse_args(argv)
+    scenarios = [name.strip() for name in args.scenarios.split(",")]
+    unknown = set(scenarios) - set(SCENARIOS)
+    if unknown:
+        parser.error(f"unknown scenarios: {', '.join(sorted(unknown))}")
+
+    client = load_client()
+    qInstallMessageHandler(quiet_qt)
+    app = QApplication(sys.argv)
+    window = client.Chat()
+    window.show()
+    for i in range(args.peers):
+        window.open_private_chat_with(f"user{i}")
+    window.activateWindow()
+    app.processEvents()
+
+    rng = random.Random(args.seed)
+    generators = {
+        "group": lambda: group_events(window, rng, args.messages),
+        "private": lambda: private_events(window, rng, args.messages, args.peers),
+        "typing": lambda: typing_events(window, rng, args.typing, args.typers, args.peers),
+        "presence": lambda: presence_events(window, rng, args.presence, args.users),
+        "toggle": lambda: toggle_events(window, args.toggles),
+    }
+    results = {}
+    for name in SCENARIOS:
+        if name in scenarios:
+            start = time.perf_counter()
+            results[name] = report(replay(app, generators[name]()))
+            print(f"✓ {name} done in {time.perf_counter() - start:.1f}s", file=sys.stderr)
+
+    print(f"{'event':<16}{'count':>8}{'mean ms':>10}{'p50 ms':>10}{'p99 ms':>10}{'max ms':>10}{'stalls':>8}")
+    for scenario in results.values():
+        for kind, r in scenario.items():
+            print(f"{kind:<16}{r['count']:>8}{r['mean_ms']:>10}{r['p50_ms']:>10}{r['p99_ms']:>10}"
+                  f"{r['max_ms']:>10}{r['stalls']:>8}")
+    blocks = window.chat.document().blockCount()
+    print(f"Main chat document: {blocks} blocks; frame stalls are events over {FRAME_SECONDS * 1000:.1f} ms")
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({"config": vars(args), "results": results, "document_blocks": blocks}, f, indent=2)
+        print(f"Results written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
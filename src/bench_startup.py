@@ -0,0 +1,128 @@
+"""GUI startup benchmark: time-to-first-paint and time-to-interactive.
+
+Starts a local server seeded with --history group messages, then launches
+client.py on Qt's offscreen platform --runs times and reports, from process
+launch:
+
+  launch_ms       - imports done, QApplication about to be created
+  first_paint_ms  - the main window painted for the first time
+  connected_ms    - TLS session and username handshake done
+  interactive_ms  - connected and the history fully rendered
+
+    python bench_startup.py --history 300 --runs 5
+    python bench_startup.py --server-delay 2   # first paint must not wait for the server
+
+--server-delay starts the server only after the client is launched, showing
+that the window comes up independently of the connection.
+"""
+import argparse
+import asyncio
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+from chat_client import ChatClient
+from loadgen import percentile, spawn_server, stop_server
+
+SRC_DIR = os.path.dirname(os.path.abspath(__file__))
+STAGES = ("launch", "first_paint", "connected", "interactive")
+RUN_TIMEOUT = 60
+
+
+async def seed_history(port, count):
+    async with ChatClient("seeder", "127.0.0.1", port, reconnect=False) as client:
+        for i in range(count):
+            await client.send_group(f"history message {i} " + "lorem ipsum " * (i % 8))
+        await asyncio.sleep(0.5)
+
+
+def launch_client(username, port):
+    env = dict(os.environ, QT_QPA_PLATFORM="offscreen", CHAT_STARTUP_TIMING="1")
+    return subprocess.Popen(
+        [sys.executable, os.path.join(SRC_DIR, "client.py"), username, "127.0.0.1", str(port)],
+        env=env, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, text=True)
+
+
+def measure_run(username, port, start_server=None):
+    """Launch one client; returns {stage: ms since launch}"""
+    launched = time.time()
+    proc = launch_client(username, port)
+    if start_server:
+        start_server()
+
+    marks = {}
+    timer = threading.Timer(RUN_TIMEOUT, proc.kill)
+    timer.start()
+    try:
+        for line in proc.stdout:
+            parts = line.split()
+            if len(parts) == 3 and parts[0] == "startup":
+                marks[parts[1]] = round((float(parts[2]) - launched) * 1000, 1)
+                if parts[1] == "interactive":
+                    break
+    finally:
+        timer.cancel()
+        proc.terminate()
+        proc.wait()
+    return marks
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="GUI startup benchmark (offscreen Qt)")
+    parser.add_argument("--port", type=int, default=5820)
+    parser.add_argument("--history", type=int, default=300, help="group messages seeded into history")
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--server-delay", type=float, default=0,
+                        help="start the server this many seconds after the first client launch")
+    parser.add_argument("--output", help="write JSON results to this file")
+    args = parser.parse_args(argv)
+
+    # Seeding sends far faster than the default per-user limits allow
+    limits = tempfile.NamedTemporaryFile("w", suffix=".json", delete=False)
+    json.dump({"type_limits": {"group": [100000, 100000]}, "user_limit": [100000, 100000]}, limits)
+    limits.close()
+    server_args = ["--rate-limits", limits.name]
+
+    server = {}
+
+    def start_server():
+        time.sleep(args.server_delay)
+        server["proc"], server["workdir"] = spawn_server(args.port, server_args)
+        asyncio.run(seed_history(args.port, args.history))
+
+    runs = []
+    try:
+        if args.server_delay:
+            runs.append(measure_run("bench0", args.port, start_server))
+        else:
+            start_server()
+        while len(runs) < args.runs:
+            runs.append(measure_run(f"bench{len(runs)}", args.port))
+    finally:
+        if "proc" in server:
+            stop_server(server["proc"], server["workdir"])
+        os.unlink(limits.name)
+
+    results = {}
+    for stage in STAGES:
+        values = [run[stage] for run in runs if stage in run]
+        if values:
+            results[f"{stage}_ms"] = {"p50": percentile(sorted(values), 0.5), "max": max(values)}
+    print(f"{'stage':<16}{'p50 ms':>10}{'max ms':>10}")
+    for name, value in results.items():
+        print(f"{name:<16}{value['p50']:>10}{value['max']:>10}")
+    incomplete = sum(1 for run in runs if "interactive" not in run)
+    if incomplete:
+        print(f"⚠ {incomplete} of {len(runs)} runs never became interactive")
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({"history": args.history, "runs": runs, "results": results}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
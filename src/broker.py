@@ -0,0 +1,138 @@
+import argparse
+import json
+import os
+import socket
+import threading
+
+from cluster import DEFAULT_BROKER, parse_address
+from protocol import FrameReader, encode
+
+nodes = {}  # node_id: (conn, send_lock)
+presence = {}  # node_id: last presence frame, replayed to nodes that join later
+owners = {}  # node_id: usernames connected there, from its last presence frame
+nodes_lock = threading.Lock()
+
+
+def send(node_id, data):
+    with nodes_lock:
+        entry = nodes.get(node_id)
+    if not entry:
+        return
+    conn, send_lock = entry
+    with send_lock:
+        try:
+            conn.sendall(data)
+        except (ConnectionError, OSError):
+            # Node went away, its handler will clean up
+            pass
+
+
+def relay(data, exclude=None):
+    """Forward a raw frame to every node except exclude"""
+    with nodes_lock:
+        targets = [n for n in nodes if n != exclude]
+    for node_id in targets:
+        send(node_id, data)
+
+
+def owner_of(username):
+    with nodes_lock:
+        return next((node for node, users in owners.items() if username in users), None)
+
+
+def handle_node(conn):
+    reader = FrameReader(conn)
+    node_id = None
+    try:
+        hello = reader.read()
+        if not hello or hello.get("kind") != "hello":
+            return
+        node_id = hello["node"]
+
+        with nodes_lock:
+            nodes[node_id] = (conn, threading.Lock())
+            known = [frame for n, frame in presence.items() if n != node_id]
+        print(f"✓ Node joined: {node_id}")
+
+        # Bring the new node up to date with everyone else's users
+        for frame in known:
+            send(node_id, frame)
+
+        while True:
+            line = reader.read_line()
+            if line is None:
+                break
+            try:
+                event = json.loads(line)
+            except ValueError:
+                print(f"⚠ Malformed frame from node {node_id}, skipped")
+                continue
+            frame = line + b"\n"
+            kind = event.get("kind")
+            if kind == "presence":
+                with nodes_lock:
+                    presence[node_id] = frame
+                    owners[node_id] = set(event.get("users") or ())
+            elif kind == "direct":
+                # Only the node holding the recipient can deliver it
+                target = owner_of(event.get("to"))
+                if target and target != node_id:
+                    send(target, frame)
+                continue
+            relay(frame, exclude=node_id)
+
+    except (ConnectionError, OSError, ValueError) as e:
+        print(f"Node {node_id} disconnected: {e}")
+
+    finally:
+        if node_id:
+            with nodes_lock:
+                if node_id in nodes and nodes[node_id][0] is conn:
+                    nodes.pop(node_id)
+                    presence.pop(node_id, None)
+                    owners.pop(node_id, None)
+            print(f" Node left: {node_id}")
+            # Its users are gone from the cluster
+            relay(encode({"kind": "presence", "node": node_id, "users": []}))
+        try:
+            conn.close()
+        except:
+            pass
+
+
+def open_listener(address):
+    family, sockaddr = parse_address(address)
+    if family == socket.AF_UNIX and os.path.exists(sockaddr):
+        os.unlink(sockaddr)
+
+    server = socket.socket(family, socket.SOCK_STREAM)
+    if family == socket.AF_INET:
+        server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    server.bind(sockaddr)
+    server.listen(64)
+    print(f" Cluster broker listening on {address}")
+    return server
+
+
+def accept_loop(server):
+    while True:
+        conn, _ = server.accept()
+        threading.Thread(target=handle_node,
+                         args=(conn,), daemon=True).start()
+
+
+def serve(address):
+    server = open_listener(address)
+    try:
+        accept_loop(server)
+    except KeyboardInterrupt:
+        print("\n Broker shutting down...")
+    finally:
+        server.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Chat cluster broker")
+    parser.add_argument("address", nargs="?", default=DEFAULT_BROKER,
+                        help="host:port or unix:/path/to/socket")
+    serve(parser.parse_args().address)
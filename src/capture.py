@@ -0,0 +1,129 @@
+"""Opt-in capture of the inbound message stream, for replay.py.
+
+While a capture is running every decoded message a client sends is logged
+with its timing and size, but anonymized: usernames become per-capture
+numbers, and message text, search terms and file contents are reduced to
+their lengths. The log is gzipped JSON lines: a header object, then one
+compact array per event:
+
+    [ms since start, user, type, frame bytes, {details}]
+
+Types are the protocol's message types plus "connect" and "disconnect".
+Details hold only what replay needs: "to" and "with" (anonymized), "len"
+(characters of content), "bytes" and "ext" for files, "limit" and
+"span_ms" for history_range. Off by default, it costs one check per
+message; start it with --capture or at runtime through the admin port
+with {"type": "capture", "path": "peak.log.gz"}.
+"""
+import gzip
+import json
+import os
+import threading
+import time
+
+import metrics
+
+CAPTURE_VERSION = 1
+FLUSH_INTERVAL = 1.0  # Seconds between flushes, so a killed server leaves a readable log
+
+active = None  # The running Capture, if any
+_switch = threading.Lock()
+
+events = metrics.Counter("chat_capture_events_total", "Events written to the traffic capture")
+
+
+class Capture:
+    def __init__(self, path):
+        self.path = path.replace("{pid}", str(os.getpid()))  # One file per prefork worker
+        self.file = gzip.open(self.path, "wt", encoding="utf-8")
+        self.lock = threading.Lock()
+        self.users = {}  # username: anonymized id
+        self.started = time.monotonic()
+        self.flushed = self.started
+        self.count = 0
+        header = {"capture": CAPTURE_VERSION, "started_ms": int(time.time() * 1000), "pid": os.getpid()}
+        self.file.write(json.dumps(header) + "\n")
+
+    def _user(self, username):
+        user = self.users.get(username)
+        if user is None:
+            user = self.users[username] = len(self.users)
+        return user
+
+    def write(self, username, msg_type, size=0, msg=None):
+        with self.lock:
+            if self.file is None:
+                return
+            now = time.monotonic()
+            event = [int((now - self.started) * 1000), self._user(username), msg_type, size]
+            details = msg and anonymize(self, msg)
+            if details:
+                event.append(details)
+            self.file.write(json.dumps(event, separators=(",", ":")) + "\n")
+            self.count += 1
+            if now - self.flushed > FLUSH_INTERVAL:
+                self.file.flush()
+                self.flushed = now
+        events.inc()
+
+    def close(self):
+        with self.lock:
+            self.file.close()
+            self.file = None
+
+
+def anonymize(capture, msg):
+    """The details of msg worth keeping for replay, with nothing identifying
+    (called with capture.lock held)"""
+    t = msg.get("type")
+    details = {}
+    for peer in ("to", "with"):
+        if isinstance(msg.get(peer), str):
+            details[peer] = capture._user(msg[peer])
+    if t in ("group", "private", "search"):
+        details["len"] = len(str(msg.get("content", "")))
+    elif t == "file":
+        details["bytes"] = len(msg.get("filedata", "")) * 3 // 4
+        details["ext"] = os.path.splitext(str(msg.get("filename", "")))[1][:10]
+    elif t == "history_range":
+        since, until = msg.get("since"), msg.get("until")
+        details["limit"] = msg.get("limit")
+        if isinstance(since, int) and isinstance(until, int):
+            details["span_ms"] = until - since
+    return details
+
+
+def start(path):
+    """Start capturing to path (stopping any running capture first)"""
+    global active
+    with _switch:
+        if active:
+            active.close()
+        active = Capture(path)
+    print(f"✓ Capturing traffic to {active.path}")
+    return active.path
+
+
+def stop():
+    """Stop capturing; returns (path, events written) or None if not running"""
+    global active
+    with _switch:
+        capture, active = active, None
+    if capture is None:
+        return None
+    capture.close()
+    print(f"✓ Capture stopped: {capture.count} events in {capture.path}")
+    return capture.path, capture.count
+
+
+def record(username, msg, size):
+    capture = active
+    if capture is not None:
+        capture.write(username, msg.get("type"), size, msg)
+
+
+def record_session(username, event):
+    """Log a session boundary: event is "connect" or "disconnect" """
+    capture = active
+    if capture is not None:
+        capture.write(username, event)
@@ -0,0 +1,312 @@
+"""Asyncio client library for the chat server.
+
+One ChatClient is one session; a single process can run thousands of them
+on the same event loop:
+
+    async with ChatClient("bot", "127.0.0.1") as client:
+        await client.send_group("hello")
+        async for event in client.events():
+            print(event)
+
+Events are the server's messages as dicts ({"type": "group", ...}) plus
+{"type": "connected"} and {"type": "disconnected"} when the link changes
+(and "connecting"/"connect_failed" progress from connect_with_retry()).
+After a reconnect the session resumes: the server's history only holds
+messages newer than those already delivered, not counting the user's
+own. When the server refuses the session (e.g. the username is taken)
+before sending its history, "disconnected" carries its "error" message
+and the events end; any other lost link is retried.
+BackgroundClient runs a session on its own thread for synchronous callers
+such as the Qt GUI.
+"""
+import asyncio
+import base64
+import json
+import random
+import ssl
+import threading
+from datetime import datetime
+
+from protocol import MAX_FRAME_SIZE, encode
+
+DEFAULT_PORT = 5000
+RECONNECT_MIN_DELAY = 0.5  # Seconds before the first reconnect attempt
+RECONNECT_MAX_DELAY = 30.0
+PING_INTERVAL = 15  # Seconds between heartbeats (server drops clients silent for 45s)
+SERVER_TIMEOUT = 40  # Seconds without any server traffic before the link is presumed dead
+CONNECT_TIMEOUT = 10  # Seconds for one connect attempt (TCP + TLS + username)
+
+
+def format_timestamp(ms, fmt="%H:%M"):
+    """Local time of a server timestamp (epoch ms); now when it is missing"""
+    if not isinstance(ms, (int, float)):
+        return datetime.now().strftime(fmt)
+    return datetime.fromtimestamp(ms / 1000).strftime(fmt)
+
+
+def default_ssl_context():
+    """The server uses a self-signed certificate, so skip verification"""
+    context = ssl.create_default_context()
+    context.check_hostname = False
+    context.verify_mode = ssl.CERT_NONE
+    return context
+
+
+class ChatClient:
+    def __init__(self, username, host="127.0.0.1", port=DEFAULT_PORT,
+                 ssl_context=None, reconnect=True):
+        self.username = username
+        self.host = host
+        self.port = port
+        self.ssl_context = ssl_context or default_ssl_context()
+        self.reconnect = reconnect
+        self.reader = None
+        self.writer = None
+        self.connected = False
+        self.closed = False
+        self.queue = asyncio.Queue()
+        self.transfers = {}  # file_chunk id: data received so far
+        self.last_seen = None  # Timestamp (epoch ms) of the newest message delivered
+        self.reader_task = None
+        self.heartbeat_task = None
+
+    async def __aenter__(self):
+        await self.connect()
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.close()
+
+    async def connect(self):
+        """Connect and start receiving; raises if the server is unreachable"""
+        await self._open()
+        if self.reader_task is None or self.reader_task.done():
+            self.reader_task = asyncio.create_task(self._read_loop())
+        if self.heartbeat_task is None or self.heartbeat_task.done():
+            self.heartbeat_task = asyncio.create_task(self._heartbeat())
+
+    async def connect_with_retry(self):
+        """Like connect(), but retry with backoff until it succeeds, reporting
+        {"type": "connecting"} and {"type": "connect_failed"} events"""
+        delay = RECONNECT_MIN_DELAY
+        attempt = 1
+        while not self.closed:
+            self.queue.put_nowait({"type": "connecting", "attempt": attempt})
+            try:
+                await asyncio.wait_for(self.connect(), CONNECT_TIMEOUT)
+                return
+            except (ConnectionError, OSError, ssl.SSLError, asyncio.TimeoutError) as e:
+                retry_in = delay * random.uniform(0.5, 1.0)
+                self.queue.put_nowait({"type": "connect_failed", "error": str(e) or type(e).__name__,
+                                       "retry_in": round(retry_in, 1)})
+                await asyncio.sleep(retry_in)
+                delay = min(delay * 2, RECONNECT_MAX_DELAY)
+                attempt += 1
+
+    async def _open(self):
+        """Open the TLS connection and send the username handshake"""
+        self.reader, self.writer = await asyncio.open_connection(
+            self.host, self.port, ssl=self.ssl_context, limit=MAX_FRAME_SIZE)
+        if self.last_seen is None:
+            self.writer.write(self.username.encode() + b"\n")
+        else:
+            # Resume: the history sent on connect skips what was delivered
+            self.writer.write(encode({"username": self.username, "since": self.last_seen}))
+        await self.writer.drain()
+        self.connected = True
+        self.queue.put_nowait({"type": "connected"})
+
+    async def close(self):
+        self.closed = True
+        self.connected = False
+        if self.writer:
+            self.writer.close()
+        for task in (self.reader_task, self.heartbeat_task):
+            if task:
+                task.cancel()
+                try:
+                    await task
+                except asyncio.CancelledError:
+                    pass
+        self.queue.put_nowait(None)  # Ends events()
+
+    def _seen(self, msg):
+        """Update last_seen from a message event; history that was already
+        delivered before a reconnect is dropped from it"""
+        if msg.get("type") == "history":
+            if self.last_seen is not None:
+                msg["messages"] = [m for m in msg["messages"] if m.get("timestamp", 0) > self.last_seen
+                                   and m.get("sender") != self.username]
+            stamps = [m.get("timestamp", 0) for m in msg["messages"]]
+        elif msg.get("type") in ("group", "private", "file"):
+            stamps = [msg.get("timestamp", 0)]
+        else:
+            return
+        stamps = [t for t in stamps if isinstance(t, int)]
+        if stamps:
+            self.last_seen = max(stamps + [self.last_seen or 0])
+
+    async def _read_loop(self):
+        delay = RECONNECT_MIN_DELAY
+        while not self.closed:
+            hint = None  # A server message saying when to come back (restart or overload)
+            refused = None  # An error the server closed the connection after
+            last = None
+            greeted = False  # The session was accepted (its history arrived)
+            try:
+                while True:
+                    # Heartbeat pongs guarantee traffic, so silence means a dead link
+                    line = await asyncio.wait_for(self.reader.readline(), SERVER_TIMEOUT)
+                    if not line:
+                        # Only the handshake (empty or taken username) is refused
+                        # with an error and EOF; later errors are per message
+                        if not greeted and last and last.get("type") == "error":
+                            refused = last
+                        break
+                    if line.strip():
+                        msg = last = json.loads(line)
+                        greeted = greeted or msg.get("type") == "history"
+                        if msg.get("type") == "reconnect" or msg.get("code") == "server_busy":
+                            hint = msg
+                            break
+                        if msg.get("type") == "file_chunk":
+                            self.transfers.setdefault(msg.get("id"), []).append(msg.get("data", ""))
+                            continue
+                        if "chunked" in msg:
+                            # The file's data came ahead of it in chunks
+                            msg["filedata"] = "".join(self.transfers.pop(msg.pop("chunked"), ()))
+                        if msg.get("type") != "pong":
+                            self._seen(msg)
+                            self.queue.put_nowait(msg)
+                    delay = RECONNECT_MIN_DELAY
+            except asyncio.TimeoutError:
+                print(f"⚠ No traffic from server for {SERVER_TIMEOUT}s, reconnecting")
+            except (ConnectionError, OSError, ValueError, ssl.SSLError):
+                pass
+
+            self.connected = False
+            self.transfers.clear()  # Files cut off mid-transfer
+            if self.writer:
+                self.writer.close()
+            if self.closed:
+                break
+            if refused:
+                # Retrying would be refused the same way
+                self.queue.put_nowait({"type": "disconnected", "error": refused.get("message", "")})
+                self.queue.put_nowait(None)
+                break
+            self.queue.put_nowait({"type": "disconnected"})
+            if hint:
+                self.queue.put_nowait(hint)
+            if not self.reconnect:
+                self.queue.put_nowait(None)
+                break
+
+            # Reconnect with exponential backoff and jitter, first honouring
+            # the server's hint so a restart does not cause a stampede
+            while not self.closed and not self.connected:
+                if hint:
+                    await asyncio.sleep(hint.get("retry_after_ms", 0) / 1000)
+                    hint = None
+                else:
+                    await asyncio.sleep(delay * random.uniform(0.5, 1.0))
+                delay = min(delay * 2, RECONNECT_MAX_DELAY)
+                try:
+                    await self._open()
+                except (ConnectionError, OSError, ssl.SSLError):
+                    pass
+
+    async def _heartbeat(self):
+        while not self.closed:
+            await asyncio.sleep(PING_INTERVAL)
+            if self.connected:
+                try:
+                    await self.send({"type": "ping"})
+                except (ConnectionError, OSError):
+                    pass
+
+    async def events(self):
+        """Yield incoming events until the client is closed"""
+        while True:
+            event = await self.queue.get()
+            if event is None:
+                return
+            yield event
+
+    async def send(self, msg):
+        if not self.connected:
+            raise ConnectionError("Not connected to the chat server")
+        self.writer.write(encode(msg))
+        await self.writer.drain()
+
+    async def send_group(self, content):
+        await self.send({"type": "group", "content": content})
+
+    async def send_private(self, to, content):
+        await self.send({"type": "private", "to": to, "content": content})
+
+    async def send_typing(self, to=None):
+        """Typing indicator: to a user, or to the group when to is None"""
+        await self.send({"type": "typing", "to": to})
+
+    async def send_file(self, filename, data):
+        await self.send({"type": "file", "filename": filename,
+                         "filedata": base64.b64encode(data).decode()})
+
+    async def search(self, keyword):
+        await self.send({"type": "search", "content": keyword})
+
+    async def history_range(self, since=None, until=None, with_user=None, limit=None):
+        """Ask for a slice of history (epoch ms bounds, until exclusive) of the
+        group, or of the private chat with with_user; answered by a
+        {"type": "history_range"} event"""
+        msg = {"type": "history_range", "with": with_user, "since": since, "until": until}
+        if limit is not None:
+            msg["limit"] = limit
+        await self.send(msg)
+
+
+class BackgroundClient:
+    """Runs a ChatClient on a private event loop thread.
+
+    Events are buffered until listen(on_event) is called; on_event then runs
+    on the loop thread for every event. send() may be called from any thread
+    and does not block.
+    """
+
+    def __init__(self, client):
+        self.client = client
+        self.loop = asyncio.new_event_loop()
+        self.thread = threading.Thread(target=self.loop.run_forever, daemon=True)
+
+    def start(self, wait=True):
+        """Start the loop and connect. With wait, block until connected and
+        raise if that fails; otherwise return at once and keep retrying in
+        the background (progress arrives as events)."""
+        self.thread.start()
+        if wait:
+            asyncio.run_coroutine_threadsafe(self.client.connect(), self.loop).result()
+        else:
+            asyncio.run_coroutine_threadsafe(self.client.connect_with_retry(), self.loop)
+
+    def listen(self, on_event):
+        asyncio.run_coroutine_threadsafe(self._pump(on_event), self.loop)
+
+    async def _pump(self, on_event):
+        async for event in self.client.events():
+            try:
+                on_event(event)
+            except Exception as e:
+                print(f"Error handling event {event.get('type')}: {e}")
+
+    def send(self, msg):
+        future = asyncio.run_coroutine_threadsafe(self.client.send(msg), self.loop)
+        future.add_done_callback(self._report)
+
+    def _report(self, future):
+        if future.exception():
+            print(f"⚠ Send failed: {future.exception()}")
+
+    def stop(self):
+        asyncio.run_coroutine_threadsafe(self.client.close(), self.loop).result(timeout=5)
+        self.loop.call_soon_threadsafe(self.loop.stop)
@@ -2,16 +2,31 @@ import base64
 import json
 import os
 import sys
-import threading
+import time as clock
+from collections import deque
 from datetime import datetime
 
 from PyQt5.QtCore import Qt, QTimer
 from PyQt5.QtGui import QFont, QTextCursor
 from PyQt5.QtWidgets import *
 
-from client_connection import conn, USERNAME
+import memstats
+from chat_client import format_timestamp
+from client_connection import session, USERNAME, SERVER_IP, PORT
 from signals import Signals
-from private_chat import PrivateChat
+from private_chat import MAX_CHAT_BLOCKS, PrivateChat
+from user_list import UserListModel, UserListView
+
+HISTORY_BATCH = 40  # History messages rendered per event-loop turn
+STARTUP_TIMING = os.environ.get("CHAT_STARTUP_TIMING")  # Print startup marks for bench_startup.py
+SOAK_REPORT = float(os.environ.get("CHAT_SOAK_REPORT") or 0)  # Seconds between memory reports for soak.py
+DOWNLOAD_CACHE_BYTES = 64 * 1024 * 1024  # Received file data kept for saving; the oldest files go first
+ERROR_NOTICE_MS = 5000  # How long a server error stays in the status bar
+
+
+def mark(stage):
+    if STARTUP_TIMING:
+        print(f"startup {stage} {clock.time():.6f}", flush=True)
 
 
 class Chat(QWidget):
@@ -23,16 +38,31 @@ class Chat(QWidget):
 
         self.sig = Signals()
         self.sig.status.connect(self.update_users)
-        self.sig.message.connect(self.show_message)
+        self.sig.message.connect(self.queue_message)
         self.sig.typing.connect(self.show_typing)
         self.sig.private_typing.connect(self.show_private_typing)
+        self.sig.connection.connect(self.set_connected)
+        self.sig.progress.connect(self.show_progress)
+        self.sig.history.connect(self.queue_history)
+        self.sig.error.connect(self.show_error)
 
         self.typing_users = {}
         self.typing_timers = {}  # Track typing timers per user
         self.typing_indicator_ids = {}  # Track typing indicator HTML IDs
         self.private_chats = {}
+        self.download_cache = {}  # filename: base64 data, oldest first
+        self.download_cache_bytes = 0
         self.dark_mode = True
-        self.connected = True
+        self.connected = False
+        self.refused = None  # The server's reason for refusing the session
+        self.painted = False
+        self.interactive = False  # Connected and history rendered
+        # History is rendered a batch per event-loop turn so the window stays
+        # responsive; live messages queue behind it to keep the order
+        self.pending = deque()
+        self.render_timer = QTimer()
+        self.render_timer.setInterval(0)
+        self.render_timer.timeout.connect(self.render_pending)
         self.last_typing_sent = 0  # Track last typing notification time
         self.typing_debounce_timer = QTimer()
         self.typing_debounce_timer.setSingleShot(True)
@@ -56,7 +86,7 @@ class Chat(QWidget):
         toolbar.addStretch()
 
         # Connection status
-        self.status_label = QLabel("🟢 Connected")
+        self.status_label = QLabel(f"⏳ Connecting to {SERVER_IP}:{PORT}...")
         self.status_label.setFont(QFont("Arial", 9))
         toolbar.addWidget(self.status_label)
 
@@ -95,6 +125,7 @@ class Chat(QWidget):
         self.chat.setSource = lambda url: None
         self.chat.setOpenExternalLinks(False)  # Now this will work!
         self.chat.setFont(QFont("Segoe UI", 10))
+        self.chat.document().setMaximumBlockCount(MAX_CHAT_BLOCKS)
         chat_layout.addWidget(self.chat)
 
         # Typing indicator label
@@ -162,8 +193,17 @@ class Chat(QWidget):
         users_label.setFont(QFont("Arial", 11, QFont.Bold))
         users_layout.addWidget(users_label)
 
-        self.users = QListWidget()
-        self.users.itemDoubleClicked.connect(self.open_private_chat)
+        self.user_filter = QLineEdit()
+        self.user_filter.setPlaceholderText("🔍 Filter users...")
+        self.user_filter.setClearButtonEnabled(True)
+        users_layout.addWidget(self.user_filter)
+
+        # Model-backed: status updates insert/remove rows instead of rebuilding
+        self.user_model = UserListModel(exclude=USERNAME)
+        self.users = UserListView(self.user_model)
+        self.users.doubleClicked.connect(self.open_private_chat)
+        self.users.typed.connect(self.type_to_filter)
+        self.user_filter.textChanged.connect(self.users.set_filter)
         self.users.setMinimumWidth(200)
         users_layout.addWidget(self.users)
 
@@ -182,8 +222,68 @@ class Chat(QWidget):
         # Apply styling
         self.setStyleSheet(self.dark_stylesheet())
 
-        # Start listening thread
-        threading.Thread(target=self.listen, daemon=True).start()
+        # Receive events from the client session (delivered on its thread)
+        session.listen(self.handle_event)
+
+        if SOAK_REPORT:
+            self.soak_timer = QTimer()
+            self.soak_timer.timeout.connect(self.report_memory)
+            self.soak_timer.start(int(SOAK_REPORT * 1000))
+
+    def paintEvent(self, event):
+        super().paintEvent(event)
+        if not self.painted:
+            self.painted = True
+            mark("first_paint")
+
+    def report_memory(self):
+        """Print memory figures and the sizes of long-lived structures for soak.py"""
+        views = [self.chat] + [chat.chat for chat in self.private_chats.values()]
+        report = {**memstats.snapshot(10),
+                  "download_cache": len(self.download_cache),
+                  "download_cache_bytes": self.download_cache_bytes,
+                  "download_cache_limit": DOWNLOAD_CACHE_BYTES,
+                  "typing_timers": len(self.typing_timers),
+                  "typing_users": len(self.typing_users),
+                  "private_chats": len(self.private_chats),
+                  "document_blocks": sum(view.document().blockCount() for view in views),
+                  "document_chars": sum(view.document().characterCount() for view in views),
+                  "time": clock.time()}
+        print(f"soak {json.dumps(report)}", flush=True)
+
+    def cache_download(self, filename, filedata):
+        if filename in self.download_cache:
+            self.download_cache_bytes -= len(self.download_cache.pop(filename))
+        self.download_cache[filename] = filedata
+        self.download_cache_bytes += len(filedata)
+        while self.download_cache_bytes > DOWNLOAD_CACHE_BYTES and len(self.download_cache) > 1:
+            oldest = next(iter(self.download_cache))
+            self.download_cache_bytes -= len(self.download_cache.pop(oldest))
+
+    def queue_message(self, msg):
+        if self.pending:
+            self.pending.append(msg)
+            return
+        self.show_message(msg)
+
+    def queue_history(self, messages):
+        self.pending.extend(messages)
+        self.render_timer.start()
+
+    def render_pending(self):
+        self.chat.setUpdatesEnabled(False)
+        for _ in range(min(HISTORY_BATCH, len(self.pending))):
+            self.show_message(self.pending.popleft())
+        self.chat.setUpdatesEnabled(True)
+        if not self.pending:
+            self.render_timer.stop()
+            if not self.interactive:
+                self.interactive = True
+                mark("interactive")
+
+    def show_progress(self, text):
+        if not self.connected:
+            self.status_label.setText(text)
 
     def toggle_mode(self):
         self.dark_mode = not self.dark_mode
@@ -229,22 +329,22 @@ class Chat(QWidget):
             border: 2px solid #58A6FF;
             background: #1C2128;
         }
-        QListWidget {
+        QListView {
             background: #161B22;
             border: 1px solid #30363D;
             border-radius: 8px;
             color: #E6EDF3;
             padding: 5px;
         }
-        QListWidget::item {
+        QListView::item {
             padding: 8px;
             border-radius: 6px;
             margin: 2px;
         }
-        QListWidget::item:hover {
+        QListView::item:hover {
             background: #21262D;
         }
-        QListWidget::item:selected {
+        QListView::item:selected {
             background: #1F6FEB;
             color: white;
         }
@@ -301,22 +401,22 @@ class Chat(QWidget):
             border: 2px solid #0969DA;
             background: #FFFFFF;
         }
-        QListWidget {
+        QListView {
             background: #F6F8FA;
             border: 1px solid #D1D9DE;
             border-radius: 8px;
             color: #1F2328;
             padding: 5px;
         }
-        QListWidget::item {
+        QListView::item {
             padding: 8px;
             border-radius: 6px;
             margin: 2px;
         }
-        QListWidget::item:hover {
+        QListView::item:hover {
             background: #E7ECF0;
         }
-        QListWidget::item:selected {
+        QListView::item:selected {
             background: #0969DA;
             color: white;
         }
@@ -355,7 +455,7 @@ class Chat(QWidget):
             self.remove_typing(USERNAME)
 
             payload = {"type": "group", "content": msg}
-            conn.sendall(json.dumps(payload).encode())
+            session.send(payload)
             self.show_message(USERNAME, msg)  # show locally
             self.input.clear()
             self.last_typing_sent = 0
@@ -367,7 +467,7 @@ class Chat(QWidget):
                 data = base64.b64encode(f.read()).decode()
             payload = {"type": "file", "filename": os.path.basename(
                 path), "filedata": data}
-            conn.sendall(json.dumps(payload).encode())
+            session.send(payload)
             self.show_message(USERNAME, f"Sent file: {os.path.basename(path)}")
             self.remove_typing(USERNAME)
 
@@ -379,11 +479,11 @@ class Chat(QWidget):
             filename = url_str.split("file:")[1]
 
             # Retrieve the base64 data we saved earlier
-            filedata_base64 = getattr(self, 'download_cache', {}).get(filename)
+            filedata_base64 = self.download_cache.get(filename)
 
             if not filedata_base64:
                 QMessageBox.warning(self, "Download Error",
-                                    "File data not found in current session.")
+                                    "File data not found in current session (or no longer cached).")
                 return
 
             # Open Save File Dialog
@@ -403,8 +503,7 @@ class Chat(QWidget):
     def search_messages(self):
         key = self.search_input.text().strip()
         if key:
-            conn.sendall(json.dumps(
-                {"type": "search", "content": key}).encode())
+            session.send({"type": "search", "content": key})
 
     def on_group_text_changed(self):
         """Handle text changes in group chat with debouncing"""
@@ -426,7 +525,7 @@ class Chat(QWidget):
     def send_group_typing(self):
         """Send typing notification for group chat"""
         if self.input.text().strip():
-            conn.sendall(json.dumps({"type": "typing", "to": None}).encode())
+            session.send({"type": "typing", "to": None})
             self.last_typing_sent = datetime.now().timestamp()
 
     def show_message(self, msg_or_sender, content=None):
@@ -456,14 +555,7 @@ class Chat(QWidget):
             return
 
         # Group/file messages
-        if timestamp:
-            try:
-                dt = datetime.strptime(timestamp, "%Y-%m-%d %H:%M:%S")
-                time = dt.strftime("%H:%M")
-            except ValueError:
-                time = timestamp
-        else:
-            time = datetime.now().strftime("%H:%M")
+        time = format_timestamp(timestamp)
 
         date = datetime.now().strftime("%Y-%m-%d")
         is_own = sender == USERNAME
@@ -484,9 +576,7 @@ class Chat(QWidget):
             content = f'<a href="file:{content}" style="color:#58A6FF; text-decoration:none;">{file_icon} {content}</a>'
             # Store the data globally so we can access it when clicked
             if file_data:
-                if not hasattr(self, 'download_cache'):
-                    self.download_cache = {}
-                self.download_cache[msg.get("filename")] = file_data
+                self.cache_download(msg.get("filename"), file_data)
 
         bubble = f"""
         <div style="background:{bg_color};color:{text_color};padding:12px 16px;border-radius:18px;
@@ -544,7 +634,7 @@ class Chat(QWidget):
         for res in results:
             r_sender = res.get("sender", "Unknown")
             r_content = res.get("content", "")
-            r_time = res.get("timestamp", "")
+            r_time = format_timestamp(res.get("timestamp"), "%Y-%m-%d %H:%M")
 
             html = f"""
             <div style="background:{bg}; border:1px solid {border}; border-radius:6px; padding:8px; margin:4px 0;">
@@ -615,8 +705,10 @@ class Chat(QWidget):
 
         self.typing_label.setText(text)
 
-    def open_private_chat(self, item):
-        username = item.text().replace("🟢 ", "").strip()
+    def open_private_chat(self, index):
+        self.open_private_chat_with(index.data(Qt.UserRole))
+
+    def open_private_chat_with(self, username):
         if username not in self.private_chats:
             self.private_chats[username] = PrivateChat(username, self)
         self.private_chats[username].show()
@@ -624,19 +716,20 @@ class Chat(QWidget):
         self.private_chats[username].activateWindow()
 
     def open_selected_private_chat(self):
-        user = self.users.currentItem()
+        user = self.users.selected_user()
         if user:
-            self.open_private_chat(user)
+            self.open_private_chat_with(user)
         else:
             QMessageBox.information(
                 self, "No User Selected", "Please select a user from the list first.")
 
+    def type_to_filter(self, text):
+        """Keys typed in the user list go to the filter box"""
+        self.user_filter.setFocus()
+        self.user_filter.insert(text)
+
     def update_users(self, users):
-        self.users.clear()
-        for user in users:
-            if user != USERNAME:  # Don't show self in list
-                item = QListWidgetItem(f"🟢 {user}")
-                self.users.addItem(item)
+        self.users.set_users(users)
 
         # Update connection status
         if self.connected:
@@ -644,48 +737,78 @@ class Chat(QWidget):
         else:
             self.status_label.setText("🔴 Disconnected")
 
-    def listen(self):
-        while True:
-            try:
-                data = conn.recv(8192)
-                if not data:
-                    self.connected = False
-                    self.status_label.setText("🔴 Disconnected")
-                    break
-                msg = json.loads(data.decode())
-                if msg["type"] == "status":
-                    self.sig.status.emit(msg["users"])
-                elif msg["type"] == "history":
-                    for m in msg["messages"]:
-                        self.sig.message.emit({
-                            "sender": m["sender"],
-                            "content": m["content"],
-                            "type": m.get("type", "group"),
-                            "to": m.get("receiver"),
-                            "status": "",
-                            "filename": m["content"] if m.get("type") == "file" else "",
-                            "timestamp": m.get("timestamp")
-                        })
-                elif msg["type"] == "typing":
-                    sender = msg.get("sender")
-                    to_user = msg.get("to")
-                    # If it's a private typing indicator, route to private chat via signal
-                    if to_user and to_user == USERNAME:
-                        self.sig.private_typing.emit(sender)
-                    else:
-                        # Group typing indicator
-                        self.sig.typing.emit(sender)
-                else:
-                    self.sig.message.emit(msg)
-                self.connected = True
-                if self.status_label.text().startswith("🔴"):
-                    self.status_label.setText("🟢 Connected")
-            except Exception as e:
-                self.connected = False
-                self.status_label.setText("🔴 Connection Error")
-                break
-
-
-app = QApplication(sys.argv)
-Chat().show()
-sys.exit(app.exec_())
+    def set_connected(self, connected):
+        self.connected = connected
+        if connected:
+            mark("connected")
+            self.status_label.setText("🟢 Connected")
+        else:
+            self.status_label.setText("🔴 Disconnected - reconnecting...")
+
+    def show_error(self, msg):
+        """Server errors go to the status bar; a refused session (the client
+        no longer reconnects) also gets a dialog"""
+        if msg["type"] == "disconnected":
+            self.refused = msg["error"] or "The server closed the connection"
+            self.status_label.setText(f"⛔ {self.refused}")
+            QMessageBox.critical(self, "Disconnected", self.refused)
+            return
+        self.status_label.setText(f"⚠ {msg.get('message', 'Server error')}")
+        QTimer.singleShot(ERROR_NOTICE_MS, self.clear_error)
+
+    def clear_error(self):
+        if self.connected and not self.refused:
+            self.status_label.setText("🟢 Connected")
+
+    def handle_event(self, msg):
+        """Route a session event to the GUI thread through signals"""
+        if msg["type"] == "connected":
+            self.sig.connection.emit(True)
+        elif msg["type"] == "disconnected":
+            self.sig.connection.emit(False)
+            if "error" in msg:
+                self.sig.error.emit(msg)
+        elif msg["type"] == "error":
+            self.sig.error.emit(msg)
+        elif msg["type"] == "connecting":
+            attempt = f" (attempt {msg['attempt']})" if msg["attempt"] > 1 else ""
+            self.sig.progress.emit(f"⏳ Connecting to {SERVER_IP}:{PORT}{attempt}...")
+        elif msg["type"] == "reconnect":
+            self.sig.progress.emit(
+                f"🔄 Server restarting - reconnecting in {msg.get('retry_after_ms', 0) / 1000:.1f}s")
+        elif msg["type"] == "connect_failed":
+            self.sig.progress.emit(f"🔴 {msg['error']} - retrying in {msg['retry_in']}s")
+        elif msg["type"] == "status":
+            self.sig.status.emit(msg["users"])
+        elif msg["type"] in ("history", "history_range"):
+            # Converted here on the session thread; the GUI thread only renders
+            self.sig.history.emit([{
+                "sender": m["sender"],
+                "content": m["content"],
+                "type": m.get("type", "group"),
+                "to": m.get("receiver"),
+                "status": "",
+                "filename": m["content"] if m.get("type") == "file" else "",
+                "timestamp": m.get("timestamp")
+            } for m in msg["messages"]])
+        elif msg["type"] == "typing":
+            sender = msg.get("sender")
+            to_user = msg.get("to")
+            # If it's a private typing indicator, route to private chat via signal
+            if to_user and to_user == USERNAME:
+                self.sig.private_typing.emit(sender)
+            else:
+                # Group typing indicator
+                self.sig.typing.emit(sender)
+        else:
+            self.sig.message.emit(msg)
+
+
+if __name__ == "__main__":
+    mark("launch")
+    app = QApplication(sys.argv)
+    window = Chat()
+    window.show()
+    # Connect only once the window exists, without blocking the GUI thread
+    session.start(wait=False)
+    sys.exit(app.exec_())
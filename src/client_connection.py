@@ -1,20 +1,15 @@
-import socket
-import ssl
 import sys
 
+from chat_client import BackgroundClient, ChatClient, DEFAULT_PORT
+
 if len(sys.argv) < 2:
-    print("Usage: python client.py <username> [server_ip]")
+    print("Usage: python client.py <username> [server_ip] [port]")
     sys.exit(1)
 
 USERNAME = sys.argv[1]
 SERVER_IP = sys.argv[2] if len(sys.argv) > 2 else "127.0.0.1"
-PORT = 5000
-
-sock = socket.socket()
-context = ssl.create_default_context()
-context.check_hostname = False
-context.verify_mode = ssl.CERT_NONE
-conn = context.wrap_socket(sock)
+PORT = int(sys.argv[3]) if len(sys.argv) > 3 else DEFAULT_PORT
 
-conn.connect((SERVER_IP, PORT))
-conn.sendall(USERNAME.encode())
+# The GUI drives one ChatClient session on a background event loop; the
+# window starts it with session.start(wait=False) once it is on screen
+session = BackgroundClient(ChatClient(USERNAME, SERVER_IP, PORT))
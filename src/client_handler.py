@@ -1,186 +1,382 @@
-import base64
+import binascii
 import json
 import os
-from server_state import clients, clients_lock, db, UPLOADS_DIR
-
-
-def broadcast(data, exclude=None):
-    """Send data to all clients except exclude"""
-    with clients_lock:
-        clients_copy = dict(clients)  # Create a copy to avoid lock issues
-
-    for user, conn in clients_copy.items():
+import random
+import socket
+import time
+import capture
+import metrics
+import offload
+import ratelimit
+import server_state
+import tracing
+from connection import ClientConnection, lane_for
+from protocol import FrameReader, encode_frames, next_transfer
+from database import HISTORY_RANGE_LIMIT, KEY_SEPARATOR
+from server_state import clients, db, UPLOADS_DIR
+
+IDLE_TIMEOUT = 45  # Seconds of silence (no message, not even a ping) before a client is dropped
+DRAIN_TIMEOUT = 5  # Seconds a graceful shutdown waits for handlers to finish
+
+evictions = metrics.Counter("chat_evictions_total", "Clients dropped by the server", ("reason",))
+
+
+def send(conn, msg):
+    """Queue msg on conn in its type's priority lane"""
+    conn.send_frames(encode_frames(msg), lane_for(msg.get("type")))
+
+
+def evict(username, conn, reason):
+    """Drop a client right away; its handler thread finishes the cleanup"""
+    if not clients.remove(username, conn):
+        return
+    metrics.connected_clients.set(len(clients))
+    capture.record_session(username, "disconnect")
+    evictions.inc(reason=reason)
+    print(f"⚠ Evicted {username}: {reason}")
+    conn.abort()
+
+
+def drain(window):
+    """Graceful shutdown: hint every client to reconnect at a random point in
+    the next `window` seconds, disconnect them and wait for their handlers"""
+    local = list(clients.items())
+    for username, conn in local:
+        hint = {"type": "reconnect", "retry_after_ms": int(random.uniform(0, window) * 1000)}
+        try:
+            send(conn, hint)
+        except (ConnectionError, OSError):
+            pass
+        # Waits out any write in flight to this client; nothing follows the hint
+        conn.flush(timeout=1)
+        conn.abort()
+
+    deadline = time.time() + DRAIN_TIMEOUT
+    while len(clients) and time.time() < deadline:
+        time.sleep(0.05)
+    # Any insert still in progress finishes (and commits) before we return
+    db.flush()
+    print(f"✓ Drained {len(local)} clients")
+
+
+def broadcast(msg, exclude=None, relay=True, frames=None):
+    """Send msg (or its already encoded frames) to all clients except
+    exclude (and to other cluster nodes)"""
+    start = time.perf_counter()
+    if frames is None:
+        frames = encode_frames(msg)  # Encoded once, shared by every recipient
+    lane = lane_for(msg.get("type"))
+    for user, conn in clients.items():
         if user != exclude:
             try:
-                conn.sendall(data)
-            except (ConnectionError, OSError, BrokenPipeError) as e:
-                # Client disconnected, will be cleaned up on next status update
-                pass
+                conn.send_frames(frames, lane)
+            except (ConnectionError, OSError, BrokenPipeError):
+                # Don't keep paying for a dead socket on every broadcast
+                evict(user, conn, "write_failed")
+
+    if relay and server_state.cluster:
+        server_state.cluster.publish(
+            {"kind": "broadcast", "msg": msg, "exclude": exclude})
+    metrics.fanout_seconds.observe(time.perf_counter() - start, type=msg.get("type"))
+
+
+def send_to(username, msg, relay=True):
+    """Deliver msg to one user, wherever in the cluster they are connected"""
+    with metrics.fanout_seconds.time(type=msg.get("type")):
+        conn = clients.get(username)
+        if conn:
+            try:
+                send(conn, msg)
+            except (ConnectionError, OSError, BrokenPipeError):
+                evict(username, conn, "write_failed")
+            return
+
+        if relay and server_state.cluster and server_state.cluster.has_user(username):
+            server_state.cluster.publish({"kind": "direct", "to": username, "msg": msg})
 
 
-def broadcast_status():
+def broadcast_status(relay=True):
     """Send online users list"""
-    with clients_lock:
-        users_list = list(clients.keys())
-        clients_copy = dict(clients)
+    local = list(clients.items())
+    local_users = [user for user, _ in local]
+
+    users_list = local_users
+    if server_state.cluster:
+        if relay:
+            server_state.cluster.publish({"kind": "presence", "users": local_users})
+        users_list = sorted(set(local_users) | set(server_state.cluster.remote_users()))
 
-    data = json.dumps({"type": "status", "users": users_list}).encode()
-    for conn in clients_copy.values():
+    frames = encode_frames({"type": "status", "users": users_list})
+    for user, conn in local:
         try:
-            conn.sendall(data)
+            conn.send_frames(frames, lane_for("status"))
         except (ConnectionError, OSError, BrokenPipeError):
-            # Client disconnected, will be cleaned up
-            pass
-
+            evict(user, conn, "write_failed")
+
+
+def handle_cluster_event(event):
+    """Apply an event relayed from another node to local clients"""
+    kind = event.get("kind")
+    if kind == "broadcast":
+        broadcast(event["msg"], exclude=event.get("exclude"), relay=False)
+    elif kind == "direct":
+        send_to(event["to"], event["msg"], relay=False)
+    elif kind == "presence":
+        broadcast_status(relay=False)
+
+
+def format_history(msg):
+    """A stored message as sent to clients (timestamp in epoch ms)"""
+    formatted = {
+        "sender": msg.get("sender", ""),
+        "content": msg.get("content", ""),
+        "type": msg.get("type", "group"),
+        "timestamp": msg.get("timestamp")
+    }
+    # For private messages, include receiver info
+    if msg.get("type") == "private":
+        formatted["receiver"] = msg.get("receiver", "")
+    return formatted
+
+
+def handle_group(conn, username, msg, trace):
+    content = msg.get("content", "").strip()
+    if content:
+        with trace.span("persist"):
+            timestamp = db.insert_message(username, "group", content, "group")
+        payload = {"type": "group", "sender": username, "content": content, "timestamp": timestamp}
+        with trace.span("fanout"):
+            broadcast(payload, exclude=username)
+
+
+def valid_username(name):
+    """A separator in a name would make private conversation keys ambiguous:
+    ("a", "b|c") and ("a|b", "c") are both "a|b|c" """
+    return isinstance(name, str) and bool(name) and KEY_SEPARATOR not in name
+
+
+def handle_private(conn, username, msg, trace):
+    to = msg.get("to")
+    content = msg.get("content", "").strip()
+
+    if not valid_username(to) or not content:
+        return
+
+    with trace.span("persist"):
+        timestamp = db.insert_message(username, to, content, "private")
+    payload = {
+        "type": "private",
+        "sender": username,
+        "to": to,
+        "content": content,
+        "timestamp": timestamp
+    }
+
+    # Send to recipient if online
+    with trace.span("fanout"):
+        send_to(to, payload)
+
+
+def handle_file(conn, username, msg, trace):
+    filename = msg.get("filename", "unknown_file")
+    filedata_str = msg.get("filedata", "")
+
+    if not filedata_str:
+        return
+
+    # Handle filename collisions by adding timestamp
+    base_name, ext = os.path.splitext(filename)
+    safe_filename = filename
+    counter = 1
+    while os.path.exists(os.path.join(UPLOADS_DIR, safe_filename)):
+        safe_filename = f"{base_name}_{counter}{ext}"
+        counter += 1
+
+    upload_start = time.perf_counter()
+    path = os.path.join(UPLOADS_DIR, safe_filename)
+    try:
+        with trace.span("decode_file"):
+            size = offload.run("upload", len(filedata_str), offload.store_upload, path, filedata_str)
+    except binascii.Error as e:
+        print(f"Error decoding file data from {username}: {e}")
+        return
+    except Exception as e:
+        print(f"Error saving file from {username}: {e}")
+        return
 
-def handle_client(conn):
+    try:
+        with trace.span("persist"):
+            timestamp = db.insert_message(username, "FILE", safe_filename, "file")
+        metrics.upload_bytes.inc(size)
+        metrics.upload_seconds.observe(time.perf_counter() - upload_start)
+        payload = {"type": "file", "sender": username,
+                   "filename": safe_filename, "filedata": filedata_str, "timestamp": timestamp}
+        with trace.span("fanout"):
+            frames = offload.run("encode", len(filedata_str), encode_frames, payload, next_transfer())
+            broadcast(payload, exclude=username, frames=frames)
+    except Exception as e:
+        print(f"Error saving file from {username}: {e}")
+
+
+def handle_search(conn, username, msg, trace):
+    keyword = msg.get("content", "")
+    with trace.span("persist"), metrics.db_seconds.time(op="search"):
+        results = db.search(keyword)
+    with trace.span("fanout"):
+        reply = {"type": "search_result", "results": results}
+        conn.send_frames(offload.run("reply", len(results), encode_frames, reply), lane_for("search_result"))
+
+
+def handle_history_range(conn, username, msg, trace):
+    peer = msg.get("with")
+    bounds = [msg.get("since"), msg.get("until"), msg.get("limit", HISTORY_RANGE_LIMIT)]
+    valid = all(v is None or (isinstance(v, int) and not isinstance(v, bool) and v >= 0) for v in bounds)
+    if not valid or not (peer is None or valid_username(peer)):
+        send(conn, {"type": "error", "code": "bad_request",
+                    "message": "with must be a username, since, until and limit epoch ms / counts"})
+        return
+    since, until, limit = bounds
+    with trace.span("persist"), metrics.db_seconds.time(op="history_range"):
+        messages = db.history_range(username, peer, since, until,
+                                    min(limit or HISTORY_RANGE_LIMIT, HISTORY_RANGE_LIMIT))
+    with trace.span("fanout"):
+        send(conn, {"type": "history_range", "with": peer, "since": since, "until": until,
+                    "messages": [format_history(m) for m in messages]})
+
+
+def handle_ping(conn, username, msg, trace):
+    send(conn, {"type": "pong"})
+
+
+def handle_typing(conn, username, msg, trace):
+    to = msg.get("to")
+    payload = {"type": "typing", "sender": username, "to": to}
+
+    # If private typing, send only to recipient
+    with trace.span("fanout"):
+        if to:
+            send_to(to, payload)
+        else:
+            # Group typing indicator
+            broadcast(payload, exclude=username)
+
+
+# Message type: handler(conn, username, msg, trace)
+HANDLERS = {
+    "group": handle_group,
+    "private": handle_private,
+    "file": handle_file,
+    "search": handle_search,
+    "history_range": handle_history_range,
+    "typing": handle_typing,
+    "ping": handle_ping,
+}
+
+
+def parse_hello(line):
+    """The first line of a connection: the username, or
+    {"username": ..., "since": epoch ms} from a client resuming after a
+    reconnect. Returns (username, since); an unusable username is empty."""
+    text = line.decode(errors="replace").strip()
+    if not text.startswith("{"):
+        return text, None
+    try:
+        hello = json.loads(text)
+    except ValueError:
+        return "", None
+    if not isinstance(hello, dict):
+        return "", None
+    username, since = hello.get("username"), hello.get("since")
+    if not (isinstance(since, int) and not isinstance(since, bool) and since >= 0):
+        since = None
+    return (username.strip() if isinstance(username, str) else ""), since
+
+
+def handle_client(sock):
+    conn = ClientConnection(sock)
+    # Any inbound message (including heartbeat pings) resets this
+    conn.settimeout(IDLE_TIMEOUT)
     username = None
     try:
-        # Receive username
-        username_data = conn.recv(1024)
+        reader = FrameReader(conn)
+
+        # Receive username (first line of the stream)
+        username_data = reader.read_line()
         if not username_data:
             conn.close()
             return
 
-        username = username_data.decode().strip()
+        username, since = parse_hello(username_data)
 
         # Validate username
         if not username:
-            conn.sendall(json.dumps(
-                {"type": "error", "message": "Username cannot be empty"}).encode())
+            send(conn, {"type": "error", "message": "Username cannot be empty"})
+            conn.close()
+            return
+        if not valid_username(username):
+            send(conn, {"type": "error", "message": f"Usernames cannot contain '{KEY_SEPARATOR}'"})
             conn.close()
             return
 
         # Check for duplicate username
-        with clients_lock:
-            if username in clients:
-                conn.sendall(json.dumps(
-                    {"type": "error", "message": f"Username '{username}' is already taken"}).encode())
-                conn.close()
-                return
-            clients[username] = conn
+        taken = server_state.cluster and server_state.cluster.has_user(username)
+        if taken or not clients.add(username, conn):
+            send(conn, {"type": "error", "message": f"Username '{username}' is already taken"})
+            conn.close()
+            return
+        metrics.connected_clients.set(len(clients))
+        capture.record_session(username, "connect")
 
         print(f"✓ Client connected: {username}")
         broadcast_status()
 
         # Send chat history - format messages to match client expectations
-        history = db.get_messages()
-        formatted_history = []
-        for msg in history:
-            # Filter private messages: only send if user is sender or receiver
-            if msg.get("type") == "private":
-                if msg.get("sender") != username and msg.get("receiver") != username:
-                    continue
-
-            formatted_msg = {
-                "sender": msg.get("sender", ""),
-                "content": msg.get("content", ""),
-                "type": msg.get("type", "group"),
-                "timestamp": msg.get("timestamp", "")
-            }
-            # For private messages, include receiver info
-            if msg.get("type") == "private":
-                formatted_msg["receiver"] = msg.get("receiver", "")
-            formatted_history.append(formatted_msg)
-
-        conn.sendall(json.dumps(
-            {"type": "history", "messages": formatted_history}).encode())
+        with metrics.db_seconds.time(op="history"):
+            history = db.connect_history(username, since=since)
+        formatted_history = [format_history(msg) for msg in history]
+
+        send(conn, {"type": "history", "messages": formatted_history})
+
+        limiter = ratelimit.RateLimiter()
 
         while True:
-            data = conn.recv(8192)
-            if not data:
+            line = reader.read_line()
+            if line is None:
                 break
-            msg = json.loads(data.decode())
+            if not line.strip():
+                continue
+
+            trace = tracing.start()
+            trace.add("recv", reader.last_recv_seconds)
+            with trace.span("decode"):
+                msg = offload.run("decode", len(line), json.loads, line)
+            capture.record(username, msg, len(line))
             t = msg.get("type")
+            handler = HANDLERS.get(t)
+            # Clients choose the type string; only known ones become metric labels
+            trace.type = t if handler else "unknown"
+            metrics.messages_received.inc(type=trace.type)
+
+            if handler is None:
+                send(conn, {"type": "error", "code": "unknown_type",
+                            "message": f"Unknown message type: {t}"})
+                continue
+
+            # Enforce limits before any DB or fan-out work
+            wait = limiter.check(t, msg)
+            if wait:
+                send(conn, ratelimit.rejection(t, wait))
+                continue
 
-            if t == "group":
-                content = msg.get("content", "").strip()
-                if content:
-                    db.insert_message(username, "group", content, "group")
-                    payload = json.dumps(
-                        {"type": "group", "sender": username, "content": content}).encode()
-                    broadcast(payload, exclude=username)
-
-            elif t == "private":
-                to = msg.get("to")
-                content = msg.get("content", "").strip()
-
-                if not to or not content:
-                    continue
-
-                db.insert_message(username, to, content, "private")
-                payload = json.dumps({
-                    "type": "private",
-                    "sender": username,
-                    "to": to,
-                    "content": content
-                }).encode()
-
-                # Send to recipient if online
-                with clients_lock:
-                    if to in clients:
-                        try:
-                            clients[to].sendall(payload)
-                        except (ConnectionError, OSError, BrokenPipeError):
-                            # Recipient disconnected
-                            pass
-
-            elif t == "file":
-                filename = msg.get("filename", "unknown_file")
-                filedata_str = msg.get("filedata", "")
-
-                if not filedata_str:
-                    continue
-
-                try:
-                    filedata = base64.b64decode(filedata_str)
-                except Exception as e:
-                    print(f"Error decoding file data from {username}: {e}")
-                    continue
-
-                # Handle filename collisions by adding timestamp
-                base_name, ext = os.path.splitext(filename)
-                safe_filename = filename
-                counter = 1
-                while os.path.exists(os.path.join(UPLOADS_DIR, safe_filename)):
-                    safe_filename = f"{base_name}_{counter}{ext}"
-                    counter += 1
-
-                path = os.path.join(UPLOADS_DIR, safe_filename)
-                try:
-                    with open(path, "wb") as f:
-                        f.write(filedata)
-                    db.insert_message(username, "FILE", safe_filename, "file")
-                    payload = json.dumps(
-                        {"type": "file", "sender": username, "filename": safe_filename, "filedata": filedata_str}).encode()
-                    broadcast(payload, exclude=username)
-                except Exception as e:
-                    print(f"Error saving file from {username}: {e}")
-
-            elif t == "search":
-                keyword = msg.get("content", "")
-                results = db.search(keyword)
-                conn.sendall(json.dumps(
-                    {"type": "search_result", "results": results}).encode())
-
-            elif t == "typing":
-                to = msg.get("to")
-                payload = json.dumps(
-                    {"type": "typing", "sender": username, "to": to}).encode()
-
-                # If private typing, send only to recipient
-                if to:
-                    with clients_lock:
-                        if to in clients:
-                            try:
-                                clients[to].sendall(payload)
-                            except (ConnectionError, OSError, BrokenPipeError):
-                                pass
-                else:
-                    # Group typing indicator
-                    broadcast(payload, exclude=username)
-
-    except json.JSONDecodeError as e:
+            try:
+                handler(conn, username, msg, trace)
+            finally:
+                trace.finish()
+
+    except socket.timeout:
+        print(f"⏱ Client {username} silent for {IDLE_TIMEOUT}s, dropping")
+        evictions.inc(reason="idle")
+    except (json.JSONDecodeError, ValueError) as e:
         print(f"JSON decode error from {username}: {e}")
     except (ConnectionError, OSError, BrokenPipeError) as e:
         print(f"Client {username} disconnected: {e}")
@@ -191,10 +387,10 @@ def handle_client(conn):
 
     finally:
         # Clean up client
-        with clients_lock:
-            if username and username in clients:
-                clients.pop(username)
-                print(f" Client disconnected: {username}")
+        if username and clients.remove(username, conn):
+            metrics.connected_clients.set(len(clients))
+            capture.record_session(username, "disconnect")
+            print(f" Client disconnected: {username}")
 
         broadcast_status()
         try:
@@ -0,0 +1,112 @@
+import socket
+import threading
+import time
+
+from protocol import FrameReader, encode
+
+DEFAULT_BROKER = "127.0.0.1:5100"
+RECONNECT_DELAY = 1.0  # Seconds between broker reconnect attempts
+
+
+def parse_address(address):
+    """Turn 'unix:/path' or 'host:port' into (family, sockaddr)"""
+    if address.startswith("unix:"):
+        return socket.AF_UNIX, address[len("unix:"):]
+    host, _, port = address.rpartition(":")
+    return socket.AF_INET, (host or "127.0.0.1", int(port))
+
+
+def connect(address):
+    family, sockaddr = parse_address(address)
+    sock = socket.socket(family, socket.SOCK_STREAM)
+    sock.connect(sockaddr)
+    return sock
+
+
+class ClusterBridge:
+    """Link between one server node and the broker.
+
+    Events are plain dicts with a "kind" key:
+      broadcast - {"msg": ..., "exclude": username}, fanned out on every node
+      direct    - {"to": username, "msg": ...}, delivered by the node holding "to"
+      presence  - {"users": [...]}, the full list of users on the sending node
+    """
+
+    def __init__(self, address, node_id, on_event, on_connect=None):
+        self.address = address
+        self.node_id = node_id
+        self.on_event = on_event
+        self.on_connect = on_connect
+        self.remote = {}  # node_id: set of usernames
+        self.remote_lock = threading.Lock()
+        self.sock = None
+        self.send_lock = threading.Lock()
+        self.connected = threading.Event()
+
+    def start(self):
+        self._connect()
+        threading.Thread(target=self.listen, daemon=True).start()
+
+    def _connect(self):
+        sock = connect(self.address)
+        sock.sendall(encode({"kind": "hello", "node": self.node_id}))
+        with self.send_lock:
+            self.sock = sock
+        self.connected.set()
+        print(f"🔗 Joined cluster via broker {self.address} as {self.node_id}")
+        if self.on_connect:
+            self.on_connect()
+
+    def publish(self, event):
+        """Send an event to every other node (best effort)"""
+        if not self.connected.is_set():
+            return
+        event["node"] = self.node_id
+        data = encode(event)
+        with self.send_lock:
+            try:
+                self.sock.sendall(data)
+            except (ConnectionError, OSError) as e:
+                print(f"⚠ Cluster publish failed: {e}")
+
+    def remote_users(self):
+        with self.remote_lock:
+            users = set()
+            for node_users in self.remote.values():
+                users.update(node_users)
+        return sorted(users)
+
+    def has_user(self, username):
+        with self.remote_lock:
+            return any(username in users for users in self.remote.values())
+
+    def listen(self):
+        while True:
+            try:
+                reader = FrameReader(self.sock)
+                while True:
+                    event = reader.read()
+                    if event is None:
+                        break
+                    if event.get("kind") == "presence":
+                        with self.remote_lock:
+                            if event.get("users"):
+                                self.remote[event["node"]] = set(event["users"])
+                            else:
+                                self.remote.pop(event["node"], None)
+                    self.on_event(event)
+            except (ConnectionError, OSError, ValueError) as e:
+                print(f"⚠ Cluster link error: {e}")
+
+            # Broker gone: forget remote users and keep retrying
+            self.connected.clear()
+            with self.remote_lock:
+                self.remote.clear()
+            self.on_event({"kind": "presence", "node": None, "users": []})
+            print("⚠ Lost connection to broker, reconnecting...")
+            while not self.connected.is_set():
+                time.sleep(RECONNECT_DELAY)
+                try:
+                    self._connect()
+                except OSError:
+                    pass
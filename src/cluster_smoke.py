@@ -0,0 +1,146 @@
+"""Multi-node smoke check: a broker plus several server nodes on one machine.
+
+Usage: python cluster_smoke.py [num_nodes]
+
+Each node runs in its own process (sharing a temporary working directory,
+so they also share chat.db and uploads/). One client connects to every node
+and the script checks that presence, group, private and typing messages
+cross node boundaries. Exits non-zero on the first failure.
+"""
+import os
+import shutil
+import socket
+import ssl
+import subprocess
+import sys
+import tempfile
+import time
+
+from protocol import FrameReader, encode
+
+SRC_DIR = os.path.dirname(os.path.abspath(__file__))
+BASE_PORT = 5600
+BROKER = "127.0.0.1:5599"
+TIMEOUT = 5
+
+
+class TestClient:
+    def __init__(self, username, port):
+        context = ssl.create_default_context()
+        context.check_hostname = False
+        context.verify_mode = ssl.CERT_NONE
+        self.username = username
+        self.conn = context.wrap_socket(socket.create_connection(("127.0.0.1", port)))
+        self.conn.settimeout(TIMEOUT)
+        self.conn.sendall(username.encode() + b"\n")
+        self.reader = FrameReader(self.conn)
+
+    def send(self, msg):
+        self.conn.sendall(encode(msg))
+
+    def expect(self, predicate, what):
+        """Read until a message satisfies predicate, fail after TIMEOUT"""
+        deadline = time.time() + TIMEOUT
+        while time.time() < deadline:
+            try:
+                msg = self.reader.read()
+            except socket.timeout:
+                break
+            if msg is None:
+                break
+            if predicate(msg):
+                return msg
+        fail(f"{self.username} never received {what}")
+
+    def close(self):
+        self.conn.close()
+
+
+def fail(reason):
+    print(f"✗ {reason}")
+    sys.exit(1)
+
+
+def wait_for_port(port):
+    deadline = time.time() + TIMEOUT
+    while time.time() < deadline:
+        try:
+            socket.create_connection(("127.0.0.1", port), timeout=0.5).close()
+            return
+        except OSError:
+            time.sleep(0.1)
+    fail(f"node on port {port} did not start")
+
+
+def main(num_nodes=3):
+    workdir = tempfile.mkdtemp(prefix="chat-cluster-")
+    for name in ("cert.pem", "key.pem"):
+        shutil.copy(os.path.join(SRC_DIR, name), workdir)
+
+    procs = [subprocess.Popen([sys.executable, os.path.join(SRC_DIR, "broker.py"), BROKER],
+                              cwd=workdir, stdout=subprocess.DEVNULL)]
+    time.sleep(0.5)
+    clients = []
+    try:
+        ports = [BASE_PORT + i for i in range(num_nodes)]
+        for i, port in enumerate(ports):
+            procs.append(subprocess.Popen(
+                [sys.executable, os.path.join(SRC_DIR, "server.py"), "--port", str(port),
+                 "--cluster", BROKER, "--node-id", f"node{i}", "--admin-port", "0"],
+                cwd=workdir, stdout=subprocess.DEVNULL))
+        for port in ports:
+            wait_for_port(port)
+
+        names = [f"user{i}" for i in range(num_nodes)]
+        for name, port in zip(names, ports):
+            clients.append(TestClient(name, port))
+
+        # Presence is unified: everyone eventually sees every user
+        for client in clients:
+            client.expect(lambda m: m.get("type") == "status" and set(names) <= set(m["users"]),
+                          "the full user list")
+        print(f"✓ Presence unified across {num_nodes} nodes")
+
+        first, last = clients[0], clients[-1]
+
+        first.send({"type": "group", "content": "hello cluster"})
+        for client in clients[1:]:
+            client.expect(lambda m: m.get("type") == "group" and m["content"] == "hello cluster",
+                          "the group message")
+        print("✓ Group message relayed to every node")
+
+        first.send({"type": "private", "to": last.username, "content": "psst"})
+        last.expect(lambda m: m.get("type") == "private" and m["sender"] == first.username,
+                    "the private message")
+        print("✓ Private message routed to the recipient's node")
+
+        last.send({"type": "typing", "to": first.username})
+        first.expect(lambda m: m.get("type") == "typing" and m["sender"] == last.username,
+                     "the private typing indicator")
+        print("✓ Typing indicator relayed")
+
+        # A duplicate username on another node must be rejected
+        dup = TestClient(first.username, ports[-1])
+        dup.expect(lambda m: m.get("type") == "error", "a duplicate-username error")
+        dup.close()
+        print("✓ Usernames are unique cluster-wide")
+
+        clients.pop().close()
+        first.expect(lambda m: m.get("type") == "status" and last.username not in m["users"],
+                     "the departure of a remote user")
+        print("✓ Departures propagate")
+
+    finally:
+        for client in clients:
+            client.close()
+        for proc in procs:
+            proc.terminate()
+        for proc in procs:
+            proc.wait()
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    print("All cluster checks passed")
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 3)
@@ -0,0 +1,310 @@
+import select
+import socket
+import ssl
+import struct
+import threading
+import time
+from collections import deque
+
+import metrics
+
+try:
+    from fcntl import ioctl
+    from termios import TIOCOUTQ
+except ImportError:  # Windows: the kernel queue is not checked
+    ioctl = None
+
+COALESCE = True  # Frames sent while a write is in flight share the next TLS write
+COALESCE_TICK = 0  # Seconds a write also waits for more frames (delays the sending thread, fan-outs included)
+MAX_BUFFERED = 16 * 1024 * 1024  # Queued bytes beyond which a client counts as not reading
+MAX_BULK_BUFFERED = 128 * 1024 * 1024  # The same for queued file data (shared between recipients)
+
+# Outbound priority lanes, highest first. Queued frames of a higher lane
+# always go out before those of a lower one; within a lane order is kept.
+LANES = ("control", "chat", "typing", "bulk")
+CONTROL, CHAT, TYPING, BULK = range(len(LANES))
+BULK_INFLIGHT = 256 * 1024  # Unsent bytes in the kernel beyond which no more bulk data is written
+BULK_POLL = 0.005  # Seconds between checks of the kernel queue while it is over BULK_INFLIGHT
+INLINE_WRITE_LIMIT = 0.1  # Seconds a handler thread writes before handing the rest to a writer thread
+LANE_OF_TYPE = {"status": CONTROL, "pong": CONTROL, "error": CONTROL, "reconnect": CONTROL,
+                "typing": TYPING, "file": BULK, "file_chunk": BULK}
+
+# Options for client sockets, tuned for small latency-sensitive frames
+TCP_NODELAY = True
+SNDBUF = None  # Bytes; None keeps the kernel's autotuning
+RCVBUF = None
+KEEPALIVE = True
+KEEPALIVE_IDLE = 60  # Seconds idle before the first probe
+KEEPALIVE_INTERVAL = 10
+KEEPALIVE_COUNT = 5
+
+
+def lane_for(msg_type):
+    return LANE_OF_TYPE.get(msg_type, CHAT)
+
+
+def unsent_bytes(sock):
+    """Bytes written to sock that the peer has not acknowledged yet (0 if unknown)"""
+    if ioctl is None:
+        return 0
+    try:
+        return struct.unpack("i", ioctl(sock.fileno(), TIOCOUTQ, b"\0\0\0\0"))[0]
+    except (OSError, ValueError):
+        return 0
+
+
+def apply_socket_options(sock, listener=False):
+    """Apply the options above. Buffer sizes go on the listener too, so that
+    accepted sockets inherit them before the TCP window is negotiated."""
+    if SNDBUF:
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, SNDBUF)
+    if RCVBUF:
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, RCVBUF)
+    if listener:
+        return
+    sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, int(TCP_NODELAY))
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, int(KEEPALIVE))
+    if KEEPALIVE and hasattr(socket, "TCP_KEEPIDLE"):
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_KEEPIDLE, KEEPALIVE_IDLE)
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_KEEPINTVL, KEEPALIVE_INTERVAL)
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_KEEPCNT, KEEPALIVE_COUNT)
+
+
+class ClientConnection:
+    """A client socket whose writes are serialized across handler threads.
+
+    Several handler threads fan out to the same recipient at once; without
+    the lock their TLS records interleave and corrupt the stream.
+
+    Frames are queued in priority lanes (LANES). A thread that finds a
+    write to this client already in flight queues its frame and returns
+    instead of waiting on the lock; the writing thread (optionally after
+    waiting COALESCE_TICK for more) sends everything queued in the control,
+    chat and typing lanes, in that order, in one TLS write, so bursts of
+    small frames cost one record and one syscall and an idle connection's
+    frame goes out immediately. Without coalescing each write takes one
+    frame, still in priority order.
+
+    Bulk frames (file data, sent as bounded file_chunk frames) are written
+    one per write by a thread of the connection's own, which runs only
+    while bulk data is queued, so neither the uploader's handler thread
+    nor other recipients wait on a slow reader, and text queued meanwhile
+    goes out after at most one chunk. A handler thread that has been
+    writing for INLINE_WRITE_LIMIT (the receiver's socket buffer is full)
+    hands the rest to such a thread too, so one slow receiver does not
+    hold up a broadcast to the others. A failed write is raised to the
+    handler thread that made it (the writer thread aborts the connection
+    instead), and later sends raise ConnectionError.
+
+    The socket is switched to non-blocking mode: OpenSSL must not read and
+    write one connection from two threads at once (doing so corrupts the
+    TLS state now and then, e.g. the client sees a close_notify followed by
+    data), so every TLS read or write holds tls_lock, and the waiting for
+    the socket happens outside it. settimeout() bounds those waits.
+    """
+
+    def __init__(self, sock, coalesce=None, tick=None):
+        self.sock = sock
+        self.timeout = sock.gettimeout()  # Seconds a read, or a write that makes no progress, may wait
+        sock.setblocking(False)
+        self.tls_lock = threading.Lock()  # Held for each TLS read or write call, never while waiting
+        self.send_lock = threading.Lock()
+        self.coalesce = COALESCE if coalesce is None else coalesce
+        self.tick = COALESCE_TICK if tick is None else tick
+        self.lanes = [deque() for _ in LANES]  # (frame, time queued) per lane
+        self.queued = [0] * len(LANES)  # Bytes in each lane
+        self.writing = False  # A thread is draining the lanes
+        self.unfinished = None  # (rest of a write, its size, its frames) a handler thread handed over
+        self.failed = None  # Why a write failed, once one has
+        self.buffer = threading.Condition()
+
+    def settimeout(self, timeout):
+        self.timeout = timeout
+
+    def _wait(self, write, deadline):
+        """Wait until the socket is readable (or writable); socket.timeout at deadline"""
+        remaining = None if deadline is None else deadline - time.monotonic()
+        if remaining is not None and remaining <= 0:
+            raise socket.timeout("timed out")
+        if hasattr(select, "poll"):
+            poller = select.poll()  # Unlike select(), not limited to fds below 1024
+            poller.register(self.sock, select.POLLOUT if write else select.POLLIN)
+            ready = poller.poll(None if remaining is None else remaining * 1000)
+        else:
+            ready = any(select.select([] if write else [self.sock], [self.sock] if write else [], [], remaining))
+        if not ready:
+            raise socket.timeout("timed out")
+
+    def recv(self, bufsize):
+        deadline = None if self.timeout is None else time.monotonic() + self.timeout
+        while True:
+            with self.tls_lock:
+                try:
+                    return self.sock.recv(bufsize)
+                except (ssl.SSLWantReadError, BlockingIOError):
+                    write = False
+                except ssl.SSLWantWriteError:
+                    write = True
+            self._wait(write, deadline)
+
+    def _sendall(self, data, give_up=None):
+        """Write data; at monotonic time give_up, return what is still unsent"""
+        view = memoryview(data)
+        deadline = None if self.timeout is None else time.monotonic() + self.timeout
+        while view:
+            if give_up is not None and time.monotonic() >= give_up:
+                return view
+            with self.tls_lock:
+                try:
+                    # After a want-write, OpenSSL expects the same data again
+                    sent = self.sock.send(view)
+                except (ssl.SSLWantWriteError, BlockingIOError):
+                    sent, write = 0, True
+                except ssl.SSLWantReadError:
+                    sent, write = 0, False
+            if sent:
+                view = view[sent:]
+                deadline = None if self.timeout is None else time.monotonic() + self.timeout
+            elif give_up is not None and (deadline is None or give_up < deadline):
+                try:
+                    self._wait(write, give_up)
+                except socket.timeout:
+                    return view
+            else:
+                self._wait(write, deadline)
+        return view
+
+    def sendall(self, data, lane=CHAT):
+        self.send_frames((data,), lane)
+
+    def send_frames(self, frames, lane=CHAT):
+        """Queue frames (kept together, in order) on lane and write them
+        unless another thread already is"""
+        size = sum(len(frame) for frame in frames)
+        now = time.perf_counter()
+        with self.buffer:
+            if self.failed:
+                raise ConnectionError(f"Connection failed: {self.failed}")
+            if lane == BULK:
+                behind = self.queued[BULK] > MAX_BULK_BUFFERED
+            else:
+                behind = sum(self.queued) - self.queued[BULK] > MAX_BUFFERED
+            if behind:
+                raise ConnectionError("Client is not reading (send buffer full)")
+            self.lanes[lane].extend((frame, now) for frame in frames)
+            self.queued[lane] += size
+            if self.writing:
+                self.buffer.notify_all()  # A bulk writer waiting on the kernel queue goes first with these
+                return  # The writing thread takes these frames along
+            self.writing = True
+        if lane == BULK:
+            self._start_writer()
+        else:
+            self._write_pending()
+
+    def _start_writer(self):
+        threading.Thread(target=self._write_pending, args=(True,), daemon=True).start()
+
+    def _next_batch(self, bulk):
+        """Frames for the next write as (frame, time queued, lane), called
+        with self.buffer held. One bulk frame only when nothing else waits
+        and the kernel has sent most of the previous ones: bytes already in
+        the socket buffer would delay a text frame as much as our own queue."""
+        while True:
+            batch = []
+            for lane in (CONTROL, CHAT, TYPING):
+                queue = self.lanes[lane]
+                while queue and (self.coalesce or not batch):
+                    batch.append((*queue.popleft(), lane))
+            if batch or not bulk or not self.lanes[BULK]:
+                return batch
+            if unsent_bytes(self.sock) <= BULK_INFLIGHT:
+                return [(*self.lanes[BULK].popleft(), BULK)]
+            self.buffer.wait(BULK_POLL)
+
+    def _write_pending(self, bulk=False):
+        if self.tick:
+            time.sleep(self.tick)  # Let frames sent meanwhile join the first write
+        give_up = None if bulk else time.monotonic() + INLINE_WRITE_LIMIT
+        while True:
+            with self.buffer:
+                if give_up is not None and time.monotonic() >= give_up and any(self.lanes):
+                    # This handler thread has other recipients waiting: hand over
+                    self._start_writer()
+                    return
+                if self.unfinished:
+                    data, size, count = self.unfinished
+                    self.unfinished = None
+                    batch = []
+                else:
+                    batch = self._next_batch(bulk)
+                    if not batch:
+                        if self.lanes[BULK]:
+                            # Only bulk data left: hand the writing over to a writer thread
+                            self._start_writer()
+                            return
+                        self.writing = False
+                        self.buffer.notify_all()
+                        return
+                    for frame, _, lane in batch:
+                        self.queued[lane] -= len(frame)
+                    data = b"".join(frame for frame, _, _ in batch)
+                    size, count = len(data), len(batch)
+            start = time.perf_counter()
+            for _, queued_at, lane in batch:
+                metrics.lane_wait_seconds.observe(start - queued_at, lane=LANES[lane])
+            try:
+                with self.send_lock:
+                    rest = self._sendall(data, give_up)
+            except OSError as e:
+                with self.buffer:
+                    self.failed = str(e) or type(e).__name__
+                    for queue in self.lanes:
+                        queue.clear()
+                    self.queued = [0] * len(LANES)
+                    self.writing = False
+                    self.buffer.notify_all()
+                if bulk:
+                    self.abort()  # No caller to raise to: make the handler thread clean up
+                    return
+                raise
+            if rest:
+                # The receiver is not keeping up: a writer thread finishes this write
+                with self.buffer:
+                    self.unfinished = (rest, size, count)
+                self._start_writer()
+                return
+            self._count(size, count)
+
+    @staticmethod
+    def _count(size, frames):
+        metrics.outbound_bytes.inc(size)
+        metrics.outbound_frames.inc(frames)
+        metrics.socket_writes.inc()
+
+    def flush(self, timeout=5):
+        """Wait until everything sent so far has been written; False if a
+        write failed or the timeout passed first"""
+        deadline = time.monotonic() + timeout
+        with self.buffer:
+            while self.writing:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return False
+                self.buffer.wait(remaining)
+            return not self.failed
+
+    def abort(self):
+        """Wake the handler thread blocked in recv so it cleans up.
+
+        Shuts down the raw socket underneath TLS: the SSL object may still
+        be in use by that thread, so it must not be torn down from here.
+        """
+        try:
+            socket.socket.shutdown(self.sock, socket.SHUT_RDWR)
+        except OSError:
+            pass
+
+    def close(self):
+        self.flush(timeout=1)  # Frames another thread is still writing, e.g. an error
+        self.sock.close()
@@ -1,39 +1,251 @@
+import os
 import sqlite3
+import threading
+import time
 from datetime import datetime
 
+import metrics
+from archive import MessageArchive
+from message_cache import RecentCache, RECENT_MESSAGES
+from storage import open_store
+
+HOT_MONTHS = 3  # Current month plus this many previous ones stay in the store
+RETENTION_MONTHS = None  # Drop months older than this (None keeps everything)
+MAINTENANCE_INTERVAL = 3600  # Seconds between compaction passes
+HISTORY_RANGE_LIMIT = 500  # Most messages returned by one history_range query
+ACTIVE_PRIVATE_CHATS = 20  # Private conversations included in the history sent on connect
+KEY_SEPARATOR = "|"  # Joins the two users of a private conversation key; never part of a username
+
+
+def now_ms():
+    return int(time.time() * 1000)
+
+
+def conversation_key(sender, receiver, msg_type):
+    """Group and file messages share one conversation; private ones are per pair"""
+    if msg_type == "private":
+        return KEY_SEPARATOR.join(sorted((sender, receiver)))
+    return "group"
+
+
+def add_months(month, count):
+    year, mon = map(int, month.split("-"))
+    index = year * 12 + mon - 1 + count
+    return f"{index // 12:04d}-{index % 12 + 1:02d}"
+
+
+def month_offset(months_back):
+    """'YYYY-MM' key of the month `months_back` before the current one"""
+    return add_months(datetime.now().strftime("%Y-%m"), -months_back)
+
+
+def month_start_ms(month):
+    """Epoch ms of local midnight on the first day of a 'YYYY-MM' month"""
+    return int(datetime.strptime(month, "%Y-%m").timestamp() * 1000)
+
+
+def archive_dir(path):
+    """The archive sits next to the store"""
+    return os.path.join(os.path.dirname(os.path.abspath(path)), "archive")
+
 
 class ChatDatabase:
-    def __init__(self):
-        self.conn = sqlite3.connect("chat.db", check_same_thread=False)
-        self.create_table()
-
-    def create_table(self):
-        self.conn.execute("""
-        CREATE TABLE IF NOT EXISTS messages (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            sender TEXT,
-            receiver TEXT,
-            content TEXT,
-            timestamp TEXT,
-            type TEXT
-        )
-        """)
-        self.conn.commit()
+    """Hot messages live in a store (storage.py: SQLite by default, or the
+    segmented log); closed months older than hot_months are compacted into
+    the compressed archive, which every query still covers."""
+
+    def __init__(self, path="chat.db", hot_months=HOT_MONTHS, retention_months=RETENTION_MONTHS,
+                 backend="sqlite"):
+        self.path = path
+        self.backend = backend
+        self.hot_months = hot_months
+        self.retention_months = retention_months
+        self._store = None  # Opened on first use, so --storage can still change backend and path
+        # One store shared by all handler threads; reentrant so a cache
+        # fill can run its query under the same lock that orders inserts
+        self.lock = threading.RLock()
+        self.recent = RecentCache()
+        # The cache only sees this process's inserts and compactions, so it
+        # is turned off when other processes write the same store (--cluster)
+        self.cache_recent = True
+        self.archive = MessageArchive(archive_dir(path))
+
+    @property
+    def store(self):
+        return self._store if self._store is not None else self.open()
+
+    def open(self):
+        """Open the store now rather than on first use, to fail early"""
+        with self.lock:
+            if self._store is None:
+                if self.archive.directory != archive_dir(self.path):
+                    self.archive = MessageArchive(archive_dir(self.path))  # Path set after __init__
+                self._store = open_store(self.backend, self.path)
+        return self._store
 
     def insert_message(self, sender, receiver, content, msg_type):
-        self.conn.execute("""
-        INSERT INTO messages (sender, receiver, content, timestamp, type)
-        VALUES (?, ?, ?, ?, ?)
-        """, (sender, receiver, content,
-              datetime.now().strftime("%Y-%m-%d %H:%M:%S"), msg_type))
-        self.conn.commit()
+        """Store a message; returns its timestamp (epoch ms)"""
+        timestamp = now_ms()
+        key = conversation_key(sender, receiver, msg_type)
+        with self.lock:
+            start = time.perf_counter()
+            self.store.append(sender, receiver, content, timestamp, msg_type, key)
+            inserted = time.perf_counter()
+            self.store.commit()
+            # Still under the lock, so a concurrent cache fill cannot miss it
+            self.recent.append(key, {"sender": sender, "receiver": receiver, "content": content,
+                                     "timestamp": timestamp, "type": msg_type})
+            if msg_type == "private":
+                self.recent.add_peer(sender, receiver, timestamp)
+                self.recent.add_peer(receiver, sender, timestamp)
+        metrics.db_seconds.observe(inserted - start, op="insert")
+        metrics.db_seconds.observe(time.perf_counter() - inserted, op="commit")
+        return timestamp
 
     def get_messages(self):
-        rows = self.conn.execute(
-            "SELECT sender, receiver, content, timestamp, type FROM messages").fetchall()
-        return [{"sender": r[0], "receiver": r[1], "content": r[2], "timestamp": r[3], "type": r[4]} for r in rows]
+        archived = list(self.archive.rows())
+        with self.lock:
+            rows = self.store.rows()
+        return [{"sender": r[0], "receiver": r[1], "content": r[2], "timestamp": r[3], "type": r[4]}
+                for r in archived + rows]
 
     def search(self, keyword):
-        rows = self.conn.execute(
-            "SELECT sender, content, timestamp FROM messages WHERE content LIKE ?", (f"%{keyword}%",)).fetchall()
-        return [{"sender": r[0], "content": r[1], "timestamp": r[2]} for r in rows]
+        # Same case-insensitive substring match as LIKE, applied to the archive
+        needle = keyword.lower()
+        results = [{"sender": r[0], "content": r[2], "timestamp": r[3]}
+                   for r in self.archive.rows() if needle in (r[2] or "").lower()]
+        with self.lock:
+            rows = self.store.search(keyword)
+        return results + [{"sender": r[0], "content": r[1], "timestamp": r[2]} for r in rows]
+
+    def history_range(self, username, peer=None, since=None, until=None, limit=HISTORY_RANGE_LIMIT):
+        """The latest `limit` messages of one conversation (the group when peer
+        is None, else the private chat with peer) with since <= timestamp < until,
+        oldest first. Page backwards by passing the oldest timestamp as until."""
+        key = conversation_key(username, peer, "private") if peer else "group"
+        since = 0 if since is None else since
+        until = now_ms() + 1 if until is None else until
+        with self.lock:
+            rows = self.store.conversation_range(key, since, until, limit)
+
+        # Older matches may be in archived months overlapping the range
+        for month in reversed(self.archive.months()):
+            if len(rows) >= limit:
+                break
+            if month_start_ms(month) >= until or month_start_ms(add_months(month, 1)) <= since:
+                continue
+            older = [r for r in self.archive.read_month(month)
+                     if since <= r[3] < until and conversation_key(r[0], r[1], r[4]) == key]
+            rows = older[max(0, len(older) - (limit - len(rows))):] + rows
+
+        return [{"sender": r[0], "receiver": r[1], "content": r[2], "timestamp": r[3], "type": r[4]}
+                for r in rows]
+
+    def recent_messages(self, username, peer=None, count=RECENT_MESSAGES):
+        """The latest `count` messages of the group (or of the private chat
+        with peer), from the recent-message cache when possible"""
+        if not self.cache_recent:
+            return self.history_range(username, peer, limit=count)
+        key = conversation_key(username, peer, "private") if peer else "group"
+        messages = self.recent.get(key, count)
+        if messages is not None:
+            return messages
+        if count > self.recent.capacity:
+            return self.history_range(username, peer, limit=count)
+        with self.lock:
+            messages = self.history_range(username, peer, limit=self.recent.capacity)
+            self.recent.fill(key, messages)
+        return messages[-count:]
+
+    def private_peers(self, username, limit=ACTIVE_PRIVATE_CHATS):
+        """Users `username` has private chats with, most recently active first"""
+        peers = self.recent.get_peers(username) if self.cache_recent else None
+        if peers is None:
+            with self.lock:
+                peers = self.store.private_peers(username)
+                if self.cache_recent:
+                    self.recent.fill_peers(username, peers)
+        return sorted(peers, key=peers.get, reverse=True)[:limit]
+
+    def connect_history(self, username, count=RECENT_MESSAGES, since=None):
+        """What a user sees on connect: the latest messages of the group and of
+        their most active private chats, oldest first. Older messages are
+        available through history_range. A client resuming after a reconnect
+        passes the newest timestamp it has (since) and only gets what it
+        missed: newer messages, without its own (clients show those as sent)."""
+        messages = list(self.recent_messages(username, None, count))
+        for peer in self.private_peers(username):
+            messages += self.recent_messages(username, peer, count)
+        if since is not None:
+            messages = [m for m in messages if m["timestamp"] > since and m["sender"] != username]
+        messages.sort(key=lambda m: m["timestamp"])
+        return messages
+
+    def compact(self):
+        """Move closed months out of the hot table into the archive and apply
+        the retention policy. Returns the archived and dropped month keys
+        (none when another process sharing the store is compacting)."""
+        with self.archive.compaction_lock() as ours:
+            if not ours:
+                return [], []
+            return self._compact()
+
+    def _compact(self):
+        cutoff = month_start_ms(month_offset(self.hot_months))
+        with self.lock:
+            months = self.store.months_before(cutoff)
+
+        archived = []
+        for month in sorted(months):
+            bounds = (month_start_ms(month), month_start_ms(add_months(month, 1)))
+            with self.lock:
+                rows = self.store.range_rows(*bounds)
+                # The archive file is complete on disk before the rows are deleted.
+                # Months go oldest first, so nothing older than this one is left.
+                self.archive.write_month(month, [list(r) for r in rows])
+                self.store.delete_before(bounds[1])
+            archived.append(month)
+            print(f" Archived {len(rows)} messages from {month}")
+
+        dropped = []
+        if self.retention_months is not None:
+            oldest = month_offset(self.retention_months)
+            for month in self.archive.months():
+                if month < oldest:
+                    self.archive.drop_month(month)
+                    dropped.append(month)
+            with self.lock:
+                self.store.delete_before(month_start_ms(oldest))
+            if dropped:
+                print(f" Dropped expired months: {', '.join(dropped)}")
+            # Cached rings may still hold expired messages
+            self.recent.clear()
+
+        if archived or dropped:
+            with self.lock:
+                self.store.vacuum()
+        return archived, dropped
+
+    def flush(self):
+        """Make every stored message durable (before a shutdown)"""
+        with self.lock:
+            if self._store is not None:
+                self.store.commit()
+
+    def close(self):
+        with self.lock:
+            if self._store is not None:
+                self._store.close()
+                self._store = None
+
+    def start_maintenance(self, interval=MAINTENANCE_INTERVAL):
+        """Compact in the background now and then every `interval` seconds"""
+        def loop():
+            while True:
+                try:
+                    self.compact()
+                except (sqlite3.Error, OSError) as e:
+                    print(f"⚠ Compaction failed: {e}")
+                time.sleep(interval)
+
+        threading.Thread(target=loop, daemon=True).start()
@@ -0,0 +1,82 @@
+"""Zero-downtime restarts by passing listening sockets between processes.
+
+A server started with --handoff PATH serves PATH as a Unix socket. When a
+new server is started with the same --handoff PATH, it connects there first
+and the running one sends it the open listening sockets (SCM_RIGHTS), so
+the port never closes and queued connections are not lost. Once the new
+process reports that it is accepting, the old one stops accepting, tells
+its clients to reconnect within a staggered window, drains and exits.
+"""
+import json
+import os
+import socket
+import threading
+
+HANDOFF_TIMEOUT = 10  # Seconds the old process waits for the new one to take over
+
+
+def take_over(path):
+    """Receive the listening sockets of the server serving path.
+
+    Returns ({"chat": sock, "admin": sock or None}, ready) where ready() must
+    be called once the sockets are being accepted on, or (None, None) if no
+    server is running there.
+    """
+    channel = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        channel.connect(path)
+        channel.settimeout(HANDOFF_TIMEOUT)
+        payload, fds, _, _ = socket.recv_fds(channel, 4096, 4)
+    except (FileNotFoundError, ConnectionRefusedError):
+        channel.close()
+        return None, None
+
+    names = json.loads(payload)["sockets"]
+    sockets = dict.fromkeys(("chat", "admin"))
+    for name, fd in zip(names, fds):
+        sockets[name] = socket.socket(fileno=fd)
+
+    def ready():
+        try:
+            channel.sendall(b"ready\n")
+        finally:
+            channel.close()
+
+    print(f"✓ Took over listening sockets ({', '.join(names)}) from {path}")
+    return sockets, ready
+
+
+def serve(path, sockets, on_handoff):
+    """Offer sockets ({name: sock}) to the next server started on path and
+    call on_handoff() once it is accepting on them"""
+    try:
+        os.unlink(path)  # Left by the process we took over from, or a crash
+    except FileNotFoundError:
+        pass
+    listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    listener.bind(path)
+    listener.listen(1)
+
+    def accept_loop():
+        while True:
+            channel, _ = listener.accept()
+            names = [name for name, sock in sockets.items() if sock is not None]
+            try:
+                channel.settimeout(HANDOFF_TIMEOUT)
+                socket.send_fds(channel, [json.dumps({"sockets": names}).encode()],
+                                [sockets[name].fileno() for name in names])
+                ready = channel.recv(16) == b"ready\n"
+            except OSError as e:
+                print(f"⚠ Handoff failed, still serving: {e}")
+                ready = False
+            finally:
+                channel.close()
+            if ready:
+                # The successor now owns the path for the next restart
+                listener.close()
+                on_handoff()
+                return
+            print("⚠ New server did not take over, still serving")
+
+    threading.Thread(target=accept_loop, daemon=True).start()
+    print(f" Handoff socket: {path}")
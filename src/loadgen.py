@@ -0,0 +1,319 @@
+"""Headless load generator and throughput/latency benchmark.
+
+Simulates many users against a chat server from one process and reports
+throughput plus p50/p95/p99 end-to-end latency per message type.
+
+    python loadgen.py --users 1000 --duration 30 --mix group=40,private=35,typing=20,file=3,search=2
+    python loadgen.py --server 10.0.0.5:5000 --users 200 --output run.json
+
+Without --server a local server is started in a temporary directory with a
+freshly generated self-signed certificate (falling back to the bundled one
+when openssl is missing). Results are printed and, with --output, written as
+JSON so runs can be compared over time.
+"""
+import argparse
+import asyncio
+import base64
+import json
+import os
+import random
+import shutil
+import socket
+import ssl
+import subprocess
+import sys
+import tempfile
+import time
+
+from chat_client import ChatClient, default_ssl_context
+
+SRC_DIR = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_MIX = "group=40,private=35,typing=20,file=3,search=2"
+CONNECT_CONCURRENCY = 50  # Parallel TLS handshakes while ramping up
+DRAIN_TIME = 3.0  # Seconds to keep listening after the last send
+
+
+def spawn_server(port, extra_args=(), env=None):
+    """Start server.py in a temporary directory; returns (process, workdir)"""
+    workdir = tempfile.mkdtemp(prefix="chat-bench-")
+    generated = shutil.which("openssl") and subprocess.run(
+        ["openssl", "req", "-x509", "-newkey", "rsa:2048", "-nodes", "-keyout", "key.pem",
+         "-out", "cert.pem", "-days", "1", "-subj", "/CN=localhost"],
+        cwd=workdir, capture_output=True).returncode == 0
+    if not generated:
+        for name in ("cert.pem", "key.pem"):
+            shutil.copy(os.path.join(SRC_DIR, name), workdir)
+
+    # Every simulated user comes from 127.0.0.1, so lift the per-IP limit
+    proc = subprocess.Popen(
+        [sys.executable, os.path.join(SRC_DIR, "server.py"), "--port", str(port),
+         "--admin-port", "0", "--max-per-ip", "1000000", *extra_args],
+        cwd=workdir, stdout=subprocess.DEVNULL, env=env)
+
+    deadline = time.time() + 10
+    while time.time() < deadline:
+        try:
+            socket.create_connection(("127.0.0.1", port), timeout=0.5).close()
+            return proc, workdir
+        except OSError:
+            time.sleep(0.1)
+    proc.terminate()
+    raise RuntimeError(f"Local server did not start on port {port}")
+
+
+def stop_server(proc, workdir):
+    proc.terminate()
+    proc.wait()
+    shutil.rmtree(workdir, ignore_errors=True)
+
+
+def percentile(sorted_values, q):
+    if not sorted_values:
+        return None
+    index = min(len(sorted_values) - 1, int(q * len(sorted_values)))
+    return sorted_values[index]
+
+
+def summarize(samples):
+    """Latency summary in milliseconds"""
+    values = sorted(samples)
+    ms = lambda v: None if v is None else round(v * 1000, 3)
+    return {
+        "count": len(values),
+        "p50_ms": ms(percentile(values, 0.50)),
+        "p95_ms": ms(percentile(values, 0.95)),
+        "p99_ms": ms(percentile(values, 0.99)),
+        "max_ms": ms(values[-1] if values else None),
+    }
+
+
+def parse_mix(text):
+    mix = {}
+    for part in text.split(","):
+        name, _, weight = part.partition("=")
+        mix[name.strip()] = float(weight)
+    return mix
+
+
+class Bench:
+    """Shared bookkeeping for all simulated users"""
+
+    def __init__(self, args):
+        self.args = args
+        self.users = {}  # username: SimUser
+        self.sent = {}  # type: count
+        self.received = {}  # type: count
+        self.latencies = {}  # type: [seconds]
+        self.pending_typing = {}  # (sender, to): send time
+        self.errors = 0
+        self.connect_times = []
+        self.file_blob = base64.b64encode(os.urandom(args.file_size)).decode()
+
+    def count_sent(self, kind):
+        self.sent[kind] = self.sent.get(kind, 0) + 1
+
+    def record(self, kind, sent_at):
+        self.received[kind] = self.received.get(kind, 0) + 1
+        self.latencies.setdefault(kind, []).append(time.perf_counter() - sent_at)
+
+    def online(self):
+        return [name for name, user in self.users.items() if user.client.connected]
+
+
+class SimUser:
+    def __init__(self, name, bench, host, port, context):
+        self.name = name
+        self.bench = bench
+        self.client = ChatClient(name, host, port, context, reconnect=False)
+        self.searches = []  # Send times of outstanding searches, in order
+        self.ranges = []  # Send times of outstanding history_range queries
+
+    async def connect(self):
+        start = time.perf_counter()
+        await self.client.connect()
+        self.bench.connect_times.append(time.perf_counter() - start)
+
+    async def send(self, msg):
+        await self.client.send(msg)
+        self.bench.count_sent(msg["type"])
+
+    async def listen(self):
+        bench = self.bench
+        try:
+            async for msg in self.client.events():
+                t = msg.get("type")
+                if t in ("group", "private"):
+                    parts = msg.get("content", "").split(" ")
+                    if parts[0] == "lg":
+                        bench.record(t, float(parts[2]))
+                elif t == "file":
+                    parts = msg.get("filename", "").split("_")
+                    if parts[0] == "lg":
+                        bench.record("file", float(parts[2].rsplit(".", 1)[0]))
+                elif t == "typing":
+                    sent_at = bench.pending_typing.pop((msg.get("sender"), msg.get("to")), None)
+                    if sent_at:
+                        bench.record("typing", sent_at)
+                elif t == "search_result" and self.searches:
+                    bench.record("search", self.searches.pop(0))
+                elif t == "history_range" and self.ranges:
+                    bench.record("history_range", self.ranges.pop(0))
+                elif t == "error":
+                    bench.errors += 1
+        except ValueError:
+            bench.errors += 1
+
+    async def send_group(self, seq):
+        await self.send({"type": "group", "content": f"lg {seq} {time.perf_counter():.6f}"})
+
+    async def send_private(self, seq):
+        peers = self.bench.online()
+        if len(peers) < 2:
+            return
+        to = random.choice(peers)
+        while to == self.name:
+            to = random.choice(peers)
+        await self.send({"type": "private", "to": to,
+                         "content": f"lg {seq} {time.perf_counter():.6f}"})
+
+    async def send_typing(self, seq):
+        peers = self.bench.online()
+        if len(peers) < 2:
+            return
+        to = random.choice(peers)
+        while to == self.name:
+            to = random.choice(peers)
+        self.bench.pending_typing[(self.name, to)] = time.perf_counter()
+        await self.send({"type": "typing", "to": to})
+
+    async def send_file(self, seq):
+        filename = f"lg_{self.name}-{seq}_{time.perf_counter():.6f}.bin"
+        await self.send({"type": "file", "filename": filename, "filedata": self.bench.file_blob})
+
+    async def send_search(self, seq):
+        self.searches.append(time.perf_counter())
+        await self.send({"type": "search", "content": f"lg {random.randint(0, 999)}"})
+
+    async def run(self, until, rate, mix):
+        kinds = list(mix)
+        weights = [mix[k] for k in kinds]
+        seq = 0
+        while self.client.connected:
+            remaining = until - time.perf_counter()
+            delay = random.expovariate(rate)
+            if delay >= remaining:
+                break
+            await asyncio.sleep(delay)
+            seq += 1
+            kind = random.choices(kinds, weights)[0]
+            try:
+                await getattr(self, f"send_{kind}")(seq)
+            except (ConnectionError, OSError):
+                self.bench.errors += 1
+                break
+
+    async def close(self):
+        await self.client.close()
+
+
+async def run_bench(args):
+    host, _, port = args.server.rpartition(":")
+    port = int(port)
+    context = default_ssl_context()
+    mix = parse_mix(args.mix)
+
+    bench = Bench(args)
+    run_id = f"{os.getpid()}{random.randint(0, 9999)}"
+    users = [SimUser(f"lg{run_id}-{i}", bench, host, port, context)
+             for i in range(args.users)]
+    for user in users:
+        bench.users[user.name] = user
+
+    # Ramp up with bounded handshake concurrency
+    gate = asyncio.Semaphore(CONNECT_CONCURRENCY)
+
+    async def connect(user):
+        async with gate:
+            try:
+                await user.connect()
+            except (ConnectionError, OSError, ssl.SSLError):
+                bench.errors += 1
+
+    ramp_start = time.perf_counter()
+    await asyncio.gather(*(connect(u) for u in users))
+    ramp_time = time.perf_counter() - ramp_start
+    connected = sum(1 for u in users if u.client.connected)
+    listeners = [asyncio.create_task(u.listen()) for u in users if u.client.connected]
+
+    start = time.perf_counter()
+    until = start + args.duration
+    await asyncio.gather(*(u.run(until, args.rate, mix) for u in users if u.client.connected))
+    elapsed = time.perf_counter() - start
+    await asyncio.sleep(DRAIN_TIME)
+
+    await asyncio.gather(*(u.close() for u in users))
+    await asyncio.gather(*listeners, return_exceptions=True)
+
+    total_sent = sum(bench.sent.values())
+    total_received = sum(bench.received.values())
+    return {
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "config": {"server": args.server, "users": args.users, "duration": args.duration,
+                   "rate_per_user": args.rate, "mix": mix, "file_size": args.file_size},
+        "connected": connected,
+        "ramp_seconds": round(ramp_time, 3),
+        "connect": summarize(bench.connect_times),
+        "sent": bench.sent,
+        "received": bench.received,
+        "send_rate_per_sec": round(total_sent / elapsed, 2),
+        "delivery_rate_per_sec": round(total_received / elapsed, 2),
+        "latency": {kind: summarize(samples) for kind, samples in sorted(bench.latencies.items())},
+        "errors": bench.errors,
+    }
+
+
+def print_report(result):
+    print(f"Users: {result['connected']}/{result['config']['users']} connected "
+          f"in {result['ramp_seconds']}s")
+    print(f"Sent {result['send_rate_per_sec']}/s, delivered {result['delivery_rate_per_sec']}/s, "
+          f"errors: {result['errors']}")
+    print(f"{'type':<10}{'sent':>8}{'recv':>10}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}")
+    for kind, lat in result["latency"].items():
+        print(f"{kind:<10}{result['sent'].get(kind, 0):>8}{lat['count']:>10}"
+              f"{lat['p50_ms']:>10}{lat['p95_ms']:>10}{lat['p99_ms']:>10}")
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Chat server load generator")
+    parser.add_argument("--server", help="host:port of a running server (default: start one locally)")
+    parser.add_argument("--port", type=int, default=5800, help="port for the local server")
+    parser.add_argument("--users", type=int, default=200)
+    parser.add_argument("--duration", type=float, default=30, help="seconds of traffic")
+    parser.add_argument("--rate", type=float, default=0.5, help="messages/sec per user")
+    parser.add_argument("--mix", default=DEFAULT_MIX, help="weights per message type")
+    parser.add_argument("--file-size", type=int, default=16 * 1024, help="bytes per file message")
+    parser.add_argument("--output", help="write JSON results to this file")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    local = None
+    if not args.server:
+        local = spawn_server(args.port)
+        args.server = f"127.0.0.1:{args.port}"
+    try:
+        result = asyncio.run(run_bench(args))
+    finally:
+        if local:
+            stop_server(*local)
+
+    print_report(result)
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(result, f, indent=2)
+        print(f"Results written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,52 @@
+"""Memory figures of the current process, for the admin port and soak.py.
+
+Allocation sites are only known when tracemalloc is tracing, e.g. when the
+process was started with PYTHONTRACEMALLOC=1; otherwise "traced_bytes" is
+None and "top" is empty. RSS and open file descriptors come from /proc and
+are None where it does not exist.
+"""
+import gc
+import os
+import threading
+import tracemalloc
+
+TOP_ALLOCATORS = 20  # Allocation sites reported by default
+
+
+def rss_bytes():
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError):
+        return None
+
+
+def open_fds():
+    try:
+        return len(os.listdir("/proc/self/fd"))
+    except OSError:
+        return None
+
+
+def top_allocators(limit=TOP_ALLOCATORS):
+    """The source lines holding the most traced memory, largest first"""
+    if not tracemalloc.is_tracing():
+        return []
+    snapshot = tracemalloc.take_snapshot().filter_traces(
+        (tracemalloc.Filter(False, tracemalloc.__file__),))
+    return [{"where": f"{os.path.basename(stat.traceback[0].filename)}:{stat.traceback[0].lineno}",
+             "bytes": stat.size, "count": stat.count}
+            for stat in snapshot.statistics("lineno")[:limit]]
+
+
+def snapshot(limit=TOP_ALLOCATORS):
+    """RSS, traced Python memory, threads, fds and the top allocation sites,
+    after a full garbage collection so that only live objects count"""
+    gc.collect()
+    return {
+        "rss_bytes": rss_bytes(),
+        "traced_bytes": tracemalloc.get_traced_memory()[0] if tracemalloc.is_tracing() else None,
+        "threads": threading.active_count(),
+        "fds": open_fds(),
+        "top": top_allocators(limit),
+    }
@@ -0,0 +1,133 @@
+import threading
+from collections import OrderedDict, deque
+
+import metrics
+
+RECENT_MESSAGES = 300  # Messages kept per conversation
+MAX_CACHE_BYTES = 64 * 1024 * 1024  # Approximate memory cap for all conversations
+MAX_CACHED_USERS = 10_000  # Users whose private-chat peer lists are kept
+MESSAGE_OVERHEAD = 400  # Rough bytes of dict/str/deque overhead per cached message
+
+lookups = metrics.Counter("chat_history_cache_lookups_total",
+                          "Recent-history cache lookups", ("result",))
+hit_ratio = metrics.Gauge("chat_history_cache_hit_ratio", "Recent-history cache hits / lookups")
+cached_bytes = metrics.Gauge("chat_history_cache_bytes", "Approximate size of the recent-history cache")
+cached_conversations = metrics.Gauge("chat_history_cache_conversations",
+                                     "Conversations held in the recent-history cache")
+
+
+def message_size(msg):
+    return (MESSAGE_OVERHEAD + len(msg["content"] or "")
+            + len(msg["sender"] or "") + len(msg["receiver"] or ""))
+
+
+class RecentCache:
+    """Ring buffers of the latest messages per conversation, LRU-evicted as a
+    whole once the memory cap is exceeded.
+
+    A conversation is only cached after fill() loaded its latest messages from
+    the database, and append() only extends conversations that are cached, so
+    every cached ring holds exactly the conversation's most recent messages.
+    Callers serialize fill() and append() for a conversation with the writes
+    that produce the messages (ChatDatabase does it under its lock).
+    """
+
+    def __init__(self, capacity=RECENT_MESSAGES, max_bytes=MAX_CACHE_BYTES,
+                 max_users=MAX_CACHED_USERS):
+        self.capacity = capacity
+        self.max_bytes = max_bytes
+        self.max_users = max_users
+        self.conversations = OrderedDict()  # key: deque of messages, most recently used last
+        self.sizes = {}  # key: bytes
+        self.total_bytes = 0
+        self.peers = OrderedDict()  # username: {peer: last timestamp}, most recently used last
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+    def get(self, key, count):
+        """The latest `count` messages of a conversation, or None on a miss"""
+        with self.lock:
+            ring = self.conversations.get(key)
+            if ring is not None and count <= self.capacity:
+                self.conversations.move_to_end(key)
+                self.hits += 1
+                result = list(ring)[-count:] if count < len(ring) else list(ring)
+            else:
+                self.misses += 1
+                result = None
+            ratio = self.hits / (self.hits + self.misses)
+        lookups.inc(result="miss" if result is None else "hit")
+        hit_ratio.set(round(ratio, 4))
+        return result
+
+    def fill(self, key, messages):
+        """Cache a conversation from its latest `capacity` stored messages"""
+        with self.lock:
+            self._drop(key)
+            ring = deque(messages[-self.capacity:], maxlen=self.capacity)
+            self.conversations[key] = ring
+            self.sizes[key] = sum(message_size(m) for m in ring)
+            self.total_bytes += self.sizes[key]
+            self._evict()
+
+    def append(self, key, msg):
+        """Record a newly stored message if its conversation is cached"""
+        with self.lock:
+            ring = self.conversations.get(key)
+            if ring is None:
+                return
+            if len(ring) == ring.maxlen:
+                dropped = message_size(ring[0])
+                self.sizes[key] -= dropped
+                self.total_bytes -= dropped
+            ring.append(msg)
+            size = message_size(msg)
+            self.sizes[key] += size
+            self.total_bytes += size
+            self._evict()
+
+    def get_peers(self, username):
+        """{peer: last timestamp} of a user's private chats, or None on a miss"""
+        with self.lock:
+            peers = self.peers.get(username)
+            if peers is None:
+                return None
+            self.peers.move_to_end(username)
+            return dict(peers)
+
+    def fill_peers(self, username, peers):
+        with self.lock:
+            self.peers[username] = dict(peers)
+            self.peers.move_to_end(username)
+            while len(self.peers) > self.max_users:
+                self.peers.popitem(last=False)
+
+    def add_peer(self, username, peer, timestamp):
+        with self.lock:
+            peers = self.peers.get(username)
+            if peers is not None:
+                peers[peer] = timestamp
+
+    def clear(self):
+        with self.lock:
+            self.conversations.clear()
+            self.sizes.clear()
+            self.peers.clear()
+            self.total_bytes = 0
+            self._report()
+
+    def _drop(self, key):
+        if self.conversations.pop(key, None) is not None:
+            self.total_bytes -= self.sizes.pop(key)
+
+    def _evict(self):
+        # Never evict the conversation that was just touched
+        while self.total_bytes > self.max_bytes and len(self.conversations) > 1:
+            key, _ = self.conversations.popitem(last=False)
+            self.total_bytes -= self.sizes.pop(key)
+        self._report()
+
+    def _report(self):
+        cached_bytes.set(self.total_bytes)
+        cached_conversations.set(len(self.conversations))
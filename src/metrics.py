@@ -0,0 +1,218 @@
+import threading
+import time
+from collections import deque
+
+RATE_WINDOW = 60  # Seconds of history kept for per-second rates
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05,
+                   0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+
+registry = []  # Every metric, in registration order
+
+
+def _escape(value):
+    """Label value escaping required by the Prometheus text format"""
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _label_str(names, values):
+    if not names:
+        return ""
+    pairs = ",".join(f'{n}="{_escape(v)}"' for n, v in zip(names, values))
+    return "{" + pairs + "}"
+
+
+class Metric:
+    kind = None
+
+    def __init__(self, name, help_text, labels=()):
+        self.name = name
+        self.help = help_text
+        self.labels = tuple(labels)
+        self.lock = threading.Lock()
+        registry.append(self)
+
+    def _key(self, labels):
+        return tuple(str(labels.get(n, "")) for n in self.labels)
+
+    def header(self):
+        return [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+
+
+class Counter(Metric):
+    """Monotonic count, with a per-second rate over the last RATE_WINDOW seconds"""
+    kind = "counter"
+
+    def __init__(self, name, help_text, labels=()):
+        super().__init__(name, help_text, labels)
+        self.values = {}
+        self.recent = {}  # key: deque of [second, count]
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        now = int(time.time())
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+            window = self.recent.setdefault(key, deque())
+            if window and window[-1][0] == now:
+                window[-1][1] += amount
+            else:
+                window.append([now, amount])
+                while window[0][0] <= now - RATE_WINDOW:
+                    window.popleft()
+
+    def rate(self, key):
+        cutoff = time.time() - RATE_WINDOW
+        with self.lock:
+            total = sum(c for s, c in self.recent.get(key, ()) if s > cutoff)
+        return total / RATE_WINDOW
+
+    def render(self):
+        lines = self.header()
+        with self.lock:
+            for key, value in sorted(self.values.items()):
+                lines.append(f"{self.name}{_label_str(self.labels, key)} {value}")
+        return lines
+
+    def snapshot(self):
+        with self.lock:
+            keys = sorted(self.values)
+            values = dict(self.values)
+        return {"/".join(k) or "total": {"count": values[k], "per_sec": round(self.rate(k), 3)}
+                for k in keys}
+
+
+class Gauge(Metric):
+    kind = "gauge"
+
+    def __init__(self, name, help_text, labels=()):
+        super().__init__(name, help_text, labels)
+        self.values = {}
+
+    def set(self, value, **labels):
+        with self.lock:
+            self.values[self._key(labels)] = value
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+    def render(self):
+        lines = self.header()
+        with self.lock:
+            for key, value in sorted(self.values.items()):
+                lines.append(f"{self.name}{_label_str(self.labels, key)} {value}")
+        return lines
+
+    def snapshot(self):
+        with self.lock:
+            return {"/".join(k) or "value": v for k, v in sorted(self.values.items())}
+
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(self, name, help_text, labels=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, help_text, labels)
+        self.buckets = tuple(buckets)
+        self.series = {}  # key: [bucket counts..., sum, count]
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self.lock:
+            series = self.series.get(key)
+            if series is None:
+                series = self.series[key] = [0] * (len(self.buckets) + 2)
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[i] += 1
+                    break
+            series[-2] += value
+            series[-1] += 1
+
+    def time(self, **labels):
+        return _Timer(self, labels)
+
+    def render(self):
+        lines = self.header()
+        with self.lock:
+            for key, series in sorted(self.series.items()):
+                cumulative = 0
+                for bound, count in zip(self.buckets, series):
+                    cumulative += count
+                    label_key = key + (str(bound),)
+                    lines.append(f"{self.name}_bucket"
+                                 f"{_label_str(self.labels + ('le',), label_key)} {cumulative}")
+                lines.append(f"{self.name}_bucket"
+                             f"{_label_str(self.labels + ('le',), key + ('+Inf',))} {series[-1]}")
+                lines.append(f"{self.name}_sum{_label_str(self.labels, key)} {series[-2]}")
+                lines.append(f"{self.name}_count{_label_str(self.labels, key)} {series[-1]}")
+        return lines
+
+    def quantile_ms(self, series, q):
+        """Estimate a quantile as the upper bound of the bucket it falls in
+        (None when it lies beyond the largest bucket)"""
+        target = q * series[-1]
+        cumulative = 0
+        for bound, count in zip(self.buckets, series):
+            cumulative += count
+            if cumulative >= target:
+                return bound * 1000
+        return None
+
+    def snapshot(self):
+        with self.lock:
+            items = [(k, list(s)) for k, s in sorted(self.series.items())]
+        result = {}
+        for key, series in items:
+            count = series[-1]
+            result["/".join(key) or "all"] = {
+                "count": count,
+                "avg_ms": round(series[-2] / count * 1000, 3) if count else 0,
+                "p50_ms": self.quantile_ms(series, 0.50),
+                "p95_ms": self.quantile_ms(series, 0.95),
+                "p99_ms": self.quantile_ms(series, 0.99),
+            }
+        return result
+
+
+class _Timer:
+    def __init__(self, histogram, labels):
+        self.histogram = histogram
+        self.labels = labels
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.histogram.observe(time.perf_counter() - self.start, **self.labels)
+
+
+def render_prometheus():
+    lines = []
+    for metric in registry:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+
+def snapshot():
+    return {metric.name: metric.snapshot() for metric in registry}
+
+
+# Server metrics
+connected_clients = Gauge("chat_connected_clients", "Clients currently connected to this node")
+messages_received = Counter("chat_messages_received_total", "Inbound messages by type", ("type",))
+fanout_seconds = Histogram("chat_fanout_seconds", "Time to deliver a message to its recipients", ("type",))
+outbound_bytes = Counter("chat_outbound_bytes_total", "Bytes written to client sockets")
+outbound_frames = Counter("chat_outbound_frames_total", "Frames sent to client sockets")
+socket_writes = Counter("chat_socket_writes_total", "TLS writes to client sockets (frames are coalesced)")
+lane_wait_seconds = Histogram("chat_lane_wait_seconds",
+                              "Time an outbound frame waits in its connection's priority lane", ("lane",))
+db_seconds = Histogram("chat_db_seconds", "Database operation latency", ("op",))
+upload_bytes = Counter("chat_upload_bytes_total", "Decoded bytes of uploaded files")
+upload_seconds = Histogram("chat_upload_seconds", "Time to decode and store an upload")
+handshake_failures = Counter("chat_handshake_failures_total", "Failed TLS handshakes")
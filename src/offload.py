@@ -0,0 +1,143 @@
+"""Process pool for CPU-heavy payload work.
+
+Handler threads share the GIL, so a large upload being parsed, decoded
+or re-encoded for fan-out stalls every other connection for as long as it
+takes (tens to hundreds of milliseconds for a 20 MB file). run() sends
+such work to a pool of worker processes when its input reaches the op's
+threshold; everything smaller runs inline, where a process hop would
+cost more than it saves. Only work whose arguments and results are flat
+strings or bytes (cheap to pickle) or whose result is much cheaper to
+pickle than to produce is worth sending.
+
+    frames = offload.run("encode", len(filedata), encode_frames, msg)
+
+Queue wait (submit to start in a worker, argument transfer included) and
+execution time are reported per op in chat_offload_wait_seconds and
+chat_offload_exec_seconds.
+"""
+import base64
+import multiprocessing
+import os
+import signal
+import sys
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+import metrics
+
+WORKERS = min(4, max(1, (os.cpu_count() or 2) // 2))  # Pool processes; 0 runs everything inline
+# Input size from which an op goes to the pool: bytes, except "reply" (rows)
+THRESHOLDS = {
+    "decode": 256 * 1024,  # json.loads of an inbound frame
+    "upload": 256 * 1024,  # base64 decode of a file and writing it out
+    "encode": 256 * 1024,  # File fan-out frames
+    "reply": 5000,  # Rows of a search result to serialize
+}
+SERVER_POLL = 1  # Seconds between a pool process's checks that the server is still running
+
+wait_seconds = metrics.Histogram("chat_offload_wait_seconds",
+                                 "Time offloaded work waits for a pool process", ("op",))
+exec_seconds = metrics.Histogram("chat_offload_exec_seconds", "Time offloaded work runs in the pool", ("op",))
+offloaded = metrics.Counter("chat_offload_total", "Operations sent to the offload pool", ("op",))
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def _watch_server(pid):
+    # A server killed without shutting the pool down leaves its processes
+    # waiting for work forever (they hold the task queue open themselves)
+    while True:
+        time.sleep(SERVER_POLL)
+        try:
+            os.kill(pid, 0)
+        except ProcessLookupError:
+            os._exit(0)
+        except PermissionError:
+            pass
+
+
+def _init_worker(server_pid):
+    signal.signal(signal.SIGINT, signal.SIG_IGN)  # Ctrl+C is for the server, which shuts us down
+    threading.Thread(target=_watch_server, args=(server_pid,), daemon=True).start()
+
+
+def _timed(func, args):
+    # time.monotonic() is system-wide, so the server can compare it with its own
+    started = time.monotonic()
+    result = func(*args)
+    return result, started, time.monotonic()
+
+
+def _new_pool():
+    if "forkserver" in multiprocessing.get_all_start_methods():
+        # Not fork: the server has threads (and locks they may hold)
+        context = multiprocessing.get_context("forkserver")
+        context.set_forkserver_preload(["offload"])
+    else:
+        context = multiprocessing.get_context("spawn")
+    return ProcessPoolExecutor(WORKERS, mp_context=context, initializer=_init_worker,
+                               initargs=(os.getpid(),))
+
+
+def _submit(func, args):
+    global _pool
+    main = sys.modules["__main__"]
+    with _pool_lock:
+        if _pool is None:
+            _pool = _new_pool()
+        # Pool processes are started on submit and would re-run server.py's
+        # module level (certificate loading included) as __mp_main__; they
+        # only need this module, so don't tell them about the main script
+        path = getattr(main, "__file__", None)
+        if path:
+            del main.__file__
+        try:
+            return _pool.submit(_timed, func, args)
+        finally:
+            if path:
+                main.__file__ = path
+
+
+def start():
+    """Start the pool processes now instead of on the first large payload"""
+    futures = [_submit(time.sleep, (0.1,)) for _ in range(WORKERS)]
+    for future in futures:
+        future.result()
+
+
+def shutdown():
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.shutdown(wait=False, cancel_futures=True)
+            _pool = None
+
+
+def run(op, size, func, *args):
+    """func(*args), in a pool process if size reaches the op's threshold.
+    func must be a module-level function; its exceptions are raised here."""
+    if not WORKERS or size < THRESHOLDS[op]:
+        return func(*args)
+    submitted = time.monotonic()
+    try:
+        result, started, finished = _submit(func, args).result()
+    except BrokenProcessPool:
+        # A pool process died (e.g. killed by the OOM killer): start a new pool next time
+        print(f"⚠ Offload pool broken, running {op} inline")
+        shutdown()
+        return func(*args)
+    offloaded.inc(op=op)
+    wait_seconds.observe(started - submitted, op=op)
+    exec_seconds.observe(finished - started, op=op)
+    return result
+
+
+def store_upload(path, filedata):
+    """Decode base64 filedata into a new file at path; returns its size"""
+    data = base64.b64decode(filedata)
+    with open(path, "wb") as f:
+        f.write(data)
+    return len(data)
@@ -1,4 +1,3 @@
-import json
 import re
 from datetime import datetime
 
@@ -6,7 +5,10 @@ from PyQt5.QtCore import Qt, QTimer
 from PyQt5.QtGui import QFont, QTextCursor
 from PyQt5.QtWidgets import QWidget, QVBoxLayout, QHBoxLayout, QLabel, QTextBrowser, QLineEdit, QPushButton
 
-from client_connection import conn, USERNAME
+from chat_client import format_timestamp
+from client_connection import session, USERNAME
+
+MAX_CHAT_BLOCKS = 15000  # Text blocks kept in a chat view (3 per message); older ones are dropped
 
 
 class PrivateChat(QWidget):
@@ -44,6 +46,7 @@ class PrivateChat(QWidget):
         self.chat.setSource = lambda url: None
         self.chat.setOpenExternalLinks(False)  # Now this will work!
         self.chat.setFont(QFont("Segoe UI", 10))
+        self.chat.document().setMaximumBlockCount(MAX_CHAT_BLOCKS)
         main_layout.addWidget(self.chat)
 
         # Typing indicator label
@@ -86,20 +89,13 @@ class PrivateChat(QWidget):
             self.remove_typing_indicator()
 
             payload = {"type": "private", "to": self.username, "content": msg}
-            conn.sendall(json.dumps(payload).encode())
+            session.send(payload)
             self.show_message(USERNAME, msg)  # show locally
             self.input.clear()
             self.last_typing_sent = 0
 
     def show_message(self, sender, content, timestamp=None):
-        if timestamp:
-            try:
-                dt = datetime.strptime(timestamp, "%Y-%m-%d %H:%M:%S")
-                time = dt.strftime("%H:%M")
-            except ValueError:
-                time = timestamp
-        else:
-            time = datetime.now().strftime("%H:%M")
+        time = format_timestamp(timestamp)
 
         is_own = sender == USERNAME
         align = Qt.AlignRight if is_own else Qt.AlignLeft
@@ -146,8 +142,7 @@ class PrivateChat(QWidget):
     def send_typing_notification(self):
         """Send typing notification to server"""
         if self.input.text().strip():
-            conn.sendall(json.dumps(
-                {"type": "typing", "to": self.username}).encode())
+            session.send({"type": "typing", "to": self.username})
             self.last_typing_sent = datetime.now().timestamp()
 
     def show_typing_indicator(self, sender):
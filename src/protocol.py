@@ -0,0 +1,79 @@
+import itertools
+import json
+import time
+
+MAX_FRAME_SIZE = 64 * 1024 * 1024  # Largest accepted frame (file uploads included)
+FILE_CHUNK_SIZE = 64 * 1024  # Characters of base64 file data per outbound file_chunk frame
+
+_transfers = itertools.count(1)
+
+
+def encode(msg):
+    """Serialize a message as a single newline-terminated JSON frame"""
+    return json.dumps(msg).encode() + b"\n"
+
+
+def next_transfer():
+    return next(_transfers)
+
+
+def encode_frames(msg, transfer=None):
+    """msg as a list of frames. A file message with more than FILE_CHUNK_SIZE
+    of data becomes file_chunk frames carrying the data, then the file
+    message itself with "chunked" (the transfer id) instead of "filedata",
+    so that other frames can be sent between the chunks. Pass transfer
+    (from next_transfer()) when encoding in another process."""
+    data = msg.get("filedata") if msg.get("type") == "file" else None
+    if not data or len(data) <= FILE_CHUNK_SIZE:
+        return [encode(msg)]
+    if transfer is None:
+        transfer = next_transfer()
+    frames = [encode({"type": "file_chunk", "id": transfer, "data": data[i:i + FILE_CHUNK_SIZE]})
+              for i in range(0, len(data), FILE_CHUNK_SIZE)]
+    header = {key: value for key, value in msg.items() if key != "filedata"}
+    frames.append(encode({**header, "chunked": transfer}))
+    return frames
+
+
+class FrameReader:
+    """Split a socket byte stream into newline-delimited frames"""
+
+    def __init__(self, conn, bufsize=65536):
+        self.conn = conn
+        self.bufsize = bufsize
+        self.buffer = bytearray()
+        self.scanned = 0  # Bytes already searched for a newline
+        self.frame_started = 0.0
+        self.last_recv_seconds = 0.0  # First byte to last byte of the latest frame
+
+    def read_line(self):
+        """Return the next raw frame (without newline), or None on EOF"""
+        while True:
+            idx = self.buffer.find(b"\n", self.scanned)
+            if idx >= 0:
+                line = bytes(self.buffer[:idx])
+                del self.buffer[:idx + 1]
+                self.scanned = 0
+                now = time.perf_counter()
+                self.last_recv_seconds = now - self.frame_started
+                self.frame_started = now  # Pipelined bytes are already here
+                return line
+            self.scanned = len(self.buffer)
+            if self.scanned > MAX_FRAME_SIZE:
+                raise ValueError("Frame exceeds maximum size")
+
+            data = self.conn.recv(self.bufsize)
+            if not data:
+                return None
+            if not self.buffer:
+                self.frame_started = time.perf_counter()
+            self.buffer += data
+
+    def read(self):
+        """Return the next decoded message, or None on EOF"""
+        while True:
+            line = self.read_line()
+            if line is None:
+                return None
+            if line.strip():
+                return json.loads(line)
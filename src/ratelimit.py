@@ -0,0 +1,112 @@
+import json
+import time
+
+import metrics
+
+# Per message type: (tokens refilled per second, bucket size)
+TYPE_LIMITS = {
+    "group": (5, 20),
+    "private": (5, 20),
+    "typing": (4, 10),
+    "file": (0.2, 3),
+    "search": (0.5, 5),
+    "history_range": (1, 5),
+}
+
+# Every user also has one shared budget that each message draws from by cost
+USER_LIMIT = (10, 40)
+COSTS = {
+    "group": 1,
+    "private": 1,
+    "typing": 0.25,
+    "file": 10,
+    "search": 8,
+    "history_range": 4,
+    "ping": 0,
+}
+FILE_COST_PER_MB = 5  # Extra cost per MB of (base64) file data
+DEFAULT_COST = 1
+
+rejected = metrics.Counter("chat_rate_limited_total", "Messages rejected by rate limits", ("type",))
+
+
+def load_config(path):
+    """Override the limits above from a JSON file with any of the keys
+    type_limits, user_limit, costs, file_cost_per_mb"""
+    global USER_LIMIT, FILE_COST_PER_MB
+    with open(path) as f:
+        config = json.load(f)
+    TYPE_LIMITS.update({t: tuple(v) for t, v in config.get("type_limits", {}).items()})
+    COSTS.update(config.get("costs", {}))
+    USER_LIMIT = tuple(config.get("user_limit", USER_LIMIT))
+    FILE_COST_PER_MB = config.get("file_cost_per_mb", FILE_COST_PER_MB)
+
+
+def message_cost(msg_type, msg):
+    cost = COSTS.get(msg_type, DEFAULT_COST)
+    if msg_type == "file":
+        cost += len(msg.get("filedata", "")) / (1024 * 1024) * FILE_COST_PER_MB
+    return cost
+
+
+class TokenBucket:
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, cost):
+        """Seconds until cost tokens are available (0 if they are now)"""
+        self.refill()
+        if self.tokens >= cost:
+            return 0.0
+        if cost > self.capacity:
+            # Never affordable in one go: let it through once the bucket is full
+            return (self.capacity - self.tokens) / self.rate
+        return (cost - self.tokens) / self.rate
+
+    def take(self, cost):
+        self.tokens = max(0.0, self.tokens - cost)
+
+
+class RateLimiter:
+    """Token buckets for one connected user (used only by its handler thread)"""
+
+    def __init__(self):
+        self.user_bucket = TokenBucket(*USER_LIMIT)
+        self.type_buckets = {}
+
+    def check(self, msg_type, msg):
+        """Charge for a message; returns 0 if allowed, else seconds to wait"""
+        type_bucket = self.type_buckets.get(msg_type)
+        if type_bucket is None and msg_type in TYPE_LIMITS:
+            type_bucket = self.type_buckets[msg_type] = TokenBucket(*TYPE_LIMITS[msg_type])
+
+        cost = message_cost(msg_type, msg)
+        wait = self.user_bucket.wait_time(cost)
+        if type_bucket:
+            wait = max(wait, type_bucket.wait_time(1))
+        if wait > 0:
+            rejected.inc(type=msg_type)
+            return wait
+
+        self.user_bucket.take(cost)
+        if type_bucket:
+            type_bucket.take(1)
+        return 0.0
+
+
+def rejection(msg_type, wait):
+    return {
+        "type": "error",
+        "code": "rate_limited",
+        "message_type": msg_type,
+        "retry_after_ms": int(wait * 1000) + 1,
+        "message": f"Too many '{msg_type}' messages, retry later",
+    }
@@ -0,0 +1,65 @@
+import threading
+
+SHARDS = 16
+
+
+class _Shard:
+    def __init__(self):
+        self.lock = threading.Lock()  # Serializes writers only
+        self.snapshot = {}  # Replaced, never mutated, once published
+
+
+class ClientRegistry:
+    """username: connection map built for many concurrent readers.
+
+    Usernames are sharded by hash. Each shard publishes an immutable dict
+    snapshot that is swapped in one assignment on join/leave, so lookups
+    and broadcast iteration take no lock at all. Writers lock only their
+    shard while they copy and swap. Nothing under a shard lock ever does
+    network I/O.
+    """
+
+    def __init__(self, shards=SHARDS):
+        self.shards = [_Shard() for _ in range(shards)]
+
+    def _shard(self, username):
+        return self.shards[hash(username) % len(self.shards)]
+
+    def get(self, username):
+        return self._shard(username).snapshot.get(username)
+
+    def __contains__(self, username):
+        return username in self._shard(username).snapshot
+
+    def __len__(self):
+        return sum(len(shard.snapshot) for shard in self.shards)
+
+    def add(self, username, conn):
+        """Register a connection; False if the name is already taken"""
+        shard = self._shard(username)
+        with shard.lock:
+            if username in shard.snapshot:
+                return False
+            updated = dict(shard.snapshot)
+            updated[username] = conn
+            shard.snapshot = updated
+        return True
+
+    def remove(self, username, conn):
+        """Unregister username if it still maps to conn; True if it did"""
+        shard = self._shard(username)
+        with shard.lock:
+            if shard.snapshot.get(username) is not conn:
+                return False
+            updated = dict(shard.snapshot)
+            del updated[username]
+            shard.snapshot = updated
+        return True
+
+    def items(self):
+        """(username, conn) pairs; each shard is read from one snapshot"""
+        for shard in self.shards:
+            yield from shard.snapshot.items()
+
+    def usernames(self):
+        return [username for shard in self.shards for username in shard.snapshot]
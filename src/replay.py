@@ -0,0 +1,298 @@
+"""Replay a traffic capture (see capture.py) against a server, sped up.
+
+Every captured user becomes a simulated client that connects, sends and
+disconnects on the captured schedule divided by --speed. Message text and
+files are filler of the captured sizes, carrying a send timestamp so the
+end-to-end latency of each delivery is measured as in loadgen.py.
+
+    python server.py --capture peak.log.gz        # or the admin "capture" command
+    python replay.py peak.log.gz --speed 10
+    python replay.py capture-*.log.gz --speed 50 --output replay.json
+
+Several files (one per prefork worker) are merged into one schedule.
+Without --server a local server is started; its rate limits are raised
+by --speed so the sped-up users are not throttled where the real ones
+were not. "lag" reports how far sends fell behind the schedule: if it
+grows, the replay (not the server) was the bottleneck.
+"""
+import argparse
+import asyncio
+import base64
+import gzip
+import json
+import os
+import random
+import re
+import tempfile
+import time
+import zlib
+from types import SimpleNamespace
+
+import loadgen
+import ratelimit
+from chat_client import default_ssl_context
+
+SPEEDS = (1, 50)  # Supported range; beyond it lag dominates the results
+MESSAGE_TYPES = ("group", "private", "typing", "file", "search", "history_range")
+
+
+def load_capture(paths):
+    """Merged events of the capture files, ordered by time; users are
+    renamed "<file>.<user>" so ids from different workers do not collide"""
+    events = []
+    for index, path in enumerate(paths):
+        try:
+            with gzip.open(path, "rt", encoding="utf-8") as f:
+                header = json.loads(f.readline())
+                if header.get("capture") != 1:
+                    raise ValueError(f"{path}: not a version 1 capture")
+                for line in f:
+                    try:
+                        event = json.loads(line)
+                    except json.JSONDecodeError:
+                        break  # Cut off mid-line by a killed server
+                    event[1] = f"{index}.{event[1]}"
+                    details = event[4] if len(event) > 4 else {}
+                    for peer in ("to", "with"):
+                        if peer in details:
+                            details[peer] = f"{index}.{details[peer]}"
+                    events.append(event)
+        except (EOFError, zlib.error):
+            pass  # Log of a server that was killed: use what was flushed
+    events.sort(key=lambda e: e[0])
+    return events
+
+
+def filler(prefix, length):
+    """prefix padded with x to length characters"""
+    return prefix + " " + "x" * max(0, length - len(prefix) - 1)
+
+
+class Replay:
+    def __init__(self, host, port, speed):
+        self.host = host
+        self.port = port
+        self.speed = speed
+        self.context = default_ssl_context()
+        self.bench = loadgen.Bench(SimpleNamespace(file_size=0))
+        self.run_id = f"{os.getpid()}{random.randint(0, 9999)}"
+        self.users = {}  # captured user: SimUser
+        self.queues = {}  # captured user: asyncio.Queue of events
+        self.players = []  # One task per captured user
+        self.listeners = []
+        self.lag = []  # Seconds each event was sent behind schedule
+        self.skipped = {}  # reason: count
+        self.blobs = {}  # file size: base64 data
+        self.seq = 0
+
+    def skip(self, reason):
+        self.skipped[reason] = self.skipped.get(reason, 0) + 1
+
+    def online_name(self, user):
+        sim = self.users.get(user)
+        return sim.name if sim and sim.client.connected else None
+
+    async def ensure_connected(self, user):
+        sim = self.users.get(user)
+        if sim and sim.client.connected:
+            return sim
+        sim = loadgen.SimUser(f"rp{self.run_id}-{user}", self.bench, self.host, self.port,
+                              self.context)
+        self.users[user] = sim
+        self.bench.users[sim.name] = sim
+        try:
+            await sim.connect()
+        except (ConnectionError, OSError):
+            self.bench.errors += 1
+            return None
+        self.listeners.append(asyncio.create_task(sim.listen()))
+        return sim
+
+    async def run_user(self, user):
+        """Play one captured user's events in order"""
+        queue = self.queues[user]
+        while True:
+            event = await queue.get()
+            if event is None:
+                return
+            due, kind = event[0], event[2]
+            details = event[4] if len(event) > 4 else {}
+            self.lag.append(max(0.0, time.perf_counter() - due))
+            if kind == "disconnect":
+                sim = self.users.get(user)
+                if sim and sim.client.connected:
+                    await sim.close()
+                continue
+            sim = await self.ensure_connected(user)  # Sessions already open when capture started
+            if kind == "connect" or sim is None:
+                continue
+            try:
+                await self.send(sim, kind, details)
+            except (ConnectionError, OSError):
+                self.bench.errors += 1
+
+    async def send(self, sim, kind, details):
+        if kind not in MESSAGE_TYPES:
+            self.skip(kind)  # e.g. pings, which the client library sends itself
+            return
+        self.seq += 1
+        now = time.perf_counter()
+        stamp = f"lg {self.seq} {now:.6f}"
+
+        to = None
+        if kind in ("private", "typing") and "to" in details:
+            to = self.online_name(details["to"])
+            if to is None:
+                self.skip(f"{kind}_peer_offline")
+                return
+
+        if kind == "group":
+            await sim.send({"type": "group", "content": filler(stamp, details.get("len", 0))})
+        elif kind == "private":
+            await sim.send({"type": "private", "to": to, "content": filler(stamp, details.get("len", 0))})
+        elif kind == "typing":
+            if to:
+                self.bench.pending_typing[(sim.name, to)] = now
+            await sim.send({"type": "typing", "to": to})
+        elif kind == "file":
+            size = details.get("bytes", 0)
+            if size not in self.blobs:
+                self.blobs[size] = base64.b64encode(os.urandom(size)).decode()
+            ext = re.sub(r"[^A-Za-z0-9.]", "", details.get("ext", "")) or ".bin"
+            await sim.send({"type": "file", "filename": f"lg_{sim.name}-{self.seq}_{now:.6f}{ext}",
+                            "filedata": self.blobs[size]})
+        elif kind == "search":
+            sim.searches.append(now)
+            await sim.send({"type": "search", "content": filler(f"lg {random.randint(0, 999)}",
+                                                                details.get("len", 0))})
+        elif kind == "history_range":
+            until = int(time.time() * 1000)
+            span = details.get("span_ms")
+            msg = {"type": "history_range", "since": until - span if span is not None else None,
+                   "until": until if span is not None else None, "limit": details.get("limit")}
+            if "with" in details:
+                msg["with"] = self.online_name(details["with"]) or f"rp{self.run_id}-{details['with']}"
+            sim.ranges.append(now)
+            await sim.send(msg)
+
+    async def run(self, events):
+        """Play events; returns the seconds sending took"""
+        start = time.perf_counter()
+        for event in events:
+            user = event[1]
+            if user not in self.queues:
+                self.queues[user] = asyncio.Queue()
+                self.players.append(asyncio.create_task(self.run_user(user)))
+            due = start + event[0] / 1000 / self.speed
+            delay = due - time.perf_counter()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            self.queues[user].put_nowait([due, *event[1:]])
+
+        for queue in self.queues.values():
+            queue.put_nowait(None)
+        await asyncio.gather(*self.players)
+        elapsed = time.perf_counter() - start
+
+        await asyncio.sleep(loadgen.DRAIN_TIME)
+        await asyncio.gather(*(sim.close() for sim in self.users.values()))
+        await asyncio.gather(*self.listeners, return_exceptions=True)
+        return elapsed
+
+
+def scaled_limits(speed):
+    """A --rate-limits file with every refill rate multiplied by speed"""
+    config = {
+        "type_limits": {t: [rate * speed, burst] for t, (rate, burst) in ratelimit.TYPE_LIMITS.items()},
+        "user_limit": [ratelimit.USER_LIMIT[0] * speed, ratelimit.USER_LIMIT[1]],
+    }
+    f = tempfile.NamedTemporaryFile("w", suffix=".json", delete=False)
+    json.dump(config, f)
+    f.close()
+    return f.name
+
+
+def report(events, speed, elapsed, replay):
+    bench = replay.bench
+    captured = events[-1][0] / 1000 if events else 0
+    sent = sum(bench.sent.values())
+    lag = loadgen.summarize(replay.lag)
+    return {
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "speed": speed,
+        "events": len(events),
+        "users": len(replay.queues),
+        "captured_seconds": round(captured, 3),
+        "replay_seconds": round(elapsed, 3),
+        "sent": bench.sent,
+        "received": bench.received,
+        "send_rate_per_sec": round(sent / elapsed, 2) if elapsed else None,
+        "delivery_rate_per_sec": round(sum(bench.received.values()) / elapsed, 2) if elapsed else None,
+        "latency": {kind: loadgen.summarize(samples) for kind, samples in sorted(bench.latencies.items())},
+        "lag": lag,
+        "skipped": replay.skipped,
+        "errors": bench.errors,
+    }
+
+
+def print_report(result):
+    print(f"Replayed {result['events']} events of {result['users']} users: "
+          f"{result['captured_seconds']}s captured in {result['replay_seconds']}s ({result['speed']}x)")
+    print(f"Sent {result['send_rate_per_sec']}/s, delivered {result['delivery_rate_per_sec']}/s, "
+          f"errors: {result['errors']}")
+    print(f"Schedule lag p50 {result['lag']['p50_ms']} ms, p99 {result['lag']['p99_ms']} ms, "
+          f"max {result['lag']['max_ms']} ms")
+    if result["skipped"]:
+        print("Skipped: " + ", ".join(f"{k} {v}" for k, v in sorted(result["skipped"].items())))
+    print(f"{'type':<14}{'sent':>8}{'recv':>10}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}")
+    for kind, lat in result["latency"].items():
+        print(f"{kind:<14}{result['sent'].get(kind, 0):>8}{lat['count']:>10}"
+              f"{lat['p50_ms']:>10}{lat['p95_ms']:>10}{lat['p99_ms']:>10}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Replay a traffic capture against a chat server")
+    parser.add_argument("captures", nargs="+", help="capture files written by server.py --capture")
+    parser.add_argument("--speed", type=float, default=1.0,
+                        help=f"time compression, {SPEEDS[0]}x to {SPEEDS[1]}x")
+    parser.add_argument("--server", help="host:port of a running server (default: start one locally)")
+    parser.add_argument("--port", type=int, default=5880, help="port for the local server")
+    parser.add_argument("--keep-limits", action="store_true",
+                        help="do not scale the local server's rate limits by --speed")
+    parser.add_argument("--output", help="write JSON results to this file")
+    args = parser.parse_args(argv)
+    if not SPEEDS[0] <= args.speed <= SPEEDS[1]:
+        parser.error(f"--speed must be between {SPEEDS[0]} and {SPEEDS[1]}")
+
+    events = load_capture(args.captures)
+    if not events:
+        parser.error("no events in the capture")
+
+    local = limits = None
+    if not args.server:
+        server_args = []
+        if not args.keep_limits:
+            limits = scaled_limits(args.speed)
+            server_args = ["--rate-limits", limits]
+        local = loadgen.spawn_server(args.port, server_args)
+        args.server = f"127.0.0.1:{args.port}"
+    host, _, port = args.server.rpartition(":")
+    replay = Replay(host, int(port), args.speed)
+    try:
+        elapsed = asyncio.run(replay.run(events))
+    finally:
+        if local:
+            loadgen.stop_server(*local)
+        if limits:
+            os.unlink(limits)
+
+    result = report(events, args.speed, elapsed, replay)
+    print_report(result)
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(result, f, indent=2)
+        print(f"Results written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,393 @@
+"""Append-only segmented log store (--storage log).
+
+Messages are appended to fixed-size segment files (00000001.seg, ...),
+preallocated to SEGMENT_BYTES and written and read through mmap. A record is
+
+    u32 length | u32 crc32 | i64 timestamp | u16 key length | conversation | JSON body
+
+where length and the CRC cover everything after the crc field, and a
+zero length marks the end of the written data.
+
+Each segment is cut into blocks of about INDEX_INTERVAL bytes. When a
+block fills up, a sparse index entry for it (position, end, min and max
+timestamp, conversations present) is appended to the segment's .idx
+file. A range read visits only the blocks of one conversation that
+overlap the time range, newest first, and decodes them straight out of
+the mmap, checking each record's CRC.
+
+Opening the store loads every .idx file and then scans the data after the
+last indexed block record by record. A torn or corrupt tail in the newest
+segment, left by a crash mid-write, is zeroed and writing resumes after
+the last good record. Deleting old messages raises a floor timestamp
+(meta.json) and unlinks the segments that lie entirely below it.
+
+One process at a time: the directory is locked while open.
+"""
+import json
+import mmap
+import os
+import struct
+import zlib
+from datetime import datetime
+
+import metrics
+
+try:
+    import fcntl
+except ImportError:  # Windows: no advisory lock
+    fcntl = None
+
+SEGMENT_BYTES = 64 * 1024 * 1024
+INDEX_INTERVAL = 16 * 1024  # Bytes of records per sparse index entry
+SYNC_WRITES = True  # msync on every commit, like SQLite's fsync; False leaves it to the OS
+
+PREFIX = struct.Struct("<II")  # length, crc32
+TAIL = struct.Struct("<qH")  # timestamp, conversation key length
+ENTRY = struct.Struct("<IIqqI")  # position, end, min timestamp, max timestamp, keys length
+
+corrupt_records = metrics.Counter("chat_log_corrupt_records_total",
+                                  "Log records skipped because their CRC did not match")
+
+
+class Block:
+    __slots__ = ("segment", "pos", "end", "min_ts", "max_ts", "keys")
+
+    def __init__(self, segment, pos, end=None, min_ts=None, max_ts=None, keys=None):
+        self.segment = segment
+        self.pos = pos
+        self.end = pos if end is None else end
+        self.min_ts = min_ts
+        self.max_ts = max_ts
+        self.keys = set() if keys is None else keys
+
+    def add(self, timestamp, key, end):
+        self.end = end
+        self.min_ts = timestamp if self.min_ts is None else min(self.min_ts, timestamp)
+        self.max_ts = timestamp if self.max_ts is None else max(self.max_ts, timestamp)
+        self.keys.add(key)
+
+    def overlaps(self, since, until):
+        return self.min_ts is not None and self.min_ts < until and self.max_ts >= since
+
+
+class Segment:
+    def __init__(self, directory, number):
+        self.number = number
+        self.path = os.path.join(directory, f"{number:08d}.seg")
+        self.index_path = os.path.join(directory, f"{number:08d}.idx")
+        self.file = open(self.path, "r+b" if os.path.exists(self.path) else "w+b")
+        if os.path.getsize(self.path) < SEGMENT_BYTES:
+            self.file.truncate(SEGMENT_BYTES)  # Sparse where the filesystem allows
+        self.mm = mmap.mmap(self.file.fileno(), SEGMENT_BYTES)
+        self.blocks = []  # Closed blocks, in order
+        self.open_block = None  # Block being filled, in the newest segment only
+        self.end = 0  # Where the next record goes
+
+    def close(self):
+        self.mm.close()
+        self.file.close()
+
+
+class SegmentLogStore:
+    def __init__(self, path):
+        self.path = path
+        os.makedirs(path, exist_ok=True)
+        self.lock_file = open(os.path.join(path, "lock"), "w")
+        if fcntl:
+            try:
+                fcntl.flock(self.lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                raise RuntimeError(f"Message log {path} is in use by another process")
+        self.meta_path = os.path.join(path, "meta.json")
+        self.floor = 0  # Messages older than this are deleted
+        if os.path.exists(self.meta_path):
+            with open(self.meta_path) as f:
+                self.floor = json.load(f)["floor"]
+
+        self.segments = []
+        self.conversations = {}  # conversation key (bytes): [Block], in order
+        self.user_chats = {}  # username: set of private conversation keys (bytes)
+        self.dirty = None  # (segment, first byte) not yet synced
+        numbers = sorted(int(name[:-4]) for name in os.listdir(path) if name.endswith(".seg"))
+        for number in numbers:
+            self.recover(Segment(path, number), last=number == numbers[-1])
+        if not self.segments:
+            self.start_segment(1)
+
+    # Opening and recovery
+
+    def load_index(self, segment):
+        """Closed blocks from the segment's .idx; a torn last entry is cut off"""
+        if not os.path.exists(segment.index_path):
+            return
+        with open(segment.index_path, "rb") as f:
+            data = f.read()
+        pos = 0
+        expected = 0
+        while pos + ENTRY.size <= len(data):
+            start, end, min_ts, max_ts, keys_len = ENTRY.unpack_from(data, pos)
+            if start != expected or end > SEGMENT_BYTES or pos + ENTRY.size + keys_len > len(data):
+                break
+            keys = data[pos + ENTRY.size:pos + ENTRY.size + keys_len].split(b"\n")
+            segment.blocks.append(Block(segment, start, end, min_ts, max_ts, set(keys)))
+            pos += ENTRY.size + keys_len
+            expected = end
+        if pos < len(data):
+            with open(segment.index_path, "r+b") as f:
+                f.truncate(pos)
+
+    def recover(self, segment, last):
+        self.load_index(segment)
+        self.segments.append(segment)
+        for block in segment.blocks:
+            self.track(block)
+
+        # Records written after the last index entry
+        mm = segment.mm
+        pos = segment.blocks[-1].end if segment.blocks else 0
+        block = Block(segment, pos)
+        while pos + PREFIX.size <= SEGMENT_BYTES:
+            length, crc = PREFIX.unpack_from(mm, pos)
+            if length == 0:
+                break
+            stop = pos + PREFIX.size + length
+            if length < TAIL.size or stop > SEGMENT_BYTES or zlib.crc32(mm[pos + PREFIX.size:stop]) != crc:
+                print(f"⚠ {segment.path}: corrupt record at byte {pos}, "
+                      f"{'discarding the torn tail' if last else 'skipping the rest of the segment'}")
+                if last:
+                    mm[pos:] = bytes(SEGMENT_BYTES - pos)
+                break
+            timestamp, key_len = TAIL.unpack_from(mm, pos + PREFIX.size)
+            key_start = pos + PREFIX.size + TAIL.size
+            block.add(timestamp, mm[key_start:key_start + key_len], stop)
+            pos = stop
+            if block.end - block.pos >= INDEX_INTERVAL:
+                self.close_block(segment, block)
+                block = Block(segment, pos)
+        segment.end = pos
+        if block.keys:
+            if last:
+                segment.open_block = block
+                self.track(block)
+            else:
+                self.close_block(segment, block)
+        elif last:
+            segment.open_block = block
+
+    def track(self, block):
+        for key in block.keys:
+            blocks = self.conversations.setdefault(key, [])
+            if not blocks or blocks[-1] is not block:
+                blocks.append(block)
+            users = key.decode().split("|")
+            # Usernames cannot contain "|"; a key of any other shape is not a
+            # private chat that can be attributed to its two users
+            if len(users) == 2:
+                for user in users:
+                    self.user_chats.setdefault(user, set()).add(key)
+
+    def close_block(self, segment, block):
+        """Seal block and persist its index entry"""
+        keys = b"\n".join(sorted(block.keys))
+        with open(segment.index_path, "ab") as f:
+            f.write(ENTRY.pack(block.pos, block.end, block.min_ts, block.max_ts, len(keys)) + keys)
+        segment.blocks.append(block)
+        self.track(block)  # A no-op for the open block, tracked as it filled
+
+    def start_segment(self, number):
+        segment = Segment(self.path, number)
+        segment.open_block = Block(segment, 0)
+        self.segments.append(segment)
+        return segment
+
+    # Writing
+
+    def append(self, sender, receiver, content, timestamp, msg_type, conversation):
+        key = conversation.encode()
+        body = json.dumps([sender, receiver, content, msg_type], ensure_ascii=False).encode()
+        tail = TAIL.pack(timestamp, len(key)) + key + body
+        record = PREFIX.pack(len(tail), zlib.crc32(tail)) + tail
+        if len(record) > SEGMENT_BYTES:
+            raise ValueError(f"Message of {len(record)} bytes does not fit in a log segment")
+
+        segment = self.segments[-1]
+        if segment.end + len(record) > SEGMENT_BYTES:
+            self.commit()
+            block, segment.open_block = segment.open_block, None
+            if block.keys:
+                self.close_block(segment, block)
+            segment = self.start_segment(segment.number + 1)
+
+        pos = segment.end
+        segment.mm[pos:pos + len(record)] = record
+        segment.end = pos + len(record)
+        if self.dirty is None:
+            self.dirty = (segment, pos)
+
+        block = segment.open_block
+        new_key = key not in block.keys
+        block.add(timestamp, key, segment.end)
+        if new_key:
+            self.track(block)
+        if block.end - block.pos >= INDEX_INTERVAL:
+            self.close_block(segment, block)
+            segment.open_block = Block(segment, segment.end)
+
+    def append_many(self, rows):
+        for row in rows:
+            self.append(*row)
+        self.commit()
+
+    def commit(self):
+        if self.dirty is None:
+            return
+        segment, start = self.dirty
+        self.dirty = None
+        if SYNC_WRITES:
+            # msync whole pages from the first unsynced record
+            first = start - start % mmap.ALLOCATIONGRANULARITY
+            segment.mm.flush(first, segment.end - first)
+
+    # Reading
+
+    def blocks(self):
+        for segment in self.segments:
+            yield from segment.blocks
+            if segment.open_block is not None and segment.open_block.keys:
+                yield segment.open_block
+
+    def records(self, block, key=None, needle=None):
+        """(timestamp, conversation, body) of block's records, or only those
+        of conversation key, or whose lowercased body contains needle (bytes);
+        CRCs are checked on the records returned"""
+        mm = block.segment.mm
+        if needle is not None and needle not in mm[block.pos:block.end].lower():
+            return
+        pos = block.pos
+        while pos < block.end:
+            length, crc = PREFIX.unpack_from(mm, pos)
+            start = pos + PREFIX.size
+            pos = start + length
+            if length < TAIL.size or pos > block.end:
+                corrupt_records.inc()  # Length field damaged: the rest of the block is unreadable
+                return
+            timestamp, key_len = TAIL.unpack_from(mm, start)
+            if timestamp < self.floor:
+                continue
+            record_key = mm[start + TAIL.size:start + TAIL.size + key_len]
+            if key is not None and record_key != key:
+                continue
+            body = mm[start + TAIL.size + key_len:pos]
+            if needle is not None and needle not in body.lower():
+                continue
+            if zlib.crc32(mm[start:pos]) != crc:
+                corrupt_records.inc()
+                continue
+            yield timestamp, record_key, body
+
+    @staticmethod
+    def row(timestamp, body):
+        sender, receiver, content, msg_type = json.loads(body)
+        return sender, receiver, content, timestamp, msg_type
+
+    def rows(self):
+        return [self.row(timestamp, body)
+                for block in self.blocks() for timestamp, _, body in self.records(block)]
+
+    def search(self, keyword):
+        needle = keyword.lower()
+        # Cheap byte test first, against the needle as it is escaped in the
+        # JSON body; ASCII lowercasing is exact for ASCII needles
+        raw = json.dumps(needle, ensure_ascii=False)[1:-1].encode() if needle.isascii() else None
+        results = []
+        for block in self.blocks():
+            for timestamp, _, body in self.records(block, needle=raw):
+                sender, _, content, _ = json.loads(body)
+                if needle in (content or "").lower():
+                    results.append((sender, content, timestamp))
+        return results
+
+    def conversation_range(self, conversation, since, until, limit):
+        key = conversation.encode()
+        since = max(since, self.floor)
+        found = []  # Newest blocks first
+        count = 0
+        for block in reversed(self.conversations.get(key, ())):
+            if not block.overlaps(since, until):
+                continue
+            rows = [self.row(timestamp, body) for timestamp, _, body in self.records(block, key)
+                    if since <= timestamp < until]
+            found.append(rows)
+            count += len(rows)
+            if count >= limit:
+                break
+        rows = [row for rows in reversed(found) for row in rows]
+        # Appends are ordered by arrival, timestamps only nearly so
+        rows.sort(key=lambda r: r[3])
+        return rows[max(0, len(rows) - limit):]
+
+    def private_peers(self, username):
+        peers = {}
+        for key in self.user_chats.get(username, ()):
+            users = key.decode().split("|")
+            peer = users[1] if users[0] == username else users[0]
+            # The conversation's newest block holds its latest message
+            for block in reversed(self.conversations.get(key, ())):
+                latest = max((timestamp for timestamp, _, _ in self.records(block, key)), default=None)
+                if latest is not None:
+                    peers[peer] = latest
+                    break
+        return peers
+
+    def months_before(self, cutoff):
+        months = set()
+        for block in self.blocks():
+            if block.overlaps(self.floor, cutoff):
+                for timestamp, _, _ in self.records(block):
+                    if timestamp < cutoff:
+                        months.add(datetime.fromtimestamp(timestamp / 1000).strftime("%Y-%m"))
+        return sorted(months)
+
+    def range_rows(self, start, end):
+        return [self.row(timestamp, body)
+                for block in self.blocks() if block.overlaps(start, end)
+                for timestamp, _, body in self.records(block) if start <= timestamp < end]
+
+    def delete_before(self, timestamp):
+        if timestamp <= self.floor:
+            return
+        self.floor = timestamp
+        tmp = self.meta_path + ".tmp"
+        with open(tmp, "w") as f:
+            json.dump({"floor": self.floor}, f)
+        os.replace(tmp, self.meta_path)
+
+        # Whole segments below the floor go; the one being written stays
+        expired = [s for s in self.segments[:-1]
+                   if all(block.max_ts < self.floor for block in s.blocks)]
+        for segment in expired:
+            self.segments.remove(segment)
+            segment.close()
+            os.remove(segment.path)
+            if os.path.exists(segment.index_path):
+                os.remove(segment.index_path)
+        if expired:
+            gone = set(expired)
+            for key, blocks in list(self.conversations.items()):
+                blocks = [b for b in blocks if b.segment not in gone]
+                if blocks:
+                    self.conversations[key] = blocks
+                else:
+                    del self.conversations[key]
+
+    def vacuum(self):
+        pass  # Space comes back as whole segments are deleted
+
+    def size(self):
+        return sum(os.path.getsize(s.path) for s in self.segments)
+
+    def close(self):
+        self.commit()
+        for segment in self.segments:
+            segment.close()
+        self.lock_file.close()
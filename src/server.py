@@ -1,14 +1,37 @@
+import argparse
 import os
+import signal
 import socket
 import ssl
 import threading
 import sys
 
-from client_handler import handle_client
+import admin
+import admission
+import capture
+import metrics
+import offload
+import ratelimit
+import server_state
+import storage
+import tracing
+import client_handler
+import connection
+import database
+import handoff
+from client_handler import broadcast_status, handle_client, handle_cluster_event
+from protocol import encode
+from cluster import ClusterBridge
+from supervisor import interrupt, run as run_workers
 from server_state import UPLOADS_DIR
 
 HOST = "0.0.0.0"
 PORT = 5000
+ACCEPT_POLL = 0.5  # Seconds between checks for a handoff while accepting
+DRAIN_WINDOW = 10  # Seconds over which clients spread their reconnects after a handoff
+BACKLOG = 512  # Pending connections the kernel queues before refusing new ones
+
+limits = admission.Admission()
 
 # SSL Context setup with error handling
 context = ssl.create_default_context(ssl.Purpose.CLIENT_AUTH)
@@ -31,13 +54,95 @@ else:
     sys.exit(1)
 
 
-def main():
-    server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-    server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+def join_cluster(address, node_id):
+    bridge = ClusterBridge(address, node_id, on_event=handle_cluster_event,
+                           on_connect=broadcast_status)
+    server_state.cluster = bridge
+    try:
+        bridge.start()
+    except OSError as e:
+        print(f"Error: Could not reach cluster broker at {address}: {e}")
+        sys.exit(1)
+
 
+def serve_connection(raw, addr):
+    """Handshake, admission check and client session for one accepted socket
+    (runs on its own thread; the caller holds a handshake slot for it)"""
+    ip = addr[0]
+    rejected = limits.admit(ip)
     try:
-        server.bind((HOST, PORT))
-        server.listen(100)
+        try:
+            connection.apply_socket_options(raw)
+            raw.settimeout(admission.HANDSHAKE_TIMEOUT)
+            conn = context.wrap_socket(raw, server_side=True)
+            conn.settimeout(None)
+        finally:
+            limits.end_handshake()
+    except (ssl.SSLError, OSError) as e:
+        print(f"⚠ SSL error from {ip}: {e}")
+        metrics.handshake_failures.inc()
+        raw.close()
+        if not rejected:
+            limits.release(ip)
+        return
+
+    if rejected:
+        print(f"⚠ Shedding connection from {ip} ({rejected} limit)")
+        try:
+            # Take the username line first: closing with unread input sends
+            # a reset that can make the client lose the error
+            conn.settimeout(admission.HANDSHAKE_TIMEOUT)
+            conn.recv(1024)
+            conn.sendall(encode(admission.busy_error(rejected)))
+        except OSError:
+            pass
+        conn.close()
+        return
+
+    try:
+        handle_client(conn)
+    finally:
+        limits.release(ip)
+
+
+def main(port=PORT, cluster=None, node_id=None, reuse_port=False,
+         admin_port=admin.ADMIN_PORT, trace=False, compaction=True,
+         handoff_path=None, drain_window=DRAIN_WINDOW, backlog=BACKLOG, capture_path=None):
+    # Restarting over a running server: inherit its listening sockets
+    inherited, ready = handoff.take_over(handoff_path) if handoff_path else (None, None)
+
+    if trace:
+        tracing.set_enabled(True)
+    server_state.db.open()
+    if capture_path:
+        capture.start(capture_path)
+    if compaction:
+        server_state.db.start_maintenance()
+    offload.start()
+    # Treat SIGTERM like Ctrl+C so the offload pool and the store are shut down
+    signal.signal(signal.SIGTERM, interrupt)
+    admin_server = None
+    if admin_port:
+        admin_server = admin.start(admin_port, inherited and inherited["admin"])
+    if cluster:
+        join_cluster(cluster, node_id or f"{socket.gethostname()}:{port}")
+
+    if inherited:
+        server = inherited["chat"]
+    else:
+        server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        if reuse_port:
+            # Several worker processes accept on the same port; the kernel balances them
+            server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+        connection.apply_socket_options(server, listener=True)
+    stopping = threading.Event()  # Set once a successor has taken over
+
+    try:
+        if not inherited:
+            server.bind((HOST, port))
+            server.listen(backlog)
+        server.settimeout(ACCEPT_POLL)  # Wake up regularly to notice a handoff
 
         try:
             # Attempt to find the local LAN IP address
@@ -50,34 +155,170 @@ def main():
 
         print("=" * 50)
         print(f" Multi-Client Chat Server Running...")
-        print(f" Listening on {HOST}:{PORT} (LAN IP: {lan_ip})")
+        print(f" Listening on {HOST}:{port} (LAN IP: {lan_ip})")
         print(f" Uploads directory: {UPLOADS_DIR}")
+        if cluster:
+            print(f" Cluster broker: {cluster}")
         print("=" * 50)
 
-        while True:
+        if handoff_path:
+            handoff.serve(handoff_path, {"chat": server, "admin": admin_server}, stopping.set)
+        if ready:
+            ready()
+
+        while not stopping.is_set():
             try:
                 raw, addr = server.accept()
-                print(f"📥 New connection from {addr[0]}:{addr[1]}")
-                conn = context.wrap_socket(raw, server_side=True)
-                threading.Thread(target=handle_client,
-                                 args=(conn,), daemon=True).start()
-            except ssl.SSLError as e:
-                print(f"⚠ SSL error: {e}")
-                try:
+                if not limits.begin_handshake():
+                    # Too many handshakes in flight: refuse before any TLS work
                     raw.close()
-                except:
-                    pass
+                    continue
+                print(f"📥 New connection from {addr[0]}:{addr[1]}")
+                threading.Thread(target=serve_connection,
+                                 args=(raw, addr), daemon=True).start()
+            except socket.timeout:
+                continue
             except Exception as e:
                 print(f"⚠ Error accepting connection: {e}")
 
+        print(" New server took over, draining clients...")
+        client_handler.drain(drain_window)
+
     except OSError as e:
         print(f" Error starting server: {e}")
-        print(f"   Port {PORT} may already be in use.")
+        print(f"   Port {port} may already be in use.")
     except KeyboardInterrupt:
         print("\n Server shutting down...")
     finally:
         server.close()
+        capture.stop()
+        offload.shutdown()
+        server_state.db.flush()
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Multi-client chat server")
+    parser.add_argument("--port", type=int, default=PORT)
+    parser.add_argument("--cluster", metavar="ADDRESS",
+                        help="join a cluster through the broker at host:port or unix:/path")
+    parser.add_argument("--node-id", help="name of this node in the cluster")
+    parser.add_argument("--admin-port", type=int, default=admin.ADMIN_PORT,
+                        help="local-only metrics/admin port (0 disables it)")
+    parser.add_argument("--rate-limits", metavar="FILE",
+                        help="JSON file overriding per-user/per-type rate limits and costs")
+    parser.add_argument("--idle-timeout", type=float, default=client_handler.IDLE_TIMEOUT,
+                        help="drop clients silent for this many seconds (they ping every 15s)")
+    parser.add_argument("--trace", action="store_true",
+                        help="start with per-message tracing on (can be toggled via the admin port)")
+    parser.add_argument("--storage", choices=storage.BACKENDS, default="sqlite",
+                        help="message store: one SQLite file, or the append-only segmented log "
+                             "(single process only)")
+    parser.add_argument("--storage-path",
+                        help="SQLite file or log directory (default: chat.db or chat.log)")
+    parser.add_argument("--hot-months", type=int, default=database.HOT_MONTHS,
+                        help="months kept in the store before compaction into the gzip archive")
+    parser.add_argument("--retention-months", type=int, default=database.RETENTION_MONTHS,
+                        help="delete messages older than this many months (default: keep all)")
+    parser.add_argument("--no-compaction", dest="compaction", action="store_false",
+                        help="never archive or expire messages from this process")
+    parser.add_argument("--max-connections", type=int, default=admission.MAX_CONNECTIONS,
+                        help="open connections beyond which new clients get 'server busy'")
+    parser.add_argument("--max-per-ip", type=int, default=admission.MAX_PER_IP,
+                        help="open connections allowed from one client IP")
+    parser.add_argument("--max-handshakes", type=int, default=admission.MAX_HANDSHAKES,
+                        help="concurrent TLS handshakes; further connections are closed at once")
+    parser.add_argument("--backlog", type=int, default=BACKLOG, help="listen() backlog")
+    parser.add_argument("--handoff", metavar="PATH",
+                        help="Unix socket for zero-downtime restarts: a new server started with the "
+                             "same path takes over the port and this one drains and exits")
+    parser.add_argument("--drain-window", type=float, default=DRAIN_WINDOW,
+                        help="seconds over which clients spread their reconnects after a handoff")
+    parser.add_argument("--no-coalesce", dest="coalesce", action="store_false",
+                        help="write every outgoing frame separately instead of batching bursts")
+    parser.add_argument("--coalesce-ms", type=float, default=connection.COALESCE_TICK * 1000,
+                        help="milliseconds a write waits for more frames to batch (default: none)")
+    parser.add_argument("--no-nodelay", dest="nodelay", action="store_false",
+                        help="leave Nagle's algorithm on for client sockets")
+    parser.add_argument("--sndbuf", type=int, help="SO_SNDBUF in bytes (default: kernel autotuning)")
+    parser.add_argument("--rcvbuf", type=int, help="SO_RCVBUF in bytes (default: kernel autotuning)")
+    parser.add_argument("--no-keepalive", dest="keepalive", action="store_false",
+                        help="disable TCP keepalive on client sockets")
+    parser.add_argument("--keepalive-idle", type=int, default=connection.KEEPALIVE_IDLE,
+                        help="seconds a connection is idle before keepalive probes start")
+    parser.add_argument("--capture", metavar="FILE",
+                        help="record anonymized inbound traffic for replay.py ('{pid}' in FILE is "
+                             "replaced by the process id, needed with --workers)")
+    parser.add_argument("--offload-workers", type=int, default=offload.WORKERS,
+                        help="processes for parsing, decoding and encoding large payloads (0: inline)")
+    parser.add_argument("--offload-threshold-kb", type=int, default=offload.THRESHOLDS["encode"] // 1024,
+                        help="payload size from which that work goes to those processes")
+    parser.add_argument("--workers", type=int, default=0,
+                        help="prefork N worker processes sharing the port (SO_REUSEPORT)")
+    parser.add_argument("--reuse-port", action="store_true",
+                        help=argparse.SUPPRESS)  # Set by the supervisor for its workers
+    return parser.parse_args(argv)
 
 
 if __name__ == "__main__":
-    main()
+    args = parse_args()
+    client_handler.IDLE_TIMEOUT = args.idle_timeout
+    limits.max_connections = args.max_connections
+    limits.max_per_ip = args.max_per_ip
+    limits.max_handshakes = args.max_handshakes
+    server_state.db.backend = args.storage
+    server_state.db.path = args.storage_path or storage.DEFAULT_PATHS[args.storage]
+    server_state.db.hot_months = args.hot_months
+    # Cluster nodes, prefork workers (which join their own bus) and the two
+    # processes of a handoff share the store
+    server_state.db.cache_recent = not (args.cluster or args.handoff)
+    connection.COALESCE = args.coalesce
+    connection.COALESCE_TICK = args.coalesce_ms / 1000
+    connection.TCP_NODELAY = args.nodelay
+    connection.SNDBUF = args.sndbuf
+    connection.RCVBUF = args.rcvbuf
+    connection.KEEPALIVE = args.keepalive
+    connection.KEEPALIVE_IDLE = args.keepalive_idle
+    offload.WORKERS = args.offload_workers
+    for op in ("decode", "upload", "encode"):
+        offload.THRESHOLDS[op] = args.offload_threshold_kb * 1024
+    server_state.db.retention_months = args.retention_months
+    if args.rate_limits:
+        ratelimit.load_config(args.rate_limits)
+    if args.workers > 0 and args.handoff:
+        sys.exit("Error: --handoff is single-process only (prefork workers can be restarted one by one)")
+    if args.storage == "log" and (args.workers > 0 or args.handoff):
+        sys.exit("Error: --storage log is locked by one process; it cannot be used with "
+                 "--workers or --handoff")
+    if args.workers > 0:
+        # Workers inherit the per-process options
+        worker_args = ["--idle-timeout", str(args.idle_timeout), "--hot-months", str(args.hot_months),
+                       "--max-connections", str(args.max_connections), "--max-per-ip", str(args.max_per_ip),
+                       "--max-handshakes", str(args.max_handshakes), "--backlog", str(args.backlog),
+                       "--coalesce-ms", str(args.coalesce_ms), "--keepalive-idle", str(args.keepalive_idle),
+                       "--storage", args.storage, "--offload-workers", str(args.offload_workers),
+                       "--offload-threshold-kb", str(args.offload_threshold_kb)]
+        if args.storage_path:
+            worker_args += ["--storage-path", args.storage_path]
+        if not args.coalesce:
+            worker_args.append("--no-coalesce")
+        if not args.nodelay:
+            worker_args.append("--no-nodelay")
+        if not args.keepalive:
+            worker_args.append("--no-keepalive")
+        for flag, value in (("--sndbuf", args.sndbuf), ("--rcvbuf", args.rcvbuf)):
+            if value:
+                worker_args += [flag, str(value)]
+        if args.retention_months is not None:
+            worker_args += ["--retention-months", str(args.retention_months)]
+        if not args.compaction:
+            worker_args.append("--no-compaction")
+        if args.rate_limits:
+            worker_args += ["--rate-limits", args.rate_limits]
+        if args.trace:
+            worker_args.append("--trace")
+        if args.capture:
+            worker_args += ["--capture", args.capture]
+        run_workers(args.workers, args.port, args.admin_port, worker_args)
+    else:
+        main(args.port, args.cluster, args.node_id, args.reuse_port, args.admin_port, args.trace,
+             args.compaction, args.handoff, args.drain_window, args.backlog, args.capture)
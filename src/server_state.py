@@ -1,10 +1,10 @@
 import os
-import threading
 from database import ChatDatabase
+from registry import ClientRegistry
 
 UPLOADS_DIR = "uploads"
 os.makedirs(UPLOADS_DIR, exist_ok=True)
 
 db = ChatDatabase()
-clients = {}  # username: conn
-clients_lock = threading.Lock()  # Thread-safe access to clients dict
+clients = ClientRegistry()  # username: conn, lock-free reads
+cluster = None  # ClusterBridge when running as part of a cluster
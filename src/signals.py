@@ -6,3 +6,7 @@ class Signals(QObject):
     message = pyqtSignal(dict)
     typing = pyqtSignal(str)
     private_typing = pyqtSignal(str)
+    connection = pyqtSignal(bool)
+    progress = pyqtSignal(str)
+    history = pyqtSignal(list)
+    error = pyqtSignal(dict)
@@ -0,0 +1,357 @@
+"""Soak test: memory growth of the server and the GUI client over hours.
+
+Starts a local server and the GUI client (client.py on Qt's offscreen
+platform), both with tracemalloc on, and alternates two kinds of phases:
+
+  messages  - --users connected users send group and private messages,
+              typing notifications and files, some of them to the GUI user
+  churn     - --churn short-lived connections: users that join, send a
+              message and leave; connections reset without a goodbye; and
+              half-dead ones that send the username and then go silent,
+              which the server must drop after --idle-timeout
+
+After every phase the test waits for idle timeouts and typing indicators
+to run out, then samples both processes: RSS, traced Python memory, threads,
+file descriptors and the top allocation sites (from the admin port's
+/memory and the client's CHAT_SOAK_REPORT lines), plus the server's
+registered clients and the client's download cache, typing timers,
+private chat windows and chat document size.
+
+Memory growth after the --warmup period (which lets bounded caches fill)
+is charged to the phase it happened in: growth during message phases per
+message sent, growth during churn phases per connection made. The
+client's download cache is left out of it and checked against its own
+limit instead. The run fails if either exceeds its budget, if threads or
+fds keep growing, if the server still lists clients that are gone, or if
+typing timers are left behind.
+
+    python soak.py                                   # 2 hours
+    python soak.py --duration 900 --warmup 300 --phase 30
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import socket
+import struct
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.request
+
+from chat_client import ChatClient, default_ssl_context
+from loadgen import spawn_server, stop_server
+
+SRC_DIR = os.path.dirname(os.path.abspath(__file__))
+GUI_USER = "soak-gui"
+TYPING_TIMEOUT = 3  # Seconds the client shows a typing indicator (client.py)
+REPORT_INTERVAL = 2  # Seconds between the GUI client's memory reports
+MIX = {"group": 50, "private": 25, "typing": 23, "file": 2}
+HANDLE_SLACK = 10  # Threads or fds a process may gain over the run without counting as a leak
+
+
+class Gui:
+    """client.py on the offscreen platform, whose memory reports are kept"""
+
+    def __init__(self, port):
+        env = dict(os.environ, QT_QPA_PLATFORM="offscreen", CHAT_SOAK_REPORT=str(REPORT_INTERVAL),
+                   PYTHONTRACEMALLOC="1")
+        self.proc = subprocess.Popen(
+            [sys.executable, os.path.join(SRC_DIR, "client.py"), GUI_USER, "127.0.0.1", str(port)],
+            env=env, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, text=True)
+        self.latest = None
+        self.updated = threading.Condition()
+        threading.Thread(target=self.read_reports, daemon=True).start()
+
+    def read_reports(self):
+        for line in self.proc.stdout:
+            if line.startswith("soak "):
+                with self.updated:
+                    self.latest = json.loads(line[5:])
+                    self.updated.notify_all()
+
+    def sample(self, after, timeout=30):
+        """The first report taken after `after` (time.time())"""
+        deadline = time.time() + timeout
+        with self.updated:
+            while not self.latest or self.latest["time"] < after:
+                if time.time() > deadline or self.proc.poll() is not None:
+                    raise RuntimeError("The GUI client stopped reporting")
+                self.updated.wait(1)
+            return self.latest
+
+    def settled(self, after, timeout=120):
+        """The first report after `after` that is on time and shows no one
+        typing, or the last one once `timeout` runs out. A GUI still catching
+        up on queued traffic (late reports, or typing notifications arriving
+        after the phase ended) gets the time; typing state that outlives it
+        is left behind for good."""
+        deadline = time.time() + timeout
+        while True:
+            report = self.sample(after)
+            on_time = report["time"] - after <= REPORT_INTERVAL + 1
+            if on_time and not report["typing_timers"] + report["typing_users"] or time.time() > deadline:
+                return report
+            after = report["time"] + TYPING_TIMEOUT
+
+    def stop(self):
+        self.proc.terminate()
+        self.proc.wait()
+
+
+def server_sample(admin_port):
+    with urllib.request.urlopen(f"http://127.0.0.1:{admin_port}/memory", timeout=30) as response:
+        return json.load(response)
+
+
+class Soak:
+    def __init__(self, args):
+        self.args = args
+        self.context = default_ssl_context()
+        self.users = []
+        self.listeners = []
+        self.silent = []  # Half-dead connections: (writer, opened at)
+        self.churned = 0
+        self.file_data = None
+
+    async def drain_events(self, client):
+        async for _ in client.events():
+            pass
+
+    async def start_users(self):
+        self.file_data = os.urandom(self.args.file_size)
+        for i in range(self.args.users):
+            client = ChatClient(f"soak-{i}", "127.0.0.1", self.args.port, self.context, reconnect=False)
+            await client.connect()
+            self.users.append(client)
+            self.listeners.append(asyncio.create_task(self.drain_events(client)))
+
+    async def send_one(self, client, seq):
+        kind = random.choices(list(MIX), list(MIX.values()))[0]
+        peer = random.choice([GUI_USER] + [u.username for u in self.users if u is not client])
+        if kind == "group":
+            await client.send_group(f"soak {seq} " + "lorem ipsum " * random.randint(0, 12))
+        elif kind == "private":
+            await client.send_private(peer, f"soak {seq}")
+        elif kind == "typing":
+            await client.send_typing(random.choice([None, peer]))
+        else:
+            await client.send_file(f"soak_{client.username}_{seq}.bin", self.file_data)
+
+    async def message_phase(self):
+        """Steady traffic from the connected users; returns messages sent"""
+        sent = 0
+        end = time.perf_counter() + self.args.phase
+
+        async def run(client):
+            nonlocal sent
+            while True:
+                await asyncio.sleep(random.expovariate(self.args.rate))
+                if time.perf_counter() >= end:
+                    return
+                await self.send_one(client, sent)
+                sent += 1
+
+        await asyncio.gather(*(run(client) for client in self.users))
+        return sent
+
+    async def churn_one(self, kind):
+        self.churned += 1
+        name = f"soak-churn-{self.churned}"
+        if kind == "clean":
+            async with ChatClient(name, "127.0.0.1", self.args.port, self.context, reconnect=False) as client:
+                await client.send_group(f"{name} was here")
+                await asyncio.sleep(0.2)
+            return
+        reader, writer = await asyncio.open_connection("127.0.0.1", self.args.port, ssl=self.context)
+        writer.write(name.encode() + b"\n")
+        await writer.drain()
+        if kind == "silent":
+            self.silent.append((writer, time.time()))  # Never read from or written to again
+            return
+        # Reset: close with an RST instead of a TLS close_notify and FIN
+        await asyncio.sleep(0.2)
+        writer.get_extra_info("socket").setsockopt(socket.SOL_SOCKET, socket.SO_LINGER, struct.pack("ii", 1, 0))
+        writer.transport.abort()
+
+    async def churn_phase(self):
+        """Short-lived connections spread over the phase; returns their number"""
+        kinds = ["clean", "reset", "silent"]
+        interval = self.args.phase / self.args.churn
+        for i in range(self.args.churn):
+            try:
+                await self.churn_one(kinds[i % len(kinds)])
+            except (ConnectionError, OSError) as e:
+                print(f"⚠ Churn connection failed: {e}")
+            await asyncio.sleep(interval)
+        return self.args.churn
+
+    def close_silent(self):
+        """Close half-dead connections the server has had time to drop"""
+        cutoff = time.time() - self.args.idle_timeout
+        for writer, opened in [entry for entry in self.silent if entry[1] < cutoff]:
+            writer.transport.abort()
+            self.silent.remove((writer, opened))
+
+    async def stop_users(self):
+        for client in self.users:
+            await client.close()
+        await asyncio.gather(*self.listeners, return_exceptions=True)
+        for writer, _ in self.silent:
+            writer.transport.abort()
+
+
+def growth(samples, key, field):
+    """Growth of samples[i][key][field] per phase kind: {kind: bytes}. The
+    GUI's download cache is left out: it is bounded, and checked on its own."""
+    total = {"messages": 0, "churn": 0}
+    for before, after in zip(samples, samples[1:]):
+        if before[key][field] is not None and after[key][field] is not None:
+            cached = after[key].get("download_cache_bytes", 0) - before[key].get("download_cache_bytes", 0)
+            total[after["phase"]] += after[key][field] - before[key][field] - cached
+    return total
+
+
+def allocator_growth(first, last, limit=5):
+    """Allocation sites whose traced memory grew most between two samples"""
+    before = {entry["where"]: entry["bytes"] for entry in first["top"]}
+    grown = [(entry["bytes"] - before.get(entry["where"], 0), entry["where"]) for entry in last["top"]]
+    return [{"where": where, "bytes": size} for size, where in sorted(grown, reverse=True)[:limit] if size > 0]
+
+
+def check(samples, units, args):
+    """Leak verdicts for the samples taken after the warm-up: [(ok, text)]"""
+    verdicts = []
+    budgets = {"messages": args.message_budget, "churn": args.connection_budget}
+    unit_names = {"messages": "message", "churn": "connection"}
+    for key in ("server", "gui"):
+        for field, slack in (("traced_bytes", 0), ("rss_bytes", args.rss_slack_mb * 1024 * 1024)):
+            grown = growth(samples, key, field)
+            for phase, size in grown.items():
+                if not units[phase]:
+                    continue
+                per_unit = max(0, size - slack) / units[phase]
+                ok = per_unit <= budgets[phase]
+                verdicts.append((ok, f"{key} {field}: {size / 1024:+.0f} KB over {units[phase]} "
+                                     f"{unit_names[phase]}s, {per_unit:.1f} B/{unit_names[phase]} "
+                                     f"(budget {budgets[phase]})"))
+        for field in ("threads", "fds"):
+            values = [sample[key][field] for sample in samples if sample[key][field] is not None]
+            if values:
+                gained = max(values) - values[0]
+                verdicts.append((gained <= HANDLE_SLACK, f"{key} {field}: {values[0]} -> max {max(values)}"))
+
+    stale = [sample["server"]["clients"] - (args.users + 1) for sample in samples]
+    verdicts.append((max(stale) <= 0, f"server clients beyond the live ones after settling: max {max(stale)}"))
+    cached = max(sample["gui"]["download_cache_bytes"] for sample in samples)
+    limit = samples[0]["gui"]["download_cache_limit"]
+    verdicts.append((cached <= limit, f"gui download cache: max {cached / 1e6:.1f} MB (limit {limit / 1e6:.1f} MB)"))
+    timers = max(sample["gui"]["typing_timers"] + sample["gui"]["typing_users"] for sample in samples)
+    verdicts.append((timers == 0, f"gui typing timers/users left after settling: max {timers}"))
+    return verdicts
+
+
+def print_sample(sample, elapsed):
+    server, gui = sample["server"], sample["gui"]
+    mb = lambda v: "?" if v is None else f"{v / 1e6:.1f}"
+    print(f"{elapsed / 60:7.1f} min {sample['phase']:<8} "
+          f"server rss {mb(server['rss_bytes'])} MB traced {mb(server['traced_bytes'])} MB "
+          f"clients {server['clients']} threads {server['threads']} fds {server['fds']} | "
+          f"gui rss {mb(gui['rss_bytes'])} MB traced {mb(gui['traced_bytes'])} MB "
+          f"cache {gui['download_cache']}/{mb(gui['download_cache_bytes'])} MB "
+          f"chats {gui['private_chats']} blocks {gui['document_blocks']}", flush=True)
+
+
+async def run(args, gui):
+    soak = Soak(args)
+    await soak.start_users()
+    settle = max(args.idle_timeout, TYPING_TIMEOUT) + 2 * REPORT_INTERVAL
+    samples = []
+    units = {"messages": 0, "churn": 0}
+    start = time.time()
+    phase = "messages"
+    try:
+        while time.time() - start < args.duration:
+            count = await (soak.message_phase() if phase == "messages" else soak.churn_phase())
+            await asyncio.sleep(settle)
+            soak.close_silent()
+            taken = time.time()
+            sample = {"phase": phase, "time": taken, "units": count,
+                      "server": await asyncio.to_thread(server_sample, args.admin_port),
+                      "gui": await asyncio.to_thread(gui.settled, taken)}
+            print_sample(sample, taken - start)
+            if taken - start >= args.warmup:
+                if samples:
+                    units[phase] += count
+                samples.append(sample)
+            phase = "churn" if phase == "messages" else "messages"
+    finally:
+        await soak.stop_users()
+    return samples, units
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Long-running memory soak test (server + offscreen GUI)")
+    parser.add_argument("--port", type=int, default=5880)
+    parser.add_argument("--admin-port", type=int, default=5881)
+    parser.add_argument("--duration", type=float, default=2 * 3600, help="seconds to run")
+    parser.add_argument("--warmup", type=float, default=900,
+                        help="seconds before growth counts (bounded caches fill up meanwhile)")
+    parser.add_argument("--phase", type=float, default=60, help="seconds per messages or churn phase")
+    parser.add_argument("--users", type=int, default=20, help="steadily connected users")
+    parser.add_argument("--rate", type=float, default=2, help="messages/sec per user in message phases")
+    parser.add_argument("--churn", type=int, default=60, help="short-lived connections per churn phase")
+    parser.add_argument("--file-size", type=int, default=200 * 1024, help="bytes per file message")
+    parser.add_argument("--idle-timeout", type=float, default=20,
+                        help="server idle timeout; must exceed the clients' 15s heartbeat")
+    parser.add_argument("--message-budget", type=float, default=64,
+                        help="bytes of growth allowed per message after the warm-up")
+    parser.add_argument("--connection-budget", type=float, default=4096,
+                        help="bytes of growth allowed per short-lived connection after the warm-up")
+    parser.add_argument("--rss-slack-mb", type=float, default=32,
+                        help="RSS growth per process not counted against the budgets (allocator noise)")
+    parser.add_argument("--output", help="write the samples and verdicts as JSON to this file")
+    args = parser.parse_args(argv)
+
+    limits = os.path.join(tempfile.gettempdir(), f"soak-{os.getpid()}.json")
+    with open(limits, "w") as f:
+        json.dump({"user_limit": [100000, 100000], "file_cost_per_mb": 0,
+                   "type_limits": {t: [1000, 1000] for t in MIX}}, f)
+    local = spawn_server(args.port, ["--admin-port", str(args.admin_port), "--rate-limits", limits,
+                                     "--idle-timeout", str(args.idle_timeout)],
+                         env=dict(os.environ, PYTHONTRACEMALLOC="1"))
+    gui = Gui(args.port)
+    try:
+        gui.sample(time.time())  # Up and connected
+        samples, units = asyncio.run(run(args, gui))
+    finally:
+        gui.stop()
+        stop_server(*local)
+        os.unlink(limits)
+
+    if len(samples) < 3:
+        sys.exit("Too few samples after the warm-up: raise --duration or lower --warmup/--phase")
+    verdicts = check(samples, units, args)
+    print()
+    for ok, text in verdicts:
+        print(f"{'✓' if ok else '⚠'} {text}")
+    for key in ("server", "gui"):
+        grown = allocator_growth(samples[0][key], samples[-1][key])
+        if grown:
+            print(f"Top growing allocation sites ({key}):")
+            for entry in grown:
+                print(f"  {entry['bytes'] / 1024:+10.1f} KB  {entry['where']}")
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({"config": vars(args), "units": units, "samples": samples,
+                       "verdicts": [{"ok": ok, "check": text} for ok, text in verdicts]}, f, indent=2)
+        print(f"Results written to {args.output}")
+    if not all(ok for ok, _ in verdicts):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
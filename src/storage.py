@@ -0,0 +1,186 @@
+"""Storage backends behind ChatDatabase.
+
+A store holds the hot (not yet archived) messages. ChatDatabase keeps the
+recent-message cache, the archive and the compaction policy, and calls
+its store only through these methods, with ChatDatabase.lock held:
+
+  append(sender, receiver, content, timestamp, type, conversation)
+  append_many(rows)        - bulk load of such 6-tuples, one commit
+  commit()                 - make appended messages durable
+  rows()                   - every message as (sender, receiver, content,
+                             timestamp, type), in insertion order
+  search(keyword)          - (sender, content, timestamp) of messages whose
+                             content contains keyword, case-insensitively
+  conversation_range(conversation, since, until, limit)
+                           - the latest `limit` rows of one conversation
+                             with since <= timestamp < until, oldest first
+  private_peers(username)  - {peer: latest timestamp} of private chats
+  months_before(cutoff)    - 'YYYY-MM' (local time) of messages older than cutoff
+  range_rows(start, end)   - rows with start <= timestamp < end, in insertion order
+  delete_before(timestamp) - drop every message older than timestamp
+  vacuum()                 - give space freed by deletes back
+  close()
+
+"sqlite" (the default) is a single SQLite file; "log" is the segmented
+append-only log in segment_log.py, a directory.
+"""
+import sqlite3
+import time
+
+from segment_log import SegmentLogStore
+
+BUSY_TIMEOUT = 60  # Seconds a write waits for another process's lock (e.g. its VACUUM) before failing
+
+# Rebuilds a pre-epoch table (TEXT local-time timestamps) with the same ids
+MIGRATE_EPOCH_MS = """
+BEGIN;
+CREATE TABLE messages_new (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    sender TEXT,
+    receiver TEXT,
+    content TEXT,
+    timestamp INTEGER NOT NULL,
+    type TEXT
+);
+INSERT INTO messages_new (id, sender, receiver, content, timestamp, type)
+SELECT id, sender, receiver, content,
+       COALESCE(CAST(strftime('%s', timestamp, 'utc') AS INTEGER), 0) * 1000, type
+FROM messages ORDER BY id;
+DROP TABLE messages;
+ALTER TABLE messages_new RENAME TO messages;
+COMMIT;
+"""
+
+
+class SQLiteStore:
+    def __init__(self, path):
+        self.path = path
+        # Cluster nodes share the file, and their compaction holds the write lock
+        self.conn = sqlite3.connect(path, check_same_thread=False, timeout=BUSY_TIMEOUT)
+        self.create_table()
+
+    def create_table(self):
+        self.conn.execute("""
+        CREATE TABLE IF NOT EXISTS messages (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            sender TEXT,
+            receiver TEXT,
+            content TEXT,
+            timestamp INTEGER NOT NULL,
+            type TEXT
+        )
+        """)
+        columns = {row[1]: row[2] for row in self.conn.execute("PRAGMA table_info(messages)")}
+        if columns["timestamp"] != "INTEGER":
+            self.migrate_epoch_ms()
+        self.conn.execute("CREATE INDEX IF NOT EXISTS idx_messages_timestamp ON messages (timestamp)")
+        # Conversations are derived from sender, receiver and type rather than
+        # stored; databases from before that drop the column's index
+        self.conn.execute("DROP INDEX IF EXISTS idx_messages_conversation")
+        # Private chats by pair, and who a user has them with, from either side
+        self.conn.execute("""
+        CREATE INDEX IF NOT EXISTS idx_messages_private_sender
+        ON messages (sender, receiver, timestamp) WHERE type = 'private'
+        """)
+        self.conn.execute("""
+        CREATE INDEX IF NOT EXISTS idx_messages_private_receiver
+        ON messages (receiver, sender, timestamp) WHERE type = 'private'
+        """)
+        self.conn.commit()
+
+    def migrate_epoch_ms(self):
+        start = time.perf_counter()
+        self.conn.commit()
+        self.conn.executescript(MIGRATE_EPOCH_MS)
+        count = self.conn.execute("SELECT COUNT(*) FROM messages").fetchone()[0]
+        print(f"✓ Migrated {count} messages to epoch-ms timestamps "
+              f"in {time.perf_counter() - start:.1f}s")
+
+    def append(self, sender, receiver, content, timestamp, msg_type, conversation):
+        self.conn.execute("""
+        INSERT INTO messages (sender, receiver, content, timestamp, type)
+        VALUES (?, ?, ?, ?, ?)
+        """, (sender, receiver, content, timestamp, msg_type))
+
+    def append_many(self, rows):
+        self.conn.executemany("""
+        INSERT INTO messages (sender, receiver, content, timestamp, type)
+        VALUES (?, ?, ?, ?, ?)""", (row[:5] for row in rows))
+        self.conn.commit()
+
+    def commit(self):
+        self.conn.commit()
+
+    def rows(self):
+        return self.conn.execute(
+            "SELECT sender, receiver, content, timestamp, type FROM messages ORDER BY id").fetchall()
+
+    def search(self, keyword):
+        return self.conn.execute(
+            "SELECT sender, content, timestamp FROM messages WHERE content LIKE ?",
+            (f"%{keyword}%",)).fetchall()
+
+    def conversation_range(self, conversation, since, until, limit):
+        if conversation == "group":
+            rows = self.conn.execute(
+                "SELECT sender, receiver, content, timestamp, type FROM messages "
+                "WHERE type != 'private' AND timestamp >= ? AND timestamp < ? "
+                "ORDER BY timestamp DESC, id DESC LIMIT ?",
+                (since, until, limit)).fetchall()
+        else:
+            # Each direction of the pair is one range of a private index, merged
+            a, b = conversation.split("|")
+            rows = [row[1:] for row in self.conn.execute("""
+            SELECT * FROM (
+                SELECT id, sender, receiver, content, timestamp, type FROM messages
+                WHERE type = 'private' AND sender = ? AND receiver = ?
+                      AND timestamp >= ? AND timestamp < ?
+                UNION ALL
+                SELECT id, sender, receiver, content, timestamp, type FROM messages
+                WHERE type = 'private' AND sender = ? AND receiver = ? AND sender != receiver
+                      AND timestamp >= ? AND timestamp < ?)
+            ORDER BY timestamp DESC, id DESC LIMIT ?
+            """, (a, b, since, until, b, a, since, until, limit))]
+        rows.reverse()
+        return rows
+
+    def private_peers(self, username):
+        return dict(self.conn.execute("""
+        SELECT peer, MAX(ts) FROM (
+            SELECT receiver AS peer, timestamp AS ts FROM messages
+            WHERE type = 'private' AND sender = ?
+            UNION ALL
+            SELECT sender, timestamp FROM messages
+            WHERE type = 'private' AND receiver = ?)
+        GROUP BY peer
+        """, (username, username)).fetchall())
+
+    def months_before(self, cutoff):
+        return [m for (m,) in self.conn.execute(
+            "SELECT DISTINCT strftime('%Y-%m', timestamp / 1000, 'unixepoch', 'localtime') "
+            "FROM messages WHERE timestamp < ?", (cutoff,))]
+
+    def range_rows(self, start, end):
+        return self.conn.execute(
+            "SELECT sender, receiver, content, timestamp, type FROM messages "
+            "WHERE timestamp >= ? AND timestamp < ? ORDER BY id", (start, end)).fetchall()
+
+    def delete_before(self, timestamp):
+        self.conn.execute("DELETE FROM messages WHERE timestamp < ?", (timestamp,))
+        self.conn.commit()
+
+    def vacuum(self):
+        self.conn.execute("VACUUM")
+
+    def close(self):
+        self.conn.close()
+
+
+BACKENDS = {"sqlite": SQLiteStore, "log": SegmentLogStore}
+DEFAULT_PATHS = {"sqlite": "chat.db", "log": "chat.log"}
+
+
+def open_store(backend, path):
+    if backend not in BACKENDS:
+        raise ValueError(f"Unknown storage backend: {backend}")
+    return BACKENDS[backend](path)
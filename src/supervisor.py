@@ -0,0 +1,109 @@
+import os
+import signal
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+import broker
+
+SERVER_SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "server.py")
+POLL_INTERVAL = 0.5  # Seconds between worker liveness checks
+RESTART_DELAY = 0.5  # Initial delay before restarting a crashed worker
+MAX_RESTART_DELAY = 30.0
+STABLE_AFTER = 10.0  # A worker alive this long resets its restart backoff
+
+
+class Worker:
+    def __init__(self, index, argv):
+        self.index = index
+        self.argv = argv
+        self.proc = None
+        self.started = 0
+        self.delay = RESTART_DELAY
+
+    def start(self):
+        self.proc = subprocess.Popen(self.argv)
+        self.started = time.time()
+        print(f"✓ Worker {self.index} started (pid {self.proc.pid})")
+
+    def check(self):
+        """Restart the worker if it has exited"""
+        code = self.proc.poll()
+        if code is None:
+            if time.time() - self.started > STABLE_AFTER:
+                self.delay = RESTART_DELAY
+            return
+
+        print(f"⚠ Worker {self.index} (pid {self.proc.pid}) exited with code {code}, "
+              f"restarting in {self.delay:.1f}s")
+        time.sleep(self.delay)
+        # Back off if the worker keeps crashing right after start
+        self.delay = min(self.delay * 2, MAX_RESTART_DELAY)
+        self.start()
+
+    def stop(self):
+        if self.proc and self.proc.poll() is None:
+            self.proc.terminate()
+
+    def wait(self):
+        if self.proc:
+            try:
+                self.proc.wait(timeout=5)
+            except subprocess.TimeoutExpired:
+                self.proc.kill()
+
+
+def interrupt(signum, frame):
+    raise KeyboardInterrupt
+
+
+def run(num_workers, port, admin_port=0, extra_args=()):
+    """Prefork mode: N worker processes share the port via SO_REUSEPORT and
+    relay broadcasts, private messages and presence through an in-process broker.
+    Worker i serves its metrics on admin_port + 1 + i.
+    """
+    if not hasattr(socket, "SO_REUSEPORT"):
+        print("Error: SO_REUSEPORT is not supported on this platform")
+        sys.exit(1)
+
+    bus_dir = tempfile.mkdtemp(prefix="chat-bus-")
+    bus_address = f"unix:{os.path.join(bus_dir, 'bus.sock')}"
+    listener = broker.open_listener(bus_address)
+    threading.Thread(target=broker.accept_loop, args=(listener,), daemon=True).start()
+
+    workers = [
+        Worker(i, [sys.executable, SERVER_SCRIPT, "--port", str(port), "--reuse-port",
+                   "--cluster", bus_address, "--node-id", f"worker-{i}",
+                   "--admin-port", str(admin_port + 1 + i if admin_port else 0), *extra_args,
+                   # Workers share chat.db; one of them compacts it
+                   *(["--no-compaction"] if i else [])])
+        for i in range(num_workers)
+    ]
+    for worker in workers:
+        worker.start()
+
+    # Treat SIGTERM like Ctrl+C so workers are always cleaned up
+    signal.signal(signal.SIGTERM, interrupt)
+
+    print(f" Supervisor running {num_workers} workers on port {port}")
+    try:
+        while True:
+            time.sleep(POLL_INTERVAL)
+            for worker in workers:
+                worker.check()
+    except KeyboardInterrupt:
+        print("\n Supervisor shutting down workers...")
+    finally:
+        for worker in workers:
+            worker.stop()
+        for worker in workers:
+            worker.wait()
+        listener.close()
+        try:
+            os.unlink(bus_address[len("unix:"):])
+            os.rmdir(bus_dir)
+        except OSError:
+            pass
@@ -0,0 +1,164 @@
+"""Opt-in per-message tracing and a statistical sampling profiler.
+
+Tracing records how long each stage of handling one inbound message took
+(recv, decode, persist, fanout) under a trace id. It is off by default and
+costs one flag check per message while off; switch it at runtime through
+the admin port with {"type": "trace", "enabled": true}.
+
+The profiler samples every thread's stack at a fixed interval for a window
+and writes collapsed stacks ("frame;frame;frame count" lines), the input
+format of flamegraph.pl and speedscope.
+"""
+import itertools
+import os
+import sys
+import threading
+import time
+from collections import Counter, deque
+
+import metrics
+
+RECENT_TRACES = 1000  # Finished traces kept for the admin "traces" command
+PROFILES_DIR = "profiles"
+
+enabled = False
+recent = deque(maxlen=RECENT_TRACES)
+_ids = itertools.count(1)
+
+stage_seconds = metrics.Histogram(
+    "chat_stage_seconds", "Time per message handling stage (while tracing is on)",
+    ("stage", "type"))
+
+
+class Trace:
+    def __init__(self):
+        self.trace_id = f"{os.getpid():x}-{next(_ids):x}"
+        self.type = None
+        self.spans = []  # (stage, seconds)
+        self.started = time.time()
+
+    def add(self, stage, seconds):
+        self.spans.append((stage, seconds))
+
+    def span(self, stage):
+        return _Span(self, stage)
+
+    def finish(self):
+        for stage, seconds in self.spans:
+            stage_seconds.observe(seconds, stage=stage, type=self.type)
+        recent.append({
+            "trace_id": self.trace_id,
+            "type": self.type,
+            "at": round(self.started, 3),
+            "spans_ms": {stage: round(seconds * 1000, 3) for stage, seconds in self.spans},
+        })
+
+
+class _Span:
+    def __init__(self, trace, stage):
+        self.trace = trace
+        self.stage = stage
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+
+    def __exit__(self, *exc):
+        self.trace.add(self.stage, time.perf_counter() - self.start)
+
+
+class _NullTrace:
+    """Stand-in used while tracing is off"""
+    trace_id = None
+    type = None
+
+    def add(self, stage, seconds):
+        pass
+
+    def span(self, stage):
+        return _NULL_SPAN
+
+    def finish(self):
+        pass
+
+
+class _NullSpan:
+    def __enter__(self):
+        pass
+
+    def __exit__(self, *exc):
+        pass
+
+
+_NULL_SPAN = _NullSpan()
+NULL_TRACE = _NullTrace()
+
+
+def start():
+    """Begin a trace for one message (a no-op trace while disabled)"""
+    return Trace() if enabled else NULL_TRACE
+
+
+def set_enabled(value):
+    global enabled
+    enabled = bool(value)
+    print(f" Tracing {'enabled' if enabled else 'disabled'}")
+
+
+# Sampling profiler
+
+_profile_lock = threading.Lock()
+_profiling = False
+
+
+def _frame_name(frame):
+    code = frame.f_code
+    return f"{code.co_name} ({os.path.basename(code.co_filename)})"
+
+
+def sample_stacks(seconds, interval):
+    """Sample all threads for `seconds`; returns Counter of collapsed stacks"""
+    stacks = Counter()
+    me = threading.get_ident()
+    names = {}
+    deadline = time.perf_counter() + seconds
+    while time.perf_counter() < deadline:
+        for thread in threading.enumerate():
+            names[thread.ident] = thread.name
+        for ident, frame in sys._current_frames().items():
+            if ident == me:
+                continue
+            parts = []
+            while frame is not None:
+                parts.append(_frame_name(frame))
+                frame = frame.f_back
+            parts.append(names.get(ident, f"thread-{ident}"))
+            stacks[";".join(reversed(parts))] += 1
+        time.sleep(interval)
+    return stacks
+
+
+def _run_profile(seconds, interval, path):
+    global _profiling
+    try:
+        stacks = sample_stacks(seconds, interval)
+        with open(path, "w") as f:
+            for stack, count in stacks.most_common():
+                f.write(f"{stack} {count}\n")
+        print(f" Profile written to {path} ({sum(stacks.values())} samples)")
+    finally:
+        with _profile_lock:
+            _profiling = False
+
+
+def start_profile(seconds=10, interval=0.005):
+    """Profile in the background; returns the output path, or None if busy"""
+    global _profiling
+    with _profile_lock:
+        if _profiling:
+            return None
+        _profiling = True
+
+    os.makedirs(PROFILES_DIR, exist_ok=True)
+    path = os.path.join(PROFILES_DIR, f"profile-{time.strftime('%Y%m%d-%H%M%S')}-{os.getpid()}.folded")
+    threading.Thread(target=_run_profile, args=(seconds, interval, path), daemon=True).start()
+    return path
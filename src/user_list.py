@@ -0,0 +1,177 @@
+from bisect import bisect_left, insort
+
+from PyQt5.QtCore import QAbstractListModel, QModelIndex, Qt, pyqtSignal
+from PyQt5.QtWidgets import QAbstractItemView, QListView
+
+RESET_THRESHOLD = 0.5  # Changed fraction of the rows beyond which one reset beats row updates
+
+
+def sort_key(username):
+    return (username.casefold(), username)
+
+
+def ranges(rows):
+    """Group sorted row numbers into (first, last) runs of consecutive rows"""
+    runs = []
+    for row in rows:
+        if runs and row == runs[-1][1] + 1:
+            runs[-1][1] = row
+        else:
+            runs.append([row, row])
+    return runs
+
+
+class UserListModel(QAbstractListModel):
+    """Online users, sorted and filtered by a case-insensitive substring.
+
+    A new status list is applied as row inserts and removals, so views keep
+    their selection and scroll position. Filtering runs here over the
+    precomputed casefolded names rather than in a QSortFilterProxyModel,
+    which would call data() once per row from C++ on every keystroke.
+    """
+
+    def __init__(self, exclude=None):
+        super().__init__()
+        self.exclude = exclude  # Our own name, never listed
+        self.online = set()  # Usernames of all online users
+        self.everyone = []  # Their sort_key()s, sorted
+        self.filter = ""  # Casefolded
+        self.keys = []  # sort_key of the listed (matching) users, sorted
+        self.names = []  # Their usernames, one per row
+
+    def rowCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self.names)
+
+    def data(self, index, role=Qt.DisplayRole):
+        if not index.isValid():
+            return None
+        name = self.names[index.row()]
+        if role == Qt.DisplayRole:
+            return f"🟢 {name}"
+        if role in (Qt.UserRole, Qt.ToolTipRole):
+            return name
+        return None
+
+    def index_of(self, username):
+        """Index of username's row, or an invalid index if not listed"""
+        key = sort_key(username)
+        row = bisect_left(self.keys, key)
+        if row < len(self.keys) and self.keys[row] == key:
+            return self.index(row, 0)
+        return QModelIndex()
+
+    def total(self):
+        return len(self.online)
+
+    def matches(self, key):
+        return self.filter in key[0]
+
+    def reset(self, keys):
+        self.beginResetModel()
+        self.keys = keys
+        self.names = [name for _, name in keys]
+        self.endResetModel()
+
+    def set_filter(self, text):
+        text = text.casefold()
+        if text == self.filter:
+            return
+        narrower = text.startswith(self.filter)
+        self.filter = text
+        # Narrowing only needs to look at what is listed now
+        source = self.keys if narrower else self.everyone
+        self.reset([key for key in source if text in key[0]])
+
+    def set_users(self, users):
+        wanted = set(users)
+        wanted.discard(self.exclude)
+        removed = [sort_key(name) for name in self.online - wanted]
+        added = [sort_key(name) for name in wanted - self.online]
+        if not removed and not added:
+            return
+        mass = len(removed) + len(added) > RESET_THRESHOLD * max(len(self.online), 1)
+        self.online = wanted
+        if mass:
+            # Initial fill or a mass change: one reset is cheaper
+            self.everyone = sorted(sort_key(name) for name in wanted)
+            self.reset([key for key in self.everyone if self.matches(key)])
+            return
+
+        for key in removed:
+            del self.everyone[bisect_left(self.everyone, key)]
+        for key in added:
+            insort(self.everyone, key)
+
+        # Listed rows: removals from the bottom up, so earlier row numbers stay valid
+        gone = sorted(bisect_left(self.keys, key) for key in removed if self.matches(key))
+        for first, last in reversed(ranges(gone)):
+            self.beginRemoveRows(QModelIndex(), first, last)
+            del self.keys[first:last + 1]
+            del self.names[first:last + 1]
+            self.endRemoveRows()
+
+        for key in sorted(key for key in added if self.matches(key)):
+            row = bisect_left(self.keys, key)
+            self.beginInsertRows(QModelIndex(), row, row)
+            self.keys.insert(row, key)
+            self.names.insert(row, key[1])
+            self.endInsertRows()
+
+
+class UserListView(QListView):
+    """List view over a UserListModel that keeps the selection on a user.
+
+    The user picked last stays selected through set_users() and
+    set_filter(); when they are removed or filtered out the selection is
+    cleared instead of moving to a neighbour, and comes back with them.
+    Type-ahead goes to the filter box (typed signal) instead of jumping to
+    a match.
+    """
+
+    typed = pyqtSignal(str)
+
+    def __init__(self, model):
+        super().__init__()
+        self.setUniformItemSizes(True)  # Lets Qt skip measuring every row of long lists
+        self.setSelectionMode(QAbstractItemView.SingleSelection)
+        self.setEditTriggers(QAbstractItemView.NoEditTriggers)
+        # Lay out long lists a batch per event-loop turn instead of all at once
+        self.setLayoutMode(QListView.Batched)
+        self.setModel(model)
+        self.chosen = None
+        self.updating = False  # Current-row changes now come from the model, not the user
+        self.selectionModel().currentChanged.connect(self.remember_current)
+
+    def keyboardSearch(self, search):
+        self.typed.emit(search)
+
+    def remember_current(self, index):
+        if index.isValid() and not self.updating:
+            self.chosen = index.data(Qt.UserRole)
+
+    def selected_user(self):
+        index = self.currentIndex()
+        if not index.isValid() or not self.selectionModel().isSelected(index):
+            return None
+        return index.data(Qt.UserRole)
+
+    def update_rows(self, change):
+        """Run change() on the model, then put the selection back on the
+        chosen user (Qt moves it to a neighbour when its row goes away)"""
+        self.updating = True
+        try:
+            change()
+            if self.chosen and self.selected_user() != self.chosen:
+                index = self.model().index_of(self.chosen)
+                if index.isValid():
+                    self.setCurrentIndex(index)
+                else:
+                    self.selectionModel().clear()
+        finally:
+            self.updating = False
+
+    def set_users(self, users):
+        self.update_rows(lambda: self.model().set_users(users))
+
+    def set_filter(self, text):
+        self.update_rows(lambda: self.model().set_filter(text))